@@ -0,0 +1,74 @@
+"""
+簡繁轉換微基準測試
+比較每次呼叫 OpenCC 與查對照表（modules.lunar.converter）的耗時。
+
+執行方式（於 backend 目錄）：
+    python -m benchmarks.bench_opencc
+"""
+
+import argparse
+import time
+from datetime import date, timedelta
+from typing import Callable, List
+
+from lunar_python import Solar
+from opencc import OpenCC
+
+from modules.lunar.converter import to_traditional
+
+
+def collect_strings(days: int) -> List[str]:
+    """收集 get_lunar_info 在 days 天內會送去轉換的所有字串"""
+    strings: List[str] = []
+    start = date(2025, 1, 1)
+    for offset in range(days):
+        d = start + timedelta(days=offset)
+        lunar = Solar.fromYmd(d.year, d.month, d.day).getLunar()
+        strings.append(lunar.toString())
+        strings.append(lunar.getJieQi())
+        strings.extend(lunar.getDayYi())
+        strings.extend(lunar.getDayJi())
+        strings.append(lunar.getChongDesc())
+        strings.append(lunar.getYearInGanZhi())
+        strings.append(lunar.getMonthInGanZhi())
+        strings.append(lunar.getDayInGanZhi())
+        strings.append(lunar.getYearShengXiao())
+    return strings
+
+
+def measure(convert: Callable[[str], str], strings: List[str], repeat: int) -> float:
+    """回傳最佳一輪的每字串耗時（微秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in strings:
+            convert(text)
+        best = min(best, time.perf_counter() - start)
+    return best / len(strings) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenCC 對照表微基準測試")
+    parser.add_argument("--days", type=int, default=365, help="收集字串的天數")
+    parser.add_argument("--repeat", type=int, default=5, help="重複次數（取最佳值）")
+    args = parser.parse_args()
+
+    strings = collect_strings(args.days)
+    cc = OpenCC('s2t')
+
+    # 確認兩種方式結果一致
+    mismatches = [s for s in strings if cc.convert(s) != to_traditional(s)]
+    if mismatches:
+        raise SystemExit(f"轉換結果不一致: {mismatches[:5]}")
+
+    baseline = measure(cc.convert, strings, args.repeat)
+    cached = measure(to_traditional, strings, args.repeat)
+
+    print(f"字串數量: {len(strings)}（{args.days} 天）")
+    print(f"OpenCC.convert : {baseline:8.3f} µs/字串")
+    print(f"to_traditional : {cached:8.3f} µs/字串")
+    print(f"加速倍數       : {baseline / cached:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
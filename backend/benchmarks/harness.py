@@ -0,0 +1,160 @@
+"""
+基準測試的共用工具：計時、百分位數、峰值記憶體與結果的 JSON 存檔與比較
+"""
+
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import unicodedata
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Callable, List, Optional
+
+
+@dataclass
+class BenchResult:
+    name: str
+    iterations: int
+    ops_per_iteration: int
+    total_seconds: float
+    throughput: float  # 每秒完成的操作數
+    mean_ms: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    min_ms: float
+    max_ms: float
+    peak_memory_kb: float  # 單次執行期間 tracemalloc 的峰值
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """線性內插的百分位數，sorted_values 需已排序"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def run_bench(
+    name: str,
+    fn: Callable[[], object],
+    iterations: int,
+    warmup: int = 1,
+    ops: int = 1,
+    setup: Optional[Callable[[], object]] = None,
+) -> BenchResult:
+    """
+    執行 fn 共 iterations 次並記錄每次的延遲；setup 於每次執行前呼叫且不計時（如清除快取）。
+    峰值記憶體另外以 tracemalloc 量測一次，避免追蹤成本影響延遲數據。
+    """
+    for _ in range(warmup):
+        if setup:
+            setup()
+        fn()
+
+    latencies = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+    total = sum(latencies)
+    return BenchResult(
+        name=name,
+        iterations=iterations,
+        ops_per_iteration=ops,
+        total_seconds=total,
+        throughput=iterations * ops / total if total else 0.0,
+        mean_ms=total / iterations * 1000,
+        p50_ms=percentile(latencies, 0.50) * 1000,
+        p95_ms=percentile(latencies, 0.95) * 1000,
+        p99_ms=percentile(latencies, 0.99) * 1000,
+        min_ms=latencies[0] * 1000,
+        max_ms=latencies[-1] * 1000,
+        peak_memory_kb=peak / 1024,
+    )
+
+
+def _ljust(text: str, width: int) -> str:
+    """依顯示寬度補空白（全形字元佔兩格）"""
+    display = sum(2 if unicodedata.east_asian_width(ch) in "WF" else 1 for ch in text)
+    return text + " " * max(width - display, 0)
+
+
+def print_results(results: List[BenchResult]) -> None:
+    header = (
+        f"{_ljust('名稱', 32)}{'次數':>4}{'ops/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  峰值 KB"
+    )
+    print(header)
+    print("-" * 90)
+    for r in results:
+        print(
+            f"{_ljust(r.name, 32)}{r.iterations:>6}{r.throughput:>12.1f}"
+            f"{r.p50_ms:>10.3f}{r.p95_ms:>10.3f}{r.p99_ms:>10.3f}{r.peak_memory_kb:>11.1f}"
+        )
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def environment() -> dict:
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def save_results(results: List[BenchResult], path: Optional[str] = None, directory: str = "benchmarks/results") -> str:
+    """將結果與執行環境存成 JSON，預設檔名含時間與 commit"""
+    meta = environment()
+    if path is None:
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(directory, f"{stamp}-{meta['commit']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": [asdict(r) for r in results]}, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def compare_results(results: List[BenchResult], baseline_path: str) -> None:
+    """與先前存檔比較 p50 與吞吐量的變化（負的 p50 變化代表變快）"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {r["name"]: r for r in baseline["results"]}
+    print(f"\n與 {baseline_path}（commit {baseline['meta'].get('commit')}）比較：")
+    print(f"{_ljust('名稱', 32)}{'p50 前':>9}{'p50 後':>9}{'變化':>7}  吞吐量變化")
+    for r in results:
+        old = previous.get(r.name)
+        if old is None:
+            print(f"{_ljust(r.name, 32)}{'—':>10}{r.p50_ms:>10.3f}")
+            continue
+        p50_delta = (r.p50_ms - old["p50_ms"]) / old["p50_ms"] * 100 if old["p50_ms"] else 0.0
+        tp_delta = (r.throughput - old["throughput"]) / old["throughput"] * 100 if old["throughput"] else 0.0
+        print(f"{_ljust(r.name, 32)}{old['p50_ms']:>10.3f}{r.p50_ms:>10.3f}{p50_delta:>+8.1f}%{tp_delta:>+10.1f}%")
@@ -0,0 +1,221 @@
+"""
+Gemini 與 TEI 的本機替身伺服器
+回應內容由輸入的雜湊決定，不連網即可重現 RAG 路徑的耗時；
+延遲（首字時間）與生成速度（token/秒）可設定，用於模擬真實服務的等待時間。
+
+- FakeGemini：實作 google-genai SDK 使用的 REST 介面
+  （GET /v1beta/models/{model}、POST :generateContent、POST :streamGenerateContent?alt=sse）；
+  要求 JSON 輸出（responseSchema）時回傳符合該 schema 的 JSON
+- FakeTEI：實作 text-embeddings-inference 的 POST /embed，以字元雙字組雜湊產生固定維度向量，
+  字面相近的文字得到相近的向量，檢索結果仍有意義
+"""
+
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+DEFAULT_EMBED_DIM = 384
+
+
+def hashed_embedding(text: str, dim: int = DEFAULT_EMBED_DIM) -> List[float]:
+    """以字元雙字組的雜湊累加成向量並正規化"""
+    vector = [0.0] * dim
+    grams = [text[i:i + 2] for i in range(max(len(text) - 1, 1))]
+    for gram in grams:
+        digest = hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % dim
+        sign = 1.0 if digest[4] & 1 else -1.0
+        vector[index] += sign
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def fake_reply(prompt: str, words: int = 80) -> str:
+    """依提示詞雜湊產生固定長度的回覆"""
+    seed = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return "（模擬回覆 " + seed[:8] + "）" + "感謝您的提問，" * (words // 7)
+
+
+def fake_json(schema: dict, prompt: str):
+    """
+    依 Gemini 的 responseSchema 產生符合結構的值：有預設值的欄位沿用預設值，
+    沒有預設值的字串以 fake_reply 填入（如回覆內容）
+    """
+    kind = str(schema.get("type", "OBJECT")).upper()
+    if "default" in schema:
+        return schema["default"]
+    if kind == "OBJECT":
+        return {
+            name: fake_json(child, prompt + name)
+            for name, child in (schema.get("properties") or {}).items()
+        }
+    if kind == "ARRAY":
+        return []
+    if kind in ("INTEGER", "NUMBER"):
+        return 0
+    if kind == "BOOLEAN":
+        return False
+    return fake_reply(prompt)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status: int = 200):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeGeminiHandler(StubHandler):
+    # 首字延遲（秒）與生成速度（每秒 token 數，0 表示立即完成）；以 configure() 產生不同設定的子類別
+    latency = 0.0
+    tokens_per_second = 0.0
+    # 以 429 拒絕的請求比例與回應的 Retry-After 秒數，模擬供應商限速
+    throttle_ratio = 0.0
+    retry_after = 1
+
+    def _generation_time(self, text: str) -> float:
+        # 中文約一字一 token
+        return len(text) / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def do_GET(self):
+        # /v1beta/models/{model}
+        model = self.path.split("?", 1)[0].rsplit("/", 1)[-1]
+        self._send_json({
+            "name": f"models/{model}",
+            "displayName": model,
+            "inputTokenLimit": 1048576,
+            "outputTokenLimit": 65536,
+            "supportedGenerationMethods": ["generateContent", "countTokens"],
+        })
+
+    def do_POST(self):
+        request = self._read_json()
+        if self.throttle_ratio and random.random() < self.throttle_ratio:
+            body = b'{"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}'
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Retry-After", str(self.retry_after))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        prompt = "".join(
+            part.get("text", "")
+            for content in request.get("contents", [])
+            for part in content.get("parts", [])
+        )
+        config = request.get("generationConfig") or {}
+        schema = config.get("responseSchema") or config.get("responseJsonSchema")
+        if schema:
+            text = json.dumps(fake_json(schema, prompt), ensure_ascii=False)
+        else:
+            text = fake_reply(prompt)
+        if self.latency:
+            time.sleep(self.latency)
+        if ":streamGenerateContent" in self.path:
+            self._stream(text, prompt)
+        else:
+            time.sleep(self._generation_time(text))
+            self._send_json(self._response(text, prompt))
+
+    def _response(self, text: str, prompt: str, finish: Optional[str] = "STOP") -> dict:
+        candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+        if finish:
+            candidate["finishReason"] = finish
+        return {
+            "candidates": [candidate],
+            "usageMetadata": {
+                "promptTokenCount": len(prompt),
+                "candidatesTokenCount": len(text),
+                "totalTokenCount": len(prompt) + len(text),
+            },
+            "modelVersion": "fake-gemini",
+        }
+
+    def _stream(self, text: str, prompt: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        chunk_size = 16
+        chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)] or [""]
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(self._generation_time(chunk))
+            finish = "STOP" if i == len(chunks) - 1 else None
+            data = json.dumps(self._response(chunk, prompt, finish), ensure_ascii=False)
+            self.wfile.write(f"data: {data}\r\n\r\n".encode("utf-8"))
+            self.wfile.flush()
+        self.close_connection = True
+
+
+class FakeTEIHandler(StubHandler):
+    dim = DEFAULT_EMBED_DIM
+    # 每次請求的固定延遲與每筆輸入的額外延遲（秒）
+    latency = 0.0
+    per_input_latency = 0.0
+
+    def do_POST(self):
+        request = self._read_json()
+        inputs = request.get("inputs", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        delay = self.latency + self.per_input_latency * len(inputs)
+        if delay:
+            time.sleep(delay)
+        self._send_json([hashed_embedding(text, self.dim) for text in inputs])
+
+
+def configure(handler, **settings):
+    """產生套用指定設定（如 latency、tokens_per_second）的處理器子類別"""
+    return type(handler.__name__, (handler,), settings)
+
+
+class StubServer:
+    """
+    在背景執行緒啟動替身伺服器，可作為 context manager 使用：
+
+        with StubServer(FakeGeminiHandler) as gemini:
+            os.environ["GEMINI_BASE_URL"] = gemini.url
+    """
+
+    def __init__(self, handler, host: str = "127.0.0.1", port: int = 0):
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
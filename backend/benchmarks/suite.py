@@ -0,0 +1,257 @@
+"""
+可離線執行的基準測試組
+涵蓋單日農曆查詢、1 年與 10 年吉日掃描、批次祭祀日期、1,000 筆事件的 ICS 匯出、
+各骨灰罐樣板的渲染，以及對本機 Gemini／TEI 替身伺服器的 RAG 對話。
+結果（吞吐量、延遲百分位數、峰值記憶體）輸出為表格並存成 JSON，可與先前的存檔比較。
+
+執行方式（於 backend 目錄）：
+    python -m benchmarks.suite
+    python -m benchmarks.suite --quick --only lunar scan
+    python -m benchmarks.suite --compare benchmarks/results/<先前結果>.json
+"""
+
+import argparse
+import asyncio
+import io
+import itertools
+import os
+import tempfile
+import uuid
+from datetime import date, timedelta
+from typing import Callable, Dict, List
+
+from .harness import BenchResult, compare_results, print_results, run_bench, save_results
+
+
+def _dates(start: date, days: int) -> List[str]:
+    return [(start + timedelta(days=i)).isoformat() for i in range(days)]
+
+
+def bench_lunar(scale: float) -> List[BenchResult]:
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from modules.lunar.cache import lunar_info_cache
+    from modules.lunar.http_cache import body_cache
+    from modules.lunar.router import compute_month_grid, get_lunar_info, router
+
+    dates = itertools.cycle(_dates(date(2025, 1, 1), 3650))
+    results = [
+        run_bench(
+            "lunar.day.cold",
+            lambda: get_lunar_info(next(dates)),
+            iterations=int(500 * scale),
+            setup=lunar_info_cache.clear,
+        ),
+        run_bench(
+            "lunar.day.warm",
+            lambda: get_lunar_info("2025-06-16"),
+            iterations=int(5000 * scale),
+        ),
+    ]
+
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+    client = TestClient(app)
+    results.append(run_bench(
+        "lunar.http",
+        lambda: client.get(f"/api/lunar?date={next(dates)}"),
+        iterations=int(500 * scale),
+    ))
+
+    months = itertools.cycle([(2025 + i // 12, i % 12 + 1) for i in range(120)])
+    results.append(run_bench(
+        "lunar.month_grid.cold",
+        lambda: compute_month_grid(*next(months)),
+        iterations=int(100 * scale),
+        setup=lunar_info_cache.clear,
+    ))
+    results.append(run_bench(
+        "lunar.month_grid.http",
+        lambda: client.get("/api/lunar/month?year={}&month={}".format(*next(months))),
+        iterations=int(500 * scale),
+        setup=body_cache.clear,
+    ))
+    return results
+
+
+def bench_scan(scale: float) -> List[BenchResult]:
+    from modules.auspicious_days.service import AuspiciousDayService
+    from modules.lunar.cache import lunar_info_cache
+    from modules.models import AuspiciousDayRequest
+
+    service = AuspiciousDayService()
+    loop = asyncio.new_event_loop()
+
+    def scan(years: int) -> Callable[[], object]:
+        start = date(2025, 1, 1)
+        request = AuspiciousDayRequest(
+            亡者生肖="鼠",
+            亡者歿日=start,
+            家屬生肖=["牛", "虎"],
+            查詢起始日期=start,
+            查詢結束日期=start + timedelta(days=365 * years - 1),
+        )
+        return lambda: loop.run_until_complete(service.recommend_dates(request))
+
+    try:
+        return [
+            run_bench("scan.1y.cold", scan(1), iterations=max(int(10 * scale), 2),
+                      ops=365, setup=lunar_info_cache.clear),
+            run_bench("scan.1y.warm", scan(1), iterations=max(int(20 * scale), 2), ops=365),
+            run_bench("scan.10y.cold", scan(10), iterations=max(int(3 * scale), 1),
+                      warmup=0, ops=3650, setup=lunar_info_cache.clear),
+        ]
+    finally:
+        loop.close()
+
+
+def bench_ritual(scale: float) -> List[BenchResult]:
+    from modules.lunar.router import compute_ritual_dates
+
+    death_dates = _dates(date(2020, 1, 1), 1000)
+
+    def batch():
+        for d in death_dates:
+            compute_ritual_dates(d, traditional=True)
+
+    return [run_bench("ritual_dates.batch1000", batch, iterations=max(int(10 * scale), 2), ops=len(death_dates))]
+
+
+def bench_ics(scale: float) -> List[BenchResult]:
+    from modules.lunar.router import IcsExportRequest, export_ritual_dates_ics
+
+    events = {f"事件{i:04d}": d for i, d in enumerate(_dates(date(2025, 1, 1), 1000))}
+    request = IcsExportRequest(events=events)
+    return [run_bench("ics.export1000", lambda: export_ritual_dates_ics(request),
+                      iterations=max(int(5 * scale), 2), ops=len(events))]
+
+
+def bench_urn(scale: float) -> List[BenchResult]:
+    from PIL import Image
+    from modules.urn.render_cache import OUTPUT_FORMATS, DEFAULT_QUALITY, encode_image
+    from modules.urn.router import URN_PHOTO_DIR, generate_design_image
+    from modules.urn.templates import get_font, layout_for
+    from modules.urn.uploads import max_portrait_size, normalize_portrait
+
+    try:
+        get_font()
+    except RuntimeError as e:
+        # 碑文字型不隨原始碼提供，未設定 URN_FONT_PATH 時略過
+        print(f"略過 urn：{e}", flush=True)
+        return []
+
+    # 以合成的遺像避免依賴使用者上傳的檔案
+    source = io.BytesIO()
+    Image.new("RGB", (1200, 1600), (180, 160, 140)).save(source, format="JPEG")
+    source.seek(0)
+    portrait = normalize_portrait(source, "JPEG", max_portrait_size())
+
+    fmt = OUTPUT_FORMATS["webp"]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        portrait_path = os.path.join(tmp, "portrait.png")
+        with open(portrait_path, "wb") as f:
+            f.write(portrait)
+        for filename in sorted(os.listdir(URN_PHOTO_DIR)):
+            try:
+                layout_for(filename)
+            except ValueError:
+                continue
+            urn_path = os.path.join(URN_PHOTO_DIR, filename)
+
+            def render(urn_path=urn_path):
+                image = generate_design_image(urn_path, portrait_path, "王大明", "1950-01-01", "2025-06-16")
+                return encode_image(image, fmt, DEFAULT_QUALITY)
+
+            name = filename.rsplit(".", 1)[0]
+            results.append(run_bench(f"urn.render.{name}", render, iterations=max(int(20 * scale), 2)))
+    return results
+
+
+def bench_rag(scale: float) -> List[BenchResult]:
+    from .stubs import FakeGeminiHandler, FakeTEIHandler, StubServer, hashed_embedding
+
+    questions = itertools.cycle([
+        "入殮時應注意什麼？",
+        "對年要怎麼計算？",
+        "龍巖有哪些生前契約方案？",
+        "重喪日是什麼意思？",
+    ])
+    with StubServer(FakeGeminiHandler) as gemini, StubServer(FakeTEIHandler) as tei, \
+            tempfile.TemporaryDirectory() as storage:
+        # modules.utils 在匯入時讀取這些設定，必須先設定環境變數
+        os.environ.update({
+            "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY", "benchmark"),
+            "GEMINI_BASE_URL": gemini.url,
+            "TEI_BASE_URL": tei.url,
+            "EMBEDDING_MODEL_ID": os.environ.get("EMBEDDING_MODEL_ID", "fake-embedding"),
+            "RAG_STORAGE_DIR": storage,
+            "SHARED_STATE_URL": f"sqlite:///{os.path.join(storage, 'shared_state.db')}",
+            # 量測單次延遲，不受 LLM Gateway 的限速影響
+            "GEMINI_RPS": "1000",
+            "GEMINI_BURST": "1000",
+        })
+        from llama_index.core import StorageContext, load_index_from_storage
+        from llama_index.core.vector_stores import VectorStoreQuery
+        from modules.utils import create_rag_engine, initialize_shared_components, load_vector_store
+
+        engine = create_rag_engine(system_prompt="你是 LegacyGuide 殯葬禮儀顧問。")
+        vector_store = initialize_shared_components()[0].vector_store
+        vector_query = VectorStoreQuery(query_embedding=hashed_embedding("對年要怎麼計算？"), similarity_top_k=5)
+        session = {}
+
+        def load_index():
+            return load_index_from_storage(
+                StorageContext.from_defaults(persist_dir=storage, vector_store=load_vector_store(storage))
+            )
+
+        def follow_up_setup():
+            # 每次量測前開一個已有一輪對話的新 session
+            session["id"] = uuid.uuid4().hex
+            engine.chat("請問喪禮流程有哪些？", session_id=session["id"])
+
+        return [
+            run_bench("rag.index.load", load_index, iterations=max(int(5 * scale), 2)),
+            run_bench("rag.vector.query", lambda: vector_store.query(vector_query),
+                      iterations=max(int(1000 * scale), 10)),
+            run_bench("rag.chat.first_turn", lambda: engine.chat(next(questions)),
+                      iterations=max(int(30 * scale), 3)),
+            run_bench("rag.chat.follow_up", lambda: engine.chat(next(questions), session_id=session["id"]),
+                      iterations=max(int(30 * scale), 3), setup=follow_up_setup),
+        ]
+
+
+BENCHMARKS: Dict[str, Callable[[float], List[BenchResult]]] = {
+    "lunar": bench_lunar,
+    "scan": bench_scan,
+    "ritual": bench_ritual,
+    "ics": bench_ics,
+    "urn": bench_urn,
+    "rag": bench_rag,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LegacyGuide 後端基準測試")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="只執行指定的項目")
+    parser.add_argument("--quick", action="store_true", help="減少重複次數，快速檢查")
+    parser.add_argument("--output", help="結果 JSON 路徑（預設存於 benchmarks/results/）")
+    parser.add_argument("--compare", help="與先前的結果 JSON 比較")
+    args = parser.parse_args()
+
+    scale = 0.2 if args.quick else 1.0
+    results: List[BenchResult] = []
+    for name in args.only or BENCHMARKS:
+        print(f"執行 {name} ...", flush=True)
+        results.extend(BENCHMARKS[name](scale))
+
+    print()
+    print_results(results)
+    path = save_results(results, args.output)
+    print(f"\n結果已存至 {path}")
+    if args.compare:
+        compare_results(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+正式環境的多 worker 設定：
+    gunicorn -c gunicorn.conf.py main:app
+
+- master 先匯入 main:app 並預先載入唯讀資料，再 fork 出 worker（copy-on-write 共用記憶體）
+- 對話紀錄存放於 SHARED_STATE_URL 指定的共用儲存，農曆快取以 LUNAR_CACHE_DB 在 worker 間共用
+
+環境變數：
+- WEB_CONCURRENCY：worker 數（預設為 CPU 核心數）
+- PORT：監聽埠號（預設 8000）
+- GUNICORN_PRELOAD：設為 0 時各 worker 自行載入（預設 1）
+- GUNICORN_TIMEOUT：worker 無回應多少秒後重啟（預設 120，需涵蓋 LLM 回應時間）
+"""
+
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+# 定期輪替 worker，避免長時間執行後記憶體逐漸膨脹；加入抖動避免同時重啟
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "5000"))
+max_requests_jitter = max_requests // 10
+accesslog = "-"
+
+# 多 worker 共用的狀態預設放在 ./state 下
+os.environ.setdefault("LUNAR_CACHE_DB", "./state/lunar_cache.db")
+os.environ.setdefault("SHARED_STATE_URL", "sqlite:///./state/shared_state.db")
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from modules.preload import preload_read_only_state
+
+    preload_read_only_state()
+    # 將目前所有物件移出 GC 追蹤範圍，避免 worker 的垃圾回收寫入這些頁面而破壞 copy-on-write
+    gc.freeze()
+    server.log.info(f"已預先載入唯讀資料，凍結 {gc.get_freeze_count()} 個物件")
@@ -0,0 +1,7 @@
+"""
+壓力測試工具
+以本機替身取代 Gemini、TEI 與火化場網站，依情境檔對 main:app 施加混合流量，
+找出單一 uvicorn worker 的飽和點。
+
+    python -m loadtest.runner --scenario loadtest/scenario.json
+"""
@@ -0,0 +1,132 @@
+"""
+壓力測試用的外部服務替身
+- Gemini、TEI：沿用 benchmarks.stubs，可設定延遲與生成速度
+- 火化場網站：回傳 loadtest/fixtures 下的靜態頁面（高雄火化名冊、桃園預約查詢），可設定頁面延遲
+
+單獨啟動（供另外執行的 uvicorn 使用）：
+    python -m loadtest.fakes --gemini-latency 0.8 --gemini-tps 120
+"""
+
+import argparse
+import os
+import time
+from contextlib import ExitStack
+from typing import Dict
+
+from benchmarks.stubs import FakeGeminiHandler, FakeTEIHandler, StubHandler, StubServer, configure
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# 與正式網站相同的路徑，crawler 只需替換主機位址
+KAOHSIUNG_PATH = "/04/P04S03A-view.aspx"
+TAOYUAN_PATH = "/Qdata/taoyuan-page4.aspx"
+FIXTURE_PAGES = {
+    KAOHSIUNG_PATH: "kaohsiung.html",
+    TAOYUAN_PATH: "taoyuan.html",
+}
+
+
+class FakeCrematoriumHandler(StubHandler):
+    latency = 0.0
+
+    def do_GET(self):
+        fixture = FIXTURE_PAGES.get(self.path.split("?", 1)[0])
+        if fixture is None:
+            self.send_error(404)
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        with open(os.path.join(FIXTURE_DIR, fixture), "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeServices:
+    """
+    同時啟動三個替身伺服器，environment() 回傳讓 main:app 改連替身所需的環境變數：
+
+        with FakeServices(gemini_latency=0.8) as fakes:
+            env = {**os.environ, **fakes.environment()}
+    """
+
+    def __init__(
+        self,
+        gemini_latency: float = 0.0,
+        gemini_tokens_per_second: float = 0.0,
+        tei_latency: float = 0.0,
+        tei_per_input_latency: float = 0.0,
+        crematorium_latency: float = 0.0,
+        host: str = "127.0.0.1",
+        ports: Dict[str, int] = None,
+    ):
+        ports = ports or {}
+        self.gemini = StubServer(
+            configure(FakeGeminiHandler, latency=gemini_latency, tokens_per_second=gemini_tokens_per_second),
+            host, ports.get("gemini", 0),
+        )
+        self.tei = StubServer(
+            configure(FakeTEIHandler, latency=tei_latency, per_input_latency=tei_per_input_latency),
+            host, ports.get("tei", 0),
+        )
+        self.crematorium = StubServer(
+            configure(FakeCrematoriumHandler, latency=crematorium_latency),
+            host, ports.get("crematorium", 0),
+        )
+        self._stack = ExitStack()
+
+    def environment(self) -> Dict[str, str]:
+        return {
+            "GEMINI_API_KEY": os.environ.get("GEMINI_API_KEY", "loadtest"),
+            "GEMINI_BASE_URL": self.gemini.url,
+            "TEI_BASE_URL": self.tei.url,
+            "EMBEDDING_MODEL_ID": os.environ.get("EMBEDDING_MODEL_ID", "fake-embedding"),
+            "KAOHSIUNG_SCHEDULE_URL": self.crematorium.url + KAOHSIUNG_PATH,
+            "TAOYUAN_SCHEDULE_URL": self.crematorium.url + TAOYUAN_PATH,
+        }
+
+    def __enter__(self) -> "FakeServices":
+        for server in (self.gemini, self.tei, self.crematorium):
+            self._stack.enter_context(server)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stack.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="啟動 Gemini、TEI 與火化場網站的本機替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--gemini-port", type=int, default=9101)
+    parser.add_argument("--tei-port", type=int, default=9102)
+    parser.add_argument("--crematorium-port", type=int, default=9103)
+    parser.add_argument("--gemini-latency", type=float, default=0.0, help="Gemini 首字延遲（秒）")
+    parser.add_argument("--gemini-tps", type=float, default=0.0, help="Gemini 生成速度（token/秒，0 為立即）")
+    parser.add_argument("--tei-latency", type=float, default=0.0, help="TEI 每次請求延遲（秒）")
+    parser.add_argument("--crematorium-latency", type=float, default=0.0, help="火化場頁面延遲（秒）")
+    args = parser.parse_args()
+
+    fakes = FakeServices(
+        gemini_latency=args.gemini_latency,
+        gemini_tokens_per_second=args.gemini_tps,
+        tei_latency=args.tei_latency,
+        crematorium_latency=args.crematorium_latency,
+        host=args.host,
+        ports={"gemini": args.gemini_port, "tei": args.tei_port, "crematorium": args.crematorium_port},
+    )
+    with fakes:
+        print("替身伺服器已啟動，請以下列環境變數啟動後端：")
+        for key, value in fakes.environment().items():
+            print(f"export {key}={value}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+依情境檔對後端施加混合流量，逐步提高併發數，找出吞吐量不再成長的飽和點。
+
+預設會啟動 Gemini／TEI／火化場替身，並以單一 worker 的 uvicorn 子行程執行 main:app：
+    python -m loadtest.runner --scenario loadtest/scenario.json --concurrency 1,2,4,8,16,32 --duration 20
+
+加上 --workers N（N > 1）改以 gunicorn.conf.py 的多 worker 模式啟動，比較吞吐量隨 worker 數的成長：
+    python -m loadtest.runner --workers 4 --only lunar_day ritual_dates
+
+也可對已在執行的後端施壓（該後端需自行設定替身的環境變數，見 python -m loadtest.fakes）：
+    python -m loadtest.runner --base-url http://127.0.0.1:8000
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.harness import environment, percentile
+from .fakes import FakeServices
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 吞吐量成長低於此比例即視為飽和
+SATURATION_GAIN = 0.05
+
+
+@dataclass
+class EndpointStats:
+    count: int
+    errors: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+
+
+@dataclass
+class StepResult:
+    concurrency: int
+    duration_seconds: float
+    requests: int
+    errors: int
+    throughput: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    endpoints: Dict[str, EndpointStats] = field(default_factory=dict)
+
+
+class Scenario:
+    """情境檔：變數定義與加權的請求範本"""
+
+    def __init__(self, data: dict):
+        self.description = data.get("description", "")
+        self.fakes = data.get("fakes", {})
+        self.variables = data.get("variables", {})
+        self.requests = data["requests"]
+        self.weights = [r.get("weight", 1) for r in self.requests]
+
+    @classmethod
+    def load(cls, path: str) -> "Scenario":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def only(self, names: List[str]) -> "Scenario":
+        return Scenario({
+            "description": self.description,
+            "fakes": self.fakes,
+            "variables": self.variables,
+            "requests": [r for r in self.requests if r["name"] in names],
+        })
+
+    def sample_values(self, rng: random.Random) -> Dict[str, str]:
+        values: Dict[str, str] = {}
+        for name, spec in self.variables.items():
+            kind = spec["type"]
+            if kind == "choice":
+                values[name] = rng.choice(spec["values"])
+            elif kind == "date":
+                start = date.fromisoformat(spec["start"])
+                span = (date.fromisoformat(spec["end"]) - start).days
+                values[name] = (start + timedelta(days=rng.randint(0, span))).isoformat()
+            elif kind == "month":
+                # 產生 {name}_start 與 {name}_end（該月第一天與最後一天）
+                first = [int(x) for x in spec["start"].split("-")]
+                last = [int(x) for x in spec["end"].split("-")]
+                index = rng.randint(first[0] * 12 + first[1] - 1, last[0] * 12 + last[1] - 1)
+                month_start = date(index // 12, index % 12 + 1, 1)
+                next_month = date(month_start.year + month_start.month // 12, month_start.month % 12 + 1, 1)
+                values[f"{name}_start"] = month_start.isoformat()
+                values[f"{name}_end"] = (next_month - timedelta(days=1)).isoformat()
+            else:
+                raise ValueError(f"不支援的變數類型: {kind}")
+        return values
+
+    def pick(self, rng: random.Random) -> Tuple[dict, Dict[str, str]]:
+        template = rng.choices(self.requests, weights=self.weights)[0]
+        return template, self.sample_values(rng)
+
+
+def _fill(value, values: Dict[str, str]):
+    """以變數值代入請求範本中的 {name}"""
+    if isinstance(value, str):
+        return value.format_map(values)
+    if isinstance(value, list):
+        return [_fill(v, values) for v in value]
+    if isinstance(value, dict):
+        return {k: _fill(v, values) for k, v in value.items()}
+    return value
+
+
+def synthetic_portrait() -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (900, 1200), (180, 160, 140)).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+async def run_step(base_url: str, scenario: Scenario, concurrency: int, duration: float,
+                   seed: int, portrait: bytes) -> StepResult:
+    samples: List[Tuple[str, float, int]] = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=300) as client:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + duration
+
+        async def worker(index: int):
+            rng = random.Random(seed * 1000 + index)
+            while loop.time() < deadline:
+                template, values = scenario.pick(rng)
+                kwargs = {}
+                if "json" in template:
+                    kwargs["json"] = _fill(template["json"], values)
+                if "form" in template:
+                    kwargs["data"] = _fill(template["form"], values)
+                if "files" in template:
+                    kwargs["files"] = {
+                        name: ("portrait.jpg", portrait, "image/jpeg")
+                        for name in template["files"]
+                    }
+                start = time.perf_counter()
+                try:
+                    response = await client.request(template["method"], _fill(template["path"], values), **kwargs)
+                    status = response.status_code
+                except httpx.HTTPError:
+                    status = 0
+                samples.append((template["name"], time.perf_counter() - start, status))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    def is_error(status: int) -> bool:
+        return status == 0 or status >= 500
+
+    latencies = sorted(s[1] for s in samples)
+    endpoints: Dict[str, EndpointStats] = {}
+    for name in sorted({s[0] for s in samples}):
+        rows = [s for s in samples if s[0] == name]
+        values = sorted(s[1] for s in rows)
+        endpoints[name] = EndpointStats(
+            count=len(rows),
+            errors=sum(1 for s in rows if is_error(s[2])),
+            p50_ms=percentile(values, 0.50) * 1000,
+            p95_ms=percentile(values, 0.95) * 1000,
+            p99_ms=percentile(values, 0.99) * 1000,
+        )
+    return StepResult(
+        concurrency=concurrency,
+        duration_seconds=elapsed,
+        requests=len(samples),
+        errors=sum(1 for s in samples if is_error(s[2])),
+        throughput=len(samples) / elapsed if elapsed else 0.0,
+        p50_ms=percentile(latencies, 0.50) * 1000,
+        p95_ms=percentile(latencies, 0.95) * 1000,
+        p99_ms=percentile(latencies, 0.99) * 1000,
+        endpoints=endpoints,
+    )
+
+
+def find_saturation(steps: List[StepResult]) -> Optional[StepResult]:
+    """吞吐量最後一次明顯成長的那一級；之後加併發只會拉長延遲"""
+    best = None
+    for step in steps:
+        if best is None or step.throughput > best.throughput * (1 + SATURATION_GAIN):
+            best = step
+    return best
+
+
+def print_step(step: StepResult) -> None:
+    print(
+        f"併發 {step.concurrency:>4}：{step.requests:>6} 請求  {step.throughput:>8.1f} req/s  "
+        f"p50 {step.p50_ms:>8.1f} ms  p95 {step.p95_ms:>8.1f} ms  p99 {step.p99_ms:>8.1f} ms  錯誤 {step.errors}"
+    )
+    for name, stats in step.endpoints.items():
+        print(
+            f"    {name:<22}{stats.count:>6}  p50 {stats.p50_ms:>8.1f}  p95 {stats.p95_ms:>8.1f}  "
+            f"p99 {stats.p99_ms:>8.1f}  錯誤 {stats.errors}"
+        )
+
+
+def wait_until_ready(base_url: str, process: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"後端啟動失敗（exit code {process.returncode}）")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"後端在 {timeout:.0f} 秒內未就緒")
+
+
+def run(args, scenario: Scenario, base_url: str) -> List[StepResult]:
+    portrait = synthetic_portrait()
+    if args.warmup > 0:
+        print(f"暖機 {args.warmup:.0f} 秒 ...", flush=True)
+        asyncio.run(run_step(base_url, scenario, 2, args.warmup, args.seed, portrait))
+
+    steps = []
+    for concurrency in args.concurrency:
+        step = asyncio.run(run_step(base_url, scenario, concurrency, args.duration, args.seed, portrait))
+        print_step(step)
+        steps.append(step)
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LegacyGuide 後端壓力測試")
+    parser.add_argument("--scenario", default=os.path.join(os.path.dirname(__file__), "scenario.json"))
+    parser.add_argument("--base-url", help="對已啟動的後端施壓；未指定則自行啟動替身與 uvicorn")
+    parser.add_argument("--app", default="main:app", help="自行啟動時的 ASGI 應用")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1, help="自行啟動時的 worker 數；大於 1 時使用 gunicorn")
+    parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")],
+                        default=[1, 2, 4, 8, 16, 32], help="逐級的併發數，以逗號分隔")
+    parser.add_argument("--duration", type=float, default=20, help="每一級的秒數")
+    parser.add_argument("--warmup", type=float, default=5, help="正式量測前的暖機秒數")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", nargs="+", help="只送出指定名稱的請求")
+    parser.add_argument("--startup-timeout", type=float, default=300, help="等待後端啟動（含建立索引）的秒數")
+    parser.add_argument("--output", help="結果 JSON 路徑")
+    args = parser.parse_args()
+
+    scenario = Scenario.load(args.scenario)
+    if args.only:
+        scenario = scenario.only(args.only)
+    print(scenario.description)
+
+    if args.base_url:
+        steps = run(args, scenario, args.base_url.rstrip("/"))
+    else:
+        with FakeServices(**scenario.fakes) as fakes, tempfile.TemporaryDirectory() as storage:
+            env = {**os.environ, **fakes.environment(), "RAG_STORAGE_DIR": os.path.join(storage, "index")}
+            base_url = f"http://127.0.0.1:{args.port}"
+            if args.workers > 1:
+                env.update({
+                    "WEB_CONCURRENCY": str(args.workers),
+                    "SHARED_STATE_URL": f"sqlite:///{os.path.join(storage, 'shared_state.db')}",
+                    "LUNAR_CACHE_DB": os.path.join(storage, "lunar_cache.db"),
+                })
+                command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", args.app,
+                           "--bind", f"127.0.0.1:{args.port}", "--log-level", "warning", "--access-logfile", "/dev/null"]
+            else:
+                command = [sys.executable, "-m", "uvicorn", args.app, "--host", "127.0.0.1",
+                           "--port", str(args.port), "--workers", "1", "--log-level", "warning"]
+            process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+            try:
+                print("等待後端啟動 ...", flush=True)
+                wait_until_ready(base_url, process, args.startup_timeout)
+                steps = run(args, scenario, base_url)
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+
+    saturation = find_saturation(steps)
+    if saturation is not None:
+        print(f"\n飽和點：併發 {saturation.concurrency}，約 {saturation.throughput:.1f} req/s"
+              f"（p95 {saturation.p95_ms:.1f} ms）")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "meta": {**environment(), "scenario": args.scenario, "duration": args.duration,
+                         "workers": args.workers},
+                "steps": [asdict(step) for step in steps],
+                "saturation_concurrency": saturation.concurrency if saturation else None,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"結果已存至 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
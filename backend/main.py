@@ -1,3 +1,5 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 import os
@@ -6,12 +8,35 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from modules.lunar.router import router as lunar_router
 from modules.chat.router import router as chat_router
-from modules.recommend_chat.router import router as recommend_router
-from modules.crawler.router import router as crawler_router
-from modules.auspicious_days.router import router as auspicious_days_router
-from modules.urn.router import router as urn_router
+from modules.recommend_chat.router import router as recommend_router, parse_stats
+from modules.crawler.router import router as crawler_router, crawl_flight
+from modules.auspicious_days.router import router as auspicious_days_router, recommend_flight
+from modules.urn.router import router as urn_router, urn_catalog
+from modules.urn.uploads import UploadLimitMiddleware
+from modules.lunar.lunar_table import get_lunar_table
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from modules.metrics import MetricsMiddleware, register_collector, render_metrics, stats_collector
+from modules.lunar.cache import lunar_info_cache
+from modules.lunar.http_cache import body_cache
+from modules.utils import embedding_stats, llm_flight
+from modules.llm_gateway import gateway_stats, route_budget_stats
+from modules.hybrid_retriever import retrieval_stats
+from modules.context_budget import context_stats
 
-app = FastAPI(title="LegacyGuide API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 預先建立農曆月份對照表，避免第一個請求承擔建表時間
+    get_lunar_table()
+    # 建立骨灰罐樣板目錄，並於樣板異動時自動更新
+    await run_in_threadpool(urn_catalog.refresh)
+    stop_watching = asyncio.Event()
+    watcher = asyncio.create_task(urn_catalog.watch(stop_watching))
+    yield
+    stop_watching.set()
+    await watcher
+
+app = FastAPI(title="LegacyGuide API", lifespan=lifespan)
 
 # 加入 CORS middleware
 app.add_middleware(
@@ -22,6 +47,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 在解析 multipart 前限制遺像上傳大小
+app.add_middleware(UploadLimitMiddleware)
+
+# 記錄各路由延遲；請求帶 X-Profile: 1 時以 Server-Timing 回傳各階段耗時
+app.add_middleware(MetricsMiddleware)
+
+register_collector(stats_collector("lunar_info_cache", "每日農曆資訊快取統計", lunar_info_cache.stats))
+register_collector(stats_collector("lunar_response_cache", "農曆 API 回應快取統計", body_cache.stats))
+register_collector(stats_collector("parse_conversation_outcomes", "對話解析的結構化輸出結果統計", parse_stats.stats))
+register_collector(stats_collector("singleflight_auspicious", "吉日推薦的請求合併統計", recommend_flight.stats))
+register_collector(stats_collector("singleflight_crawler", "火化場爬蟲的請求合併統計", crawl_flight.stats))
+register_collector(stats_collector("singleflight_llm", "LLM 呼叫的請求合併統計", llm_flight.stats))
+register_collector(stats_collector("embedding_batcher", "TEI 嵌入請求的合併與快取統計", embedding_stats))
+register_collector(stats_collector("rag_retrieval", "混合檢索中只用字詞比對與合併向量檢索的次數", retrieval_stats.stats))
+register_collector(stats_collector("rag_context_tokens", "送入 LLM 前檢索內容與對話紀錄的估計 token 數", context_stats.stats))
+register_collector(stats_collector("llm_gateway", "Gemini 與 TEI 請求的限速、排隊與拒絕統計", gateway_stats))
+register_collector(stats_collector("llm_route_budget", "LLM 路由的同時處理數與拒絕統計", route_budget_stats))
+
 UPLOAD_STATIC_DIR = os.path.join(os.path.dirname(__file__), "uploads")
 app.mount("/static", StaticFiles(directory=UPLOAD_STATIC_DIR), name="static")
 
@@ -37,3 +80,8 @@ app.include_router(urn_router, prefix="/api")
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    """Prometheus 文字格式的量測資料（僅回應此請求的 worker，序列以 worker 標籤區分）"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
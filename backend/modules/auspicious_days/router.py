@@ -3,8 +3,11 @@
 提供吉日推薦的 API 端點
 """
 
+import asyncio
+
 from fastapi import APIRouter, HTTPException
 from ..models import AuspiciousDayRequest, AuspiciousDayResponse
+from ..singleflight import SingleFlight, make_key
 from .service import AuspiciousDayService
 
 router = APIRouter(
@@ -17,6 +20,8 @@ router = APIRouter(
 )
 
 service = AuspiciousDayService()
+# 多人同時查詢同一個月份與條件時只掃描一次
+recommend_flight = SingleFlight("auspicious.recommend", timeout=60)
 
 @router.post("/recommend", response_model=AuspiciousDayResponse)
 async def recommend_dates(request: AuspiciousDayRequest):
@@ -31,10 +36,8 @@ async def recommend_dates(request: AuspiciousDayRequest):
 
     返回推薦的吉日列表，包含每個日期的詳細分析和建議
     """
-    # try:
-    return await service.recommend_dates(request)
-    # except Exception as e:
-    #     raise HTTPException(
-    #         status_code=500,
-    #         detail=f"推薦吉日時發生錯誤：{str(e)}"
-    #     ) 
\ No newline at end of file
+    key = make_key(request.model_dump(mode="json"))
+    try:
+        return await recommend_flight.do(key, lambda: service.recommend_dates(request))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="推薦吉日逾時，請稍後再試")
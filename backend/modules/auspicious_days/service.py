@@ -3,6 +3,7 @@
 實現吉日推薦的主要業務邏輯
 """
 
+import asyncio
 from datetime import date, datetime, timedelta
 from typing import List, Dict
 from ..models import (
@@ -11,8 +12,7 @@ from ..models import (
     DateAnalysis,
     ConflictInfo,
     LunarInfo,
-    GanZhi,
-    Date
+    GanZhi
 )
 from .utils import (
     get_earthly_branch_conflicts,
@@ -21,6 +21,7 @@ from .utils import (
     calculate_recommendation_level
 )
 from ..lunar.router import get_lunar_info as get_lunar_info_from_module
+from ..metrics import span
 
 class AuspiciousDayService:
     def __init__(self):
@@ -33,24 +34,25 @@ class AuspiciousDayService:
     
     async def analyze_date(self, date: date, request: AuspiciousDayRequest) -> DateAnalysis:
         """分析單一日期的適宜程度"""
-        # 獲取農曆資訊
-        lunar_info = await self.get_lunar_info(date)
-        
-        # 檢查各種沖煞和禁忌
-        conflicts = self.check_conflicts(lunar_info, request)
-        
-        # 計算推薦等級
-        recommendation_level = calculate_recommendation_level(
-            conflicts,
-            (lunar_info.宜, lunar_info.忌)
-        )
-        
-        # 生成推薦說明
-        explanation = self.generate_explanation(conflicts, lunar_info, recommendation_level)
-        
-        # 生成注意事項
-        notes = self.generate_notes(conflicts, lunar_info)
-        
+        with span("auspicious.day"):
+            # 獲取農曆資訊
+            lunar_info = await self.get_lunar_info(date)
+
+            # 檢查各種沖煞和禁忌
+            conflicts = self.check_conflicts(lunar_info, request)
+
+            # 計算推薦等級
+            recommendation_level = calculate_recommendation_level(
+                conflicts,
+                (lunar_info.宜, lunar_info.忌)
+            )
+
+            # 生成推薦說明
+            explanation = self.generate_explanation(conflicts, lunar_info, recommendation_level)
+
+            # 生成注意事項
+            notes = self.generate_notes(conflicts, lunar_info)
+
         return DateAnalysis(
             日期=date,
             農曆資訊=lunar_info,
@@ -72,7 +74,7 @@ class AuspiciousDayService:
         conflicts = []
         
         # 檢查重喪日等絕對禁忌
-        forbidden_conflicts = self.check_forbidden_days(lunar_info.日期, lunar_info.干支)
+        forbidden_conflicts = self.check_forbidden_days(lunar_info.月, lunar_info.干支)
         conflicts.extend(forbidden_conflicts)
         
         # 檢查生肖相沖
@@ -85,12 +87,12 @@ class AuspiciousDayService:
         
         return conflicts
     
-    def check_forbidden_days(self, date: Date, 天干支: GanZhi) -> List[ConflictInfo]:
+    def check_forbidden_days(self, lunar_month: int, 天干支: GanZhi) -> List[ConflictInfo]:
         """檢查重喪日、歲破日等絕對禁忌"""
         conflicts = []
         
         # 檢查重喪日
-        is_forbidden, reason = is_forbidden_day(date, 天干支)
+        is_forbidden, reason = is_forbidden_day(lunar_month, 天干支)
         if is_forbidden:
             conflicts.append(ConflictInfo(
                 類型="禁忌日",
@@ -165,12 +167,18 @@ class AuspiciousDayService:
         recommended_dates = []
         
         # 遍歷日期範圍
-        current_date = request.查詢起始日期
-        while current_date <= request.查詢結束日期:
-            analysis = await self.analyze_date(current_date, request)
-            if analysis.推薦等級 in ["極佳"]:
-                recommended_dates.append(analysis)
-            current_date = current_date + timedelta(days=1)
+        with span("auspicious.scan"):
+            current_date = request.查詢起始日期
+            scanned = 0
+            while current_date <= request.查詢結束日期:
+                # 長範圍掃描時定期讓出事件迴圈，其他請求（含等待同一結果的重複請求）得以處理
+                scanned += 1
+                if scanned % 31 == 0:
+                    await asyncio.sleep(0)
+                analysis = await self.analyze_date(current_date, request)
+                if analysis.推薦等級 in ["極佳"]:
+                    recommended_dates.append(analysis)
+                current_date = current_date + timedelta(days=1)
         
         # 按推薦等級排序
         recommended_dates.sort(key=lambda x: x.日期)
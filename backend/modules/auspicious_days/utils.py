@@ -4,7 +4,7 @@
 """
 
 from typing import List, Tuple
-from ..models import GanZhi, Date   
+from ..models import GanZhi
 
 # 天干相沖對應表
 HEAVENLY_STEM_CONFLICTS = {
@@ -56,8 +56,8 @@ def get_year_stem_branch(year: int) -> str:
     
     return heavenly_stems[stem_index] + earthly_branches[branch_index]
 
-def is_forbidden_day(date: Date, 天干支: GanZhi) -> Tuple[bool, str]:
-    """判斷是否為禁忌日期"""
+def is_forbidden_day(lunar_month: int, 天干支: GanZhi) -> Tuple[bool, str]:
+    """判斷是否為禁忌日期（lunar_month 為農曆月份 1-12，閏月視同本月）"""
     # 重喪日判斷
     重喪日 = {
         1: "甲", 2: "乙", 3: "戊", 4: "丙", 
@@ -65,22 +65,10 @@ def is_forbidden_day(date: Date, 天干支: GanZhi) -> Tuple[bool, str]:
         9: "戊", 10: "壬", 11: "癸", 12: "己"
     }
     
-    try:
-        # 從農曆日期中提取月份
-        lunar_parts = date.lunar.split("-")
-        if len(lunar_parts) < 2 or not lunar_parts[1]:
-            print(f"警告：無法解析農曆日期 {date.lunar}")
-            return False, ""
-            
-        lunar_month = int(lunar_parts[1])
-        
-        if 天干支.日 in 重喪日.get(lunar_month, ""):
-            return True, f"重喪日：{lunar_month}月{天干支.日}日"
-        
-        return False, ""
-    except (ValueError, IndexError) as e:
-        print(f"警告：解析農曆日期時發生錯誤 {e}，日期：{date.lunar}")
-        return False, ""
+    if 天干支.日 in 重喪日.get(lunar_month, ""):
+        return True, f"重喪日：{lunar_month}月{天干支.日}日"
+    
+    return False, ""
 
 def calculate_recommendation_level(conflicts: List[dict], 宜忌: Tuple[List[str], List[str]]) -> str:
     """根據衝突和宜忌計算推薦等級"""
@@ -1,9 +1,12 @@
+import asyncio
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import Optional
 import os
 import logging
 from dotenv import load_dotenv
 from modules.utils import create_rag_engine
+from modules.llm_gateway import Overloaded, Priority, RouteBudget, llm_priority, retry_after_header
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
@@ -20,6 +23,8 @@ if not GEMINI_API_KEY:
 
 class ChatRequest(BaseModel):
     message: str
+    # 前端每個對話視窗產生一組 session_id，後端依此保存對話紀錄；未提供時為單輪對話
+    session_id: Optional[str] = Field(None, max_length=128)
 
 # 初始化 RAG 引擎 - 使用 chat router 的配置
 chat_system_prompt = """角色設定:你是一位經驗豐富、具有高度同理心與責任感殯葬禮儀顧問(請以LegacyGuide自稱)，請根據知識文件內容回答使用者的問題，不用自我介紹功能。
@@ -47,6 +52,7 @@ chat_system_prompt = """角色設定:你是一位經驗豐富、具有高度同
 try:
     query_engine = create_rag_engine(
         system_prompt=chat_system_prompt,
+        name="rag",
         # temperature=0.8,
         # max_output_tokens=1024
     )
@@ -55,20 +61,34 @@ except Exception as e:
     logger.error(f"Failed to initialize chat RAG engine: {str(e)}")
     raise
 
+# 同時處理中的 /rag 請求上限，超過時回應 503
+rag_budget = RouteBudget("rag", int(os.getenv("RAG_ROUTE_CONCURRENCY", "32")))
+
 @router.post("/rag")
 async def rag_endpoint(request: ChatRequest):
     try:
         if not request.message.strip():
             raise HTTPException(status_code=400, detail="Message cannot be empty")
 
-        logger.info(f"Received question: {request.message}")
+        # 日誌只記錄長度，不記錄使用者問題內容
+        logger.info(f"Received question ({len(request.message)} chars)")
         
-        # 使用 RAG 引擎處理問題
-        response = query_engine.chat(request.message)
+        # 使用 RAG 引擎處理問題；線上對話以最高優先等級呼叫 LLM
+        with llm_priority(Priority.INTERACTIVE):
+            answer = await rag_budget.run(
+                query_engine.achat(request.message, session_id=request.session_id)
+            )
         
         logger.info("Successfully generated response")
-        return {"answer": str(response)}
+        return {"answer": answer, "session_id": request.session_id}
 
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="回覆逾時，請稍後再試")
+    except Overloaded as e:
+        logger.warning(f"Request shed: {e}")
+        raise HTTPException(status_code=503, detail="目前詢問人數較多，請稍後再試", headers=retry_after_header(e))
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
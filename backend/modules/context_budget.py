@@ -0,0 +1,315 @@
+"""
+生成前的上下文 token 預算
+CONDENSE_PLUS_CONTEXT 原本把檢索到的節點原封不動送進提示詞，對話紀錄也隨輪數不斷變長，
+QA.md 的長段落加上累積的對話會拉高每次 Gemini 呼叫的 token 數與延遲。
+
+- ContextCompressor（節點後處理器）：
+  1. 去重：排名較後的節點中，已出現在前面節點的句子移除；重複比例達 RAG_DEDUP_THRESHOLD 的節點整個略過
+  2. 裁剪：總量仍超過 RAG_CONTEXT_TOKEN_BUDGET 時，以句子與問題的嵌入相似度挑出最相關的句子，
+     依原順序保留到預算為止；每個節點開頭的段落路徑一律保留。
+     句子嵌入經 EmbeddingBatcher 快取，常被檢索到的段落不會重複送到 TEI
+- compact_history：對話紀錄超過 RAG_HISTORY_TOKEN_BUDGET 時，保留最近 RAG_HISTORY_KEEP_MESSAGES 則訊息，
+  較早的部分（含先前的摘要）以 LLM 濃縮成一則摘要。摘要會寫回對話紀錄，之後幾輪不必重新摘要
+- 每個請求在 token_report() 之內累計各步驟的 token 數：寫入日誌、/metrics（rag_context_tokens），
+  並於 X-Profile 請求的 Server-Timing 標頭回傳
+
+Gemini 的 tokenizer 無法離線使用，token 數以字元估算：中日韓文字每字 1 個，其他字元每 4 個 1 個。
+
+環境變數（括號內為預設值）：
+- RAG_CONTEXT_TOKEN_BUDGET（1500）：檢索內容的 token 上限，設為 0 時只去重不裁剪
+- RAG_DEDUP_THRESHOLD（0.8）
+- RAG_HISTORY_TOKEN_BUDGET（1200）：對話紀錄的 token 上限，設為 0 時不摘要
+- RAG_HISTORY_KEEP_MESSAGES（4）：摘要時原文保留的最近訊息數
+"""
+
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, fields
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.llms import LLM, ChatMessage, MessageRole
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from pydantic import PrivateAttr
+
+from modules.metrics import record_count, span
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "1500"))
+DEDUP_THRESHOLD = float(os.getenv("RAG_DEDUP_THRESHOLD", "0.8"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("RAG_HISTORY_TOKEN_BUDGET", "1200"))
+HISTORY_KEEP_MESSAGES = int(os.getenv("RAG_HISTORY_KEEP_MESSAGES", "4"))
+
+_CJK = re.compile(r"[　-〿㐀-䶿一-鿿豈-﫿＀-￯]")
+# 句子連同結尾的標點與換行；join 後與原文相同
+_SENTENCE = re.compile(r"[^。！？；\n]*(?:[。！？；]+\s*|\n+|$)")
+# 太短的句子（項目符號、「費用：」之類）在不同段落重複出現是正常的，不視為重複
+_DEDUP_MIN_CHARS = 8
+# 對話紀錄中的摘要訊息以此標記，再次摘要時一併納入
+SUMMARY_KEY = "history_summary"
+
+SUMMARY_PROMPT = """以下是殯葬禮儀顧問與家屬先前的對話。請以繁體中文條列整理成 200 字以內的摘要，
+保留家屬提到的具體資訊（往生者資料、日期、宗教、預算、地點、需求）與顧問已給的建議或推薦方案，
+省略寒暄與重複的說明。
+
+{history}
+
+摘要："""
+
+
+def estimate_tokens(text: str) -> int:
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+@dataclass
+class TokenReport:
+    """單一請求各步驟前後的估計 token 數"""
+    context_in: int = 0
+    context_deduped: int = 0
+    context_out: int = 0
+    history_in: int = 0
+    history_out: int = 0
+
+    @property
+    def saved(self) -> int:
+        return self.context_in - self.context_out + self.history_in - self.history_out
+
+    def __str__(self) -> str:
+        return (
+            f"context {self.context_in}→{self.context_out} "
+            f"(dedupe -{self.context_in - self.context_deduped}, trim -{self.context_deduped - self.context_out}), "
+            f"history {self.history_in}→{self.history_out}, saved {self.saved}"
+        )
+
+
+class ContextStats:
+    """所有請求的 token 數累計"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.totals = TokenReport()
+        self.history_summaries = 0
+
+    def add(self, report: TokenReport) -> None:
+        with self._lock:
+            self.requests += 1
+            for field in fields(TokenReport):
+                setattr(self.totals, field.name, getattr(self.totals, field.name) + getattr(report, field.name))
+
+    def summarized(self) -> None:
+        with self._lock:
+            self.history_summaries += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                **{field.name: getattr(self.totals, field.name) for field in fields(TokenReport)},
+                "saved": self.totals.saved,
+                "history_summaries": self.history_summaries,
+            }
+
+
+context_stats = ContextStats()
+
+_report: ContextVar[Optional[TokenReport]] = ContextVar("token_report", default=None)
+
+
+@contextmanager
+def token_report() -> Iterator[TokenReport]:
+    """在此範圍內的上下文壓縮與對話摘要累計到同一份報告，結束時輸出"""
+    report = TokenReport()
+    token = _report.set(report)
+    try:
+        yield report
+    finally:
+        _report.reset(token)
+        if report.context_in or report.history_in:
+            context_stats.add(report)
+            record_count("context.tokens_in", report.context_in + report.history_in)
+            record_count("context.tokens_out", report.context_out + report.history_out)
+            logger.info(f"Context tokens: {report}")
+
+
+def _current_report() -> TokenReport:
+    # 不在 token_report() 之內時記到一份不輸出的報告
+    return _report.get() or TokenReport()
+
+
+def _sentences(text: str) -> List[str]:
+    return [piece for piece in _SENTENCE.findall(text) if piece]
+
+
+def _normalize(sentence: str) -> str:
+    return re.sub(r"\s+", "", sentence)
+
+
+class _Passage:
+    """節點拆成開頭的段落路徑與內文句子"""
+
+    def __init__(self, result: NodeWithScore):
+        self.result = result
+        pieces = _sentences(result.node.get_content(MetadataMode.NONE))
+        # ingestion 產生的節點第一行為段落路徑
+        has_header = bool(result.node.metadata.get("section")) and len(pieces) > 1
+        self.header = pieces[0] if has_header else ""
+        self.sentences = pieces[1:] if has_header else pieces
+
+    @property
+    def text(self) -> str:
+        return self.header + "".join(self.sentences)
+
+    def to_node(self) -> NodeWithScore:
+        node = self.result.node.model_copy()
+        node.set_content(self.text.strip())
+        return NodeWithScore(node=node, score=self.result.score)
+
+
+class ContextCompressor(BaseNodePostprocessor):
+    """去除重複句子並將檢索內容裁剪到 token 預算內"""
+
+    token_budget: int = CONTEXT_TOKEN_BUDGET
+    dedup_threshold: float = DEDUP_THRESHOLD
+    _embed_model: BaseEmbedding = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, **kwargs):
+        super().__init__(**kwargs)
+        self._embed_model = embed_model
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextCompressor"
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore],
+                           query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        if not nodes:
+            return nodes
+        report = _current_report()
+        passages = [_Passage(result) for result in nodes]
+        report.context_in += sum(estimate_tokens(passage.text) for passage in passages)
+
+        passages = self._dedupe(passages)
+        tokens = sum(estimate_tokens(passage.text) for passage in passages)
+        report.context_deduped += tokens
+
+        if self.token_budget > 0 and tokens > self.token_budget and query_bundle is not None:
+            with span("rag.compress"):
+                passages = self._trim(passages, query_bundle.query_str)
+            tokens = sum(estimate_tokens(passage.text) for passage in passages)
+        report.context_out += tokens
+        return [passage.to_node() for passage in passages]
+
+    def _dedupe(self, passages: List["_Passage"]) -> List["_Passage"]:
+        seen = set()
+        kept = []
+        node_ids = set()
+        for passage in passages:
+            node_id = passage.result.node.node_id
+            if node_id in node_ids:
+                continue
+            node_ids.add(node_id)
+            total = sum(len(sentence) for sentence in passage.sentences) or 1
+            unique = []
+            for sentence in passage.sentences:
+                key = _normalize(sentence)
+                if len(key) >= _DEDUP_MIN_CHARS and key in seen:
+                    continue
+                unique.append(sentence)
+            duplicated = total - sum(len(sentence) for sentence in unique)
+            if duplicated / total >= self.dedup_threshold:
+                continue
+            seen.update(_normalize(sentence) for sentence in passage.sentences)
+            passage.sentences = unique
+            kept.append(passage)
+        return kept
+
+    def _trim(self, passages: List["_Passage"], query: str) -> List["_Passage"]:
+        # (節點序號, 句子序號, 句子)
+        candidates: List[Tuple[int, int, str]] = [
+            (i, j, sentence)
+            for i, passage in enumerate(passages)
+            for j, sentence in enumerate(passage.sentences)
+            if sentence.strip()
+        ]
+        if not candidates:
+            return passages
+        query_vector = np.asarray(self._embed_model.get_query_embedding(query), dtype=np.float32)
+        vectors = np.asarray(
+            self._embed_model.get_text_embedding_batch([sentence.strip() for _, _, sentence in candidates]),
+            dtype=np.float32,
+        )
+        norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(query_vector) or 1.0)
+        scores = vectors @ query_vector / np.where(norms == 0, 1.0, norms)
+
+        remaining = self.token_budget - sum(estimate_tokens(passage.header) for passage in passages)
+        keep = set()
+        for index in np.argsort(-scores, kind="stable"):
+            i, j, sentence = candidates[index]
+            cost = estimate_tokens(sentence)
+            if cost <= remaining:
+                keep.add((i, j))
+                remaining -= cost
+
+        trimmed = []
+        for i, passage in enumerate(passages):
+            passage.sentences = [sentence for j, sentence in enumerate(passage.sentences) if (i, j) in keep]
+            # 沒有任何句子入選的節點只剩段落路徑，不送給 LLM
+            if any(sentence.strip() for sentence in passage.sentences):
+                trimmed.append(passage)
+        return trimmed
+
+
+def history_tokens(messages: List[ChatMessage]) -> int:
+    return sum(estimate_tokens(message.content or "") for message in messages)
+
+
+def _format_messages(messages: List[ChatMessage]) -> str:
+    lines = []
+    for message in messages:
+        if message.additional_kwargs.get(SUMMARY_KEY):
+            lines.append(f"（更早的對話摘要）\n{message.content}")
+        else:
+            speaker = "家屬" if message.role == MessageRole.USER else "顧問"
+            lines.append(f"{speaker}：{message.content}")
+    return "\n".join(lines)
+
+
+def compact_history(messages: List[ChatMessage], llm: LLM,
+                    token_budget: int = HISTORY_TOKEN_BUDGET,
+                    keep_messages: int = HISTORY_KEEP_MESSAGES) -> List[ChatMessage]:
+    """
+    對話紀錄超過 token_budget 時，將最近 keep_messages 則以外的訊息摘要為一則使用者訊息；
+    未超過時原樣回傳。摘要以 USER 角色保存，Gemini 會與下一則使用者訊息合併。
+    """
+    report = _current_report()
+    tokens = history_tokens(messages)
+    report.history_in += tokens
+    # 保留的訊息從使用者訊息開始，摘要之後不會緊接著另一則顧問回覆
+    keep = keep_messages
+    while 0 < keep < len(messages) and messages[-keep].role != MessageRole.USER:
+        keep -= 1
+    split = len(messages) - keep
+    older, recent = messages[:split], messages[split:]
+    if token_budget <= 0 or tokens <= token_budget or len(older) < 2:
+        report.history_out += tokens
+        return messages
+
+    with span("rag.summarize_history"):
+        summary = str(llm.complete(SUMMARY_PROMPT.format(history=_format_messages(older)))).strip()
+    context_stats.summarized()
+    compacted = [
+        ChatMessage(role=MessageRole.USER, content=f"先前對話摘要：\n{summary}",
+                    additional_kwargs={SUMMARY_KEY: True}),
+        *recent,
+    ]
+    report.history_out += history_tokens(compacted)
+    return compacted
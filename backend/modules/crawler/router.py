@@ -1,14 +1,25 @@
+import asyncio
 import os
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import Select
 from datetime import datetime, timedelta
+from modules.metrics import span
+from modules.singleflight import SingleFlight, make_key
 
 router = APIRouter()
 
+# 同一火化場、同一日期區間的查詢同時只啟動一次 Chrome
+crawl_flight = SingleFlight("crawler", timeout=float(os.getenv("CRAWLER_TIMEOUT", "90")))
+
+# 火化場查詢頁面；壓力測試時可改指向本機的靜態頁面
+KAOHSIUNG_SCHEDULE_URL = os.getenv("KAOHSIUNG_SCHEDULE_URL", "https://mort.kcg.gov.tw/04/P04S03A-view.aspx")
+TAOYUAN_SCHEDULE_URL = os.getenv("TAOYUAN_SCHEDULE_URL", "https://taoyuanfuneral.tycg.gov.tw/Qdata/taoyuan-page4.aspx")
+
 def parse_kaohsiung_schedule(raw_text):
     import re
     from collections import defaultdict
@@ -87,44 +98,68 @@ def parse_taoyuan_schedule(raw_text):
                 result[gregorian_date].append(time_str)
     return dict(result)
 
+async def _crawl_once(site: str, fetch, start_date: str, end_date: str) -> JSONResponse:
+    """
+    以正規化後的日期區間合併相同的查詢，爬蟲本身在執行緒中執行。
+    所有等待者離開後 single-flight 會取消工作，但執行緒中的 Chrome 無法中途停止，
+    會照常跑完並關閉瀏覽器，只是結果不再有人使用。
+    """
+    start = datetime.strptime(start_date, "%Y-%m-%d").date().isoformat()
+    end = datetime.strptime(end_date, "%Y-%m-%d").date().isoformat()
+    try:
+        content = await crawl_flight.do(
+            make_key(site, start, end),
+            lambda: run_in_threadpool(fetch, start, end),
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="火化場網站回應逾時，請稍後再試")
+    return JSONResponse(content=content)
+
 """查詢高雄市火化場各時段可預約火化時段。"""
 @router.get("/crawl_kaohsiung_info", response_class=JSONResponse)
-def crawl_ks_info(start_date: str = Query(default="2025-06-16"), end_date: str = Query(default="2025-06-18")):
-    
+async def crawl_ks_info(start_date: str = Query(default="2025-06-16"), end_date: str = Query(default="2025-06-18")):
+    return await _crawl_once("kaohsiung", fetch_kaohsiung_info, start_date, end_date)
+
+def fetch_kaohsiung_info(start_date: str, end_date: str) -> dict:
     start_dt = datetime.strptime(start_date, "%Y-%m-%d")
     end_dt = datetime.strptime(end_date, "%Y-%m-%d")
 
     delta_days = (end_dt - start_dt).days + 1
-    url = f"https://mort.kcg.gov.tw/04/P04S03A-view.aspx?mp=Fmok&Day={start_dt.year - 1911}{start_dt.strftime('%m%d')}&Days={delta_days}"
+    url = f"{KAOHSIUNG_SCHEDULE_URL}?mp=Fmok&Day={start_dt.year - 1911}{start_dt.strftime('%m%d')}&Days={delta_days}"
     chrome_options = Options()
     chrome_options.add_argument("--headless")
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--disable-dev-shm-usage")
 
-    driver = webdriver.Chrome(options=chrome_options)
+    with span("crawler.chrome_launch"):
+        driver = webdriver.Chrome(options=chrome_options)
     try:
-        driver.get(url)
-        driver.implicitly_wait(5)
+        with span("crawler.page_load"):
+            driver.get(url)
+            driver.implicitly_wait(5)
 
-        body = driver.find_element(By.TAG_NAME, "body")
-        text = body.text
+            body = driver.find_element(By.TAG_NAME, "body")
+            text = body.text
         structured = parse_kaohsiung_schedule(text)
-        return JSONResponse(content={
+        return {
             "url": url,
             "availability": structured
-        })
+        }
     finally:
         driver.quit()
 
 """查詢桃園市火化場各時段可預約火化時段。"""
 @router.get("/crawl_taoyuan_info", response_class=JSONResponse)
-def crawl_ty_info(start_date: str = Query(default="2025-06-16"), end_date: str = Query(default="2025-06-18")):
+async def crawl_ty_info(start_date: str = Query(default="2025-06-16"), end_date: str = Query(default="2025-06-18")):
+    return await _crawl_once("taoyuan", fetch_taoyuan_info, start_date, end_date)
+
+def fetch_taoyuan_info(start_date: str, end_date: str) -> dict:
     """
     Query Taoyuan funeral info by date range (max 12 days per query).
     If the range exceeds 12 days, split into multiple queries and aggregate results.
     """
 
-    url = "https://taoyuanfuneral.tycg.gov.tw/Qdata/taoyuan-page4.aspx"
+    url = TAOYUAN_SCHEDULE_URL
     chrome_options = Options()
     chrome_options.add_argument("--headless")
     chrome_options.add_argument("--no-sandbox")
@@ -139,10 +174,12 @@ def crawl_ty_info(start_date: str = Query(default="2025-06-16"), end_date: str =
     current_start = start_dt
     while current_start <= end_dt:
         current_end = min(current_start + timedelta(days=11), end_dt)
-        driver = webdriver.Chrome(options=chrome_options)
+        with span("crawler.chrome_launch"):
+            driver = webdriver.Chrome(options=chrome_options)
         try:
-            driver.get(url)
-            driver.implicitly_wait(1)
+            with span("crawler.page_load"):
+                driver.get(url)
+                driver.implicitly_wait(1)
             # Select start date
             select_start = Select(driver.find_element(By.NAME, "DropDownList日期起"))
             start_value = f"{current_start.year}/{current_start.month}/{current_start.day}"
@@ -174,8 +211,9 @@ def crawl_ty_info(start_date: str = Query(default="2025-06-16"), end_date: str =
                 driver.implicitly_wait(1)
             except Exception:
                 pass
-            body = driver.find_element(By.TAG_NAME, "body")
-            text = body.text
+            with span("crawler.page_load"):
+                body = driver.find_element(By.TAG_NAME, "body")
+                text = body.text
             parsed = parse_taoyuan_schedule(text)
             results.append(parsed)
         finally:
@@ -192,7 +230,7 @@ def crawl_ty_info(start_date: str = Query(default="2025-06-16"), end_date: str =
     # Remove duplicates and sort times
     for k in merged:
         merged[k] = sorted(list(set(merged[k])))
-    return JSONResponse(content={
+    return {
         "url": url,
         "availability": merged
-    })
+    }
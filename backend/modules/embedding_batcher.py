@@ -0,0 +1,178 @@
+"""
+跨請求合併 TEI 嵌入呼叫（micro-batching）
+每輪對話只需嵌入一個改寫後的問題（裁剪上下文時再加上若干句子），
+多位使用者同時發問時 TEI 會收到大量只有一筆輸入的請求。
+
+- 第一個到達的請求成為 leader，等待一個很短的時間窗（EMBED_BATCH_WINDOW_MS，預設 5 毫秒），
+  期間到達的文字一併以一次 TEI 呼叫送出，再把向量分送回各請求
+- 累積到 EMBED_MAX_BATCH 筆（預設 32，TEI 的 max_client_batch_size 預設值）時立即送出，不等時間窗
+- 同一批次中重複的文字只送一次；已送出、尚未回傳的文字也直接等待同一個結果，不再重送
+- 最近嵌入過的文字 → 向量以 LRU 快取（EMBED_CACHE_SIZE，預設 2048 筆），相同問題不再呼叫 TEI
+
+一次超過 EMBED_MAX_BATCH 筆的請求（建索引、較長的句子篩選）不等時間窗，直接分批送出，但仍先查快取。
+
+不使用背景執行緒，由呼叫端執行緒輪流擔任 leader，gunicorn preload 後 fork 出的 worker 也能正常運作。
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+Embedding = List[float]
+
+
+class EmbeddingLRU:
+    """文字 → 向量的 LRU 快取（執行緒安全）"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[str, Embedding]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text: str) -> Optional[Embedding]:
+        with self._lock:
+            vector = self._items.get(text)
+            if vector is not None:
+                self._items.move_to_end(text)
+            return vector
+
+    def put(self, text: str, vector: Embedding) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._items[text] = vector
+            self._items.move_to_end(text)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class EmbeddingBatcher:
+    """將同時到達的少量嵌入請求合併為一次呼叫 embed_fn(texts)"""
+
+    def __init__(self, embed_fn: Callable[[List[str]], List[Embedding]],
+                 window: Optional[float] = None, max_batch: Optional[int] = None,
+                 cache_size: Optional[int] = None):
+        self._embed_fn = embed_fn
+        self.window = window if window is not None else float(os.getenv("EMBED_BATCH_WINDOW_MS", "5")) / 1000
+        self.max_batch = max_batch or int(os.getenv("EMBED_MAX_BATCH", "32"))
+        self.cache = EmbeddingLRU(cache_size if cache_size is not None else int(os.getenv("EMBED_CACHE_SIZE", "2048")))
+        self._cond = threading.Condition()
+        self._pending: Dict[str, Future] = {}
+        # 已送出、等待 TEI 回應的文字；結果寫入快取後才移除
+        self._inflight: Dict[str, Future] = {}
+        self._leader = False
+        self.requests = 0
+        self.cache_hits = 0
+        self.batches = 0
+        self.batched_texts = 0
+
+    def embed(self, texts: List[str]) -> List[Embedding]:
+        """回傳與 texts 順序相同的向量；快取命中的文字不會送出"""
+        results: List[Optional[Embedding]] = [self.cache.get(text) for text in texts]
+        futures: Dict[str, Future] = {}
+        full: List[Dict[str, Future]] = []
+        lead = False
+
+        with self._cond:
+            self.requests += len(texts)
+            for i, text in enumerate(texts):
+                if results[i] is not None or text in futures:
+                    continue
+                future = self._pending.get(text) or self._inflight.get(text)
+                if future is None:
+                    # 查快取之後、取得鎖之前，其他批次可能已完成並寫入快取
+                    results[i] = self.cache.get(text)
+                    if results[i] is not None:
+                        continue
+                    future = self._pending[text] = Future()
+                futures[text] = future
+            self.cache_hits += sum(1 for vector in results if vector is not None)
+            if not futures:
+                return results
+            while len(self._pending) >= self.max_batch:
+                full.append(self._take())
+            if self._pending and not self._leader:
+                self._leader = lead = True
+
+        for batch in full:
+            self._flush(batch)
+        if lead:
+            with self._cond:
+                # 時間窗內其他執行緒補滿批次時會自行送出，此處醒來後只送剩下的
+                self._cond.wait(self.window)
+                self._leader = False
+                batch = self._take()
+            if batch:
+                self._flush(batch)
+
+        vectors = {text: future.result() for text, future in futures.items()}
+        return [vector if vector is not None else vectors[text] for text, vector in zip(texts, results)]
+
+    def embed_direct(self, texts: List[str]) -> List[Embedding]:
+        """不經時間窗，快取未命中的文字每 max_batch 筆直接呼叫一次 embed_fn"""
+        results: List[Optional[Embedding]] = [self.cache.get(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, results) if vector is None))
+        with self._cond:
+            self.requests += len(texts)
+            self.cache_hits += len(texts) - sum(1 for vector in results if vector is None)
+        vectors: Dict[str, Embedding] = {}
+        for start in range(0, len(missing), self.max_batch):
+            batch = missing[start:start + self.max_batch]
+            vectors.update(zip(batch, self._embed_fn(batch)))
+            with self._cond:
+                self.batches += 1
+                self.batched_texts += len(batch)
+        for text, vector in vectors.items():
+            self.cache.put(text, vector)
+        return [vector if vector is not None else vectors[text] for text, vector in zip(texts, results)]
+
+    def _take(self) -> Dict[str, Future]:
+        """取出最多 max_batch 筆等待中的文字並標記為送出中（呼叫端需持有鎖）"""
+        texts = list(self._pending)[:self.max_batch]
+        batch = {text: self._pending.pop(text) for text in texts}
+        self._inflight.update(batch)
+        return batch
+
+    def _flush(self, batch: Dict[str, Future]) -> None:
+        texts = list(batch)
+        try:
+            vectors = self._embed_fn(texts)
+        except BaseException as e:
+            self._finish(batch)
+            # 例外交由每個等待者的 future.result() 拋出
+            for future in batch.values():
+                future.set_exception(e)
+            return
+        for text, vector in zip(texts, vectors):
+            self.cache.put(text, vector)
+        with self._cond:
+            self.batches += 1
+            self.batched_texts += len(texts)
+        self._finish(batch)
+        for text, vector in zip(texts, vectors):
+            batch[text].set_result(vector)
+
+    def _finish(self, batch: Dict[str, Future]) -> None:
+        with self._cond:
+            for text, future in batch.items():
+                if self._inflight.get(text) is future:
+                    del self._inflight[text]
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                "requests": self.requests,
+                "cache_hits": self.cache_hits,
+                "cache_size": len(self.cache),
+                "batches": self.batches,
+                "batched_texts": self.batched_texts,
+                "avg_batch_size": round(self.batched_texts / self.batches, 2) if self.batches else 0,
+            }
@@ -0,0 +1,111 @@
+"""
+字詞比對（BM25）與向量相似度的混合檢索
+重喪日、對年、殯葬管理條例的條號、龍巖方案名稱等專有名詞，字詞比對往往比語意向量準確。
+
+- 先查詢 bigram 倒排索引（不需嵌入）；若至少 LEXICAL_SHORTCUT_MIN_HITS 個結果
+  涵蓋了查詢中幾乎所有具鑑別力的詞（IDF 加權覆蓋率 ≥ LEXICAL_SHORTCUT_COVERAGE，
+  語料中沒有的查詢詞也計入分母），直接回傳字詞比對的結果，不呼叫 TEI
+- 否則再做向量檢索，兩份排名以 reciprocal rank fusion（RRF）合併
+
+環境變數（括號內為預設值）：
+- HYBRID_RETRIEVAL（1）：設為 0 時只使用向量檢索
+- RAG_TOP_K（2）：回傳的節點數
+- HYBRID_CANDIDATES（10）：兩種檢索各取的候選數
+- HYBRID_RRF_K（60）：RRF 的平滑常數
+- LEXICAL_SHORTCUT_COVERAGE（0.9）、LEXICAL_SHORTCUT_MIN_HITS（同 RAG_TOP_K）
+"""
+
+import logging
+import os
+import threading
+from typing import Dict, List, Optional
+
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from modules.lexical_index import LexicalIndex
+from modules.metrics import span
+
+logger = logging.getLogger(__name__)
+
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "2"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "10"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+LEXICAL_SHORTCUT_COVERAGE = float(os.getenv("LEXICAL_SHORTCUT_COVERAGE", "0.9"))
+
+
+class RetrievalStats:
+    """檢索路徑統計：只用字詞比對（shortcut）與混合檢索（fused）的次數"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.shortcut = 0
+        self.fused = 0
+
+    def record(self, shortcut: bool) -> None:
+        with self._lock:
+            if shortcut:
+                self.shortcut += 1
+            else:
+                self.fused += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"shortcut": self.shortcut, "fused": self.fused}
+
+
+retrieval_stats = RetrievalStats()
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = HYBRID_RRF_K) -> Dict[str, float]:
+    """各排名中名次 r（自 1 起算）的項目得分 1 / (k + r)，加總後為融合分數"""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, node_id in enumerate(ranking, start=1):
+            fused[node_id] = fused.get(node_id, 0.0) + 1.0 / (k + rank)
+    return fused
+
+
+class HybridRetriever(BaseRetriever):
+    """BM25 與向量檢索的混合檢索器；向量檢索器需回傳 HYBRID_CANDIDATES 個候選"""
+
+    def __init__(self, vector_retriever: BaseRetriever, lexical_index: LexicalIndex, docstore,
+                 similarity_top_k: int = RAG_TOP_K, candidates: int = HYBRID_CANDIDATES,
+                 shortcut_coverage: float = LEXICAL_SHORTCUT_COVERAGE,
+                 shortcut_min_hits: Optional[int] = None):
+        super().__init__()
+        self._vector_retriever = vector_retriever
+        self._lexical_index = lexical_index
+        self._docstore = docstore
+        self._top_k = similarity_top_k
+        self._candidates = candidates
+        self._shortcut_coverage = shortcut_coverage
+        self._shortcut_min_hits = shortcut_min_hits or int(
+            os.getenv("LEXICAL_SHORTCUT_MIN_HITS", str(similarity_top_k))
+        )
+
+    def _nodes(self, scores: Dict[str, float], known: Dict[str, NodeWithScore]) -> List[NodeWithScore]:
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:self._top_k]
+        results = []
+        for node_id, score in ranked:
+            node = known[node_id].node if node_id in known else self._docstore.get_node(node_id)
+            results.append(NodeWithScore(node=node, score=score))
+        return results
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        with span("rag.lexical"):
+            hits = self._lexical_index.search(query_bundle.query_str, limit=self._candidates)
+
+        strong = [hit for hit in hits if hit.coverage >= self._shortcut_coverage]
+        if len(strong) >= self._shortcut_min_hits:
+            retrieval_stats.record(shortcut=True)
+            return self._nodes({hit.node_id: hit.score for hit in strong}, {})
+
+        retrieval_stats.record(shortcut=False)
+        vector_nodes = self._vector_retriever.retrieve(query_bundle)
+        known = {result.node.node_id: result for result in vector_nodes}
+        fused = reciprocal_rank_fusion([
+            [hit.node_id for hit in hits],
+            [result.node.node_id for result in vector_nodes],
+        ])
+        return self._nodes(fused, known)
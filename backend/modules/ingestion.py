@@ -0,0 +1,255 @@
+"""
+知識文件的結構化切塊
+取代 SimpleDirectoryReader 加上固定 chunk_size 的切法，依文件結構產生語意完整的節點：
+
+- Markdown：依標題切段，每段開頭附上「檔名 > 各層標題」的路徑；
+  QA.md 這類以問句為標題的段落即為一組問答，不與其他段落合併。
+  同一層下過短的相鄰段落合併，過長的段落再依段落、句子切開（RAG_CHUNK_MAX_CHARS）
+- PDF（殯葬管理條例）：以 pypdf 取出文字後依「第 X 條」切成一條一節點，附上所屬章名；
+  取出的文字依檔案內容的 SHA-256 快取於 RAG_EXTRACT_CACHE_DIR，重建索引時不必重新解析
+- 其他格式仍交給 SimpleDirectoryReader 與 SentenceSplitter
+
+環境變數（括號內為預設值）：
+- RAG_CHUNK_MAX_CHARS（800）、RAG_CHUNK_MIN_CHARS（200）
+- RAG_EXTRACT_CACHE_DIR（./cache/extracted）：不可放在 RAG_STORAGE_DIR 之下，
+  該目錄非空時即視為已建好索引
+"""
+
+import hashlib
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+from llama_index.core import SimpleDirectoryReader
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+
+logger = logging.getLogger(__name__)
+
+CHUNK_MAX_CHARS = int(os.getenv("RAG_CHUNK_MAX_CHARS", "800"))
+CHUNK_MIN_CHARS = int(os.getenv("RAG_CHUNK_MIN_CHARS", "200"))
+EXTRACT_CACHE_DIR = os.getenv("RAG_EXTRACT_CACHE_DIR", "./cache/extracted")
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_FRONT_MATTER = re.compile(r"\A---\s*\n.*?\n---\s*\n", re.S)
+_RULE = re.compile(r"^\s*(-{3,}|\*{3,}|_{3,})\s*$")
+_ARTICLE_HEADING = re.compile(r"^第\s*(\d+(?:-\d+)?)\s*條$")
+_CHAPTER_HEADING = re.compile(r"^第\s*[一二三四五六七八九十]+\s*章\s*.+$")
+# 句末字元；PDF 中不以這些字元結尾的行視為被換行切斷的句子
+_LINE_END = "。：；！？"
+_LIST_START = re.compile(r"^(第\s|\d+\s|[一二三四五六七八九十]+、|（[一二三四五六七八九十]+）)")
+_SENTENCE = re.compile(r"(?<=[。！？；])")
+
+
+@dataclass
+class Section:
+    path: Tuple[str, ...]
+    body: str
+
+    @property
+    def parent(self) -> Tuple[str, ...]:
+        return self.path[:-1]
+
+    @property
+    def is_question(self) -> bool:
+        return self.path[-1].endswith(("？", "?"))
+
+
+def _split_long(text: str, max_chars: int = CHUNK_MAX_CHARS) -> List[str]:
+    """依段落、再依句子切成不超過 max_chars 的片段"""
+    if len(text) <= max_chars:
+        return [text]
+    pieces: List[str] = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        for sentence in _SENTENCE.split(paragraph):
+            pieces.extend(sentence[i:i + max_chars] for i in range(0, len(sentence), max_chars))
+
+    chunks: List[str] = []
+    current = ""
+    for piece in pieces:
+        piece = piece.strip()
+        if not piece:
+            continue
+        if current and len(current) + len(piece) + 2 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def markdown_sections(text: str, title: str) -> List[Section]:
+    """依標題切段；只有標題沒有內文的段落不產生節點，其標題併入下層段落的路徑"""
+    text = _FRONT_MATTER.sub("", text)
+    sections: List[Section] = []
+    stack: List[Tuple[int, str]] = []
+    body: List[str] = []
+
+    def flush():
+        content = "\n".join(body).strip()
+        if content:
+            # 與檔名相同的一級標題不重複列入路徑
+            headings = [heading for _, heading in stack if heading != title]
+            sections.append(Section((title, *headings), content))
+        body.clear()
+
+    for line in text.splitlines():
+        match = _HEADING.match(line)
+        if match:
+            flush()
+            level = len(match.group(1))
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            stack.append((level, match.group(2)))
+        elif not _RULE.match(line):
+            body.append(line.rstrip())
+    flush()
+    return sections
+
+
+def merge_small_sections(sections: List[Section]) -> List[List[Section]]:
+    """同一層下相鄰的短段落合併為一組；問答段落各自獨立"""
+    groups: List[List[Section]] = []
+    for section in sections:
+        if groups:
+            last = groups[-1]
+            size = sum(len(item.body) for item in last)
+            if (size < CHUNK_MIN_CHARS and last[-1].parent == section.parent
+                    and not section.is_question and not last[-1].is_question
+                    and size + len(section.body) <= CHUNK_MAX_CHARS):
+                last.append(section)
+                continue
+        groups.append([section])
+    return groups
+
+
+def _group_chunks(group: List[Section]) -> Iterator[Tuple[str, str]]:
+    """產生 (段落路徑, 節點文字)；文字開頭為路徑，合併的段落保留各自的標題"""
+    if len(group) == 1:
+        path = " > ".join(group[0].path)
+        for chunk in _split_long(group[0].body):
+            yield path, f"{path}\n\n{chunk}"
+        return
+    path = " > ".join(group[0].parent)
+    body = "\n\n".join(f"{section.path[-1]}\n{section.body}" for section in group)
+    yield path, f"{path}\n\n{body}"
+
+
+def join_pdf_lines(text: str) -> str:
+    """接回 PDF 排版造成的斷行，保留條號、項次與條列的換行"""
+    lines = [line.strip() for line in text.splitlines()]
+    joined: List[str] = []
+    for line in lines:
+        if not line:
+            continue
+        if joined and not joined[-1].endswith(tuple(_LINE_END)) and not _LIST_START.match(line) \
+                and not _ARTICLE_HEADING.match(joined[-1]) and not _CHAPTER_HEADING.match(joined[-1]):
+            joined[-1] += line
+        else:
+            joined.append(line)
+    return "\n".join(joined)
+
+
+def regulation_sections(text: str, title: str) -> List[Section]:
+    """依「第 X 條」切段，路徑為 法規名稱 > 章名 > 條號；第一條之前的法規資訊另成一段"""
+    sections: List[Section] = []
+    chapter: Optional[str] = None
+    article: Optional[str] = None
+    body: List[str] = []
+
+    def flush():
+        content = "\n".join(body).strip()
+        if content:
+            path = tuple(part for part in (title, chapter, article) if part)
+            sections.append(Section(path, content))
+        body.clear()
+
+    for line in join_pdf_lines(text).splitlines():
+        if _CHAPTER_HEADING.match(line):
+            flush()
+            chapter, article = re.sub(r"\s+", " ", line), None
+        elif _ARTICLE_HEADING.match(line):
+            flush()
+            article = f"第 {_ARTICLE_HEADING.match(line).group(1)} 條"
+        else:
+            body.append(line)
+    flush()
+    return sections
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extract_pdf_text(path: str, cache_dir: str = EXTRACT_CACHE_DIR) -> str:
+    """取出 PDF 文字；結果依檔案內容的雜湊快取"""
+    cache_path = os.path.join(cache_dir, f"{file_hash(path)}.txt")
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as f:
+            return f.read()
+
+    from pypdf import PdfReader
+
+    text = "\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{cache_path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, cache_path)
+    logger.info(f"已解析並快取 {os.path.basename(path)}")
+    return text
+
+
+def _make_nodes(file_name: str, chunks: Iterator[Tuple[str, str]]) -> List[TextNode]:
+    nodes = []
+    for section, text in chunks:
+        node = TextNode(
+            text=text,
+            metadata={"file_name": file_name, "section": section},
+            # 段落路徑已在文字開頭；檔名只提供給 LLM 作為引用來源
+            excluded_embed_metadata_keys=["file_name", "section"],
+            excluded_llm_metadata_keys=["section"],
+        )
+        node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=file_name)
+        nodes.append(node)
+    return nodes
+
+
+def load_asset_nodes(assets_dir: str) -> List[TextNode]:
+    """將知識文件目錄切成節點"""
+    nodes: List[TextNode] = []
+    others: List[str] = []
+    for file_name in sorted(os.listdir(assets_dir)):
+        path = os.path.join(assets_dir, file_name)
+        if not os.path.isfile(path) or file_name.startswith("."):
+            continue
+        title, ext = os.path.splitext(file_name)
+        ext = ext.lower()
+        if ext == ".md":
+            with open(path, encoding="utf-8") as f:
+                groups = merge_small_sections(markdown_sections(f.read(), title))
+            chunks = (chunk for group in groups for chunk in _group_chunks(group))
+        elif ext == ".pdf":
+            sections = regulation_sections(extract_pdf_text(path), title)
+            chunks = (chunk for section in sections for chunk in _group_chunks([section]))
+        else:
+            others.append(path)
+            continue
+        file_nodes = _make_nodes(file_name, chunks)
+        logger.info(f"{file_name}: {len(file_nodes)} 個節點")
+        nodes.extend(file_nodes)
+
+    if others:
+        documents = SimpleDirectoryReader(input_files=others).load_data()
+        nodes.extend(SentenceSplitter(chunk_size=1024, chunk_overlap=100).get_nodes_from_documents(documents))
+    return nodes
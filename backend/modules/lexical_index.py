@@ -0,0 +1,209 @@
+"""
+以中文字元 bigram 建立的倒排索引（BM25），不需外部斷詞工具
+- 連續的中文字切成重疊的兩字詞（重喪日 → 重喪、喪日），單一中文字保留為一字詞
+- 先在疑問詞與虛詞（什麼、如何、的、是⋯）處斷開，避免「日是」「麼意」這類跨詞的 bigram
+- 英文與數字以整個詞為單位（轉小寫、全形轉半形）
+- 「第 10 條」「第十條」「第21-1條」等條號另外產生 第10條 形式的詞，不同寫法都能對上
+- 查詢先以 OpenCC 轉為繁體，簡體提問也能比對繁體文件
+- 可逐筆新增或移除文件，保存為 JSON
+
+search() 除了 BM25 分數，另回傳以 IDF 加權的查詢詞覆蓋率，
+供混合檢索判斷是否能只靠字詞比對回答（見 modules/hybrid_retriever.py）。
+語料中沒有的查詢詞以「只出現在一份文件」的 IDF 計入分母，
+查詢大多由語料外的詞組成時覆蓋率隨之降低，不會只憑少數命中的詞走捷徑。
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from opencc import OpenCC
+
+_cc = OpenCC("s2t")
+
+_CJK_RUN = re.compile(r"[㐀-䶿一-鿿豈-﫿]+|[a-z0-9]+")
+_ARTICLE = re.compile(r"第\s*([0-9]+(?:\s*-\s*[0-9]+)?|[零〇一二三四五六七八九十百千]+)\s*條")
+# 斷詞用的疑問詞與虛詞；多字詞需排在單字之前
+_STOP_WORDS = (
+    "為什麼", "什麼", "怎麼", "如何", "哪些", "哪裡", "哪個", "請問", "是否", "可以", "需要", "應該",
+    "意思", "一下", "我們", "你們", "他們",
+    "的", "了", "嗎", "呢", "吧", "啊", "呀", "嘛", "是", "有", "要", "該", "應", "請", "我", "你",
+    "在", "和", "與", "及", "或",
+)
+_STOP = re.compile("|".join(_STOP_WORDS))
+_CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_CN_UNITS = {"十": 10, "百": 100, "千": 1000}
+
+
+def chinese_numeral(text: str) -> int:
+    """將「二十一」「一百零五」等中文數字轉為整數"""
+    total, digit = 0, 0
+    for char in text:
+        if char in _CN_DIGITS:
+            digit = _CN_DIGITS[char]
+        else:
+            total += (digit or 1) * _CN_UNITS[char]
+            digit = 0
+    return total + digit
+
+
+def _article_token(number: str) -> str:
+    number = re.sub(r"\s+", "", number)
+    if not number[0].isdigit():
+        number = str(chinese_numeral(number))
+    return f"第{number}條"
+
+
+def tokenize(text: str) -> List[str]:
+    """切出文件或查詢中的索引詞（可重複）"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = [_article_token(match.group(1)) for match in _ARTICLE.finditer(text)]
+    # 條號已成為完整的詞，不再切出「第十」「十條」這類 bigram
+    text = _STOP.sub(" ", _ARTICLE.sub(" ", text))
+    for match in _CJK_RUN.finditer(text):
+        run = match.group()
+        if run[0].isascii() or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def normalize_query(query: str) -> str:
+    return _cc.convert(query)
+
+
+@dataclass
+class LexicalHit:
+    node_id: str
+    score: float
+    # 命中的查詢詞 IDF 總和 / 所有查詢詞的 IDF 總和（語料外的詞以最大 IDF 計）
+    coverage: float
+
+
+class LexicalIndex:
+    """BM25 倒排索引；文件以整數編號存放於 posting list，節點 id 只存一份"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._ids: List[Optional[str]] = []
+        self._slots: Dict[str, int] = {}
+        self._lengths: List[int] = []
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    @property
+    def doc_count(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self._slots
+
+    def add(self, node_id: str, text: str) -> None:
+        counts = Counter(tokenize(text))
+        with self._lock:
+            if node_id in self._slots:
+                self._remove(node_id)
+            slot = self._slots[node_id] = len(self._ids)
+            self._ids.append(node_id)
+            for term, tf in counts.items():
+                self._postings.setdefault(term, {})[slot] = tf
+            length = sum(counts.values())
+            self._lengths.append(length)
+            self._total_length += length
+
+    def remove(self, node_ids: Iterable[str]) -> None:
+        with self._lock:
+            for node_id in node_ids:
+                if node_id in self._slots:
+                    self._remove(node_id)
+
+    def _remove(self, node_id: str) -> None:
+        # 編號保留為空位，保存時才重新編號
+        slot = self._slots.pop(node_id)
+        for term in [term for term, docs in self._postings.items() if slot in docs]:
+            docs = self._postings[term]
+            del docs[slot]
+            if not docs:
+                del self._postings[term]
+        self._ids[slot] = None
+        self._total_length -= self._lengths[slot]
+        self._lengths[slot] = 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids, self._slots, self._lengths, self._postings = [], {}, [], {}
+            self._total_length = 0
+
+    def _idf(self, df: int) -> float:
+        n = len(self._slots)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, limit: int = 10) -> List[LexicalHit]:
+        terms = set(tokenize(normalize_query(query)))
+        if not terms or not self._slots:
+            return []
+        avg_length = self._total_length / len(self._slots)
+        scores: Dict[int, float] = {}
+        matched: Dict[int, float] = {}
+        total_idf = 0.0
+        for term in terms:
+            docs = self._postings.get(term)
+            if not docs:
+                # 語料外的詞也可能是查詢的重點（同義詞、口語說法），只有向量檢索找得到，
+                # 以 df=1 的 IDF 計入分母
+                total_idf += self._idf(1)
+                continue
+            idf = self._idf(len(docs))
+            total_idf += idf
+            for slot, tf in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[slot] / avg_length)
+                scores[slot] = scores.get(slot, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                matched[slot] = matched.get(slot, 0.0) + idf
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [LexicalHit(self._ids[slot], score, matched[slot] / total_idf) for slot, score in ranked]
+
+    def persist(self, path: str) -> None:
+        with self._lock:
+            # 重新編號，移除刪除後留下的空位
+            renumber = {slot: i for i, slot in enumerate(sorted(self._slots.values()))}
+            data = {
+                "k1": self.k1,
+                "b": self.b,
+                "ids": [self._ids[slot] for slot in sorted(self._slots.values())],
+                "lengths": [self._lengths[slot] for slot in sorted(self._slots.values())],
+                # term → [編號, 詞頻, 編號, 詞頻, ...]
+                "postings": {
+                    term: [value for slot, tf in docs.items() for value in (renumber[slot], tf)]
+                    for term, docs in self._postings.items()
+                },
+            }
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["LexicalIndex"]:
+        """讀取保存的索引；檔案不存在時回傳 None"""
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"])
+        index._ids = data["ids"]
+        index._slots = {node_id: slot for slot, node_id in enumerate(index._ids)}
+        index._lengths = data["lengths"]
+        index._total_length = sum(index._lengths)
+        index._postings = {
+            term: dict(zip(flat[::2], flat[1::2])) for term, flat in data["postings"].items()
+        }
+        return index
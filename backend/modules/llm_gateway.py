@@ -0,0 +1,382 @@
+"""
+Gemini 與 TEI 呼叫的集中流量控制
+所有 LLM 與嵌入請求都經過每個模型各自的 Gateway：
+
+- 令牌桶限制每秒請求數，並限制同時進行中的請求數
+- 優先等級：互動對話（INTERACTIVE）> 背景解析（BACKGROUND）> 批次建索引（BATCH），
+  放行時一律先處理較高等級的等待者
+- 每個等級的等待佇列有上限；佇列已滿，或預估等待時間超過請求期限時立即拒絕（Overloaded），
+  不讓請求在佇列中空等到逾時
+- 上游回應 429／503 時依 Retry-After 或指數退避（含隨機抖動）重試，重試同樣需重新取得令牌
+- RouteBudget 限制單一路由同時處理的請求數，超過時直接拒絕
+- 排隊與退避會阻塞執行緒，因此 LLM 與嵌入的同步呼叫一律以 run_in_llm_threadpool 執行，
+  使用獨立的執行緒名額，不佔用 FastAPI 預設的執行緒池（anyio 預設 40 條），
+  排隊中的 LLM 請求不會拖慢 /api/lunar、/api/die 與骨灰罐繪製等同步路由
+
+優先等級與期限以 ContextVar 傳遞（llm_priority），路由設定後，
+執行緒中的 LlamaIndex 呼叫（經 GatedTransport 發出的 HTTP 請求）會沿用。
+
+環境變數（括號內為預設值）：
+- GEMINI_RPS（5）、GEMINI_BURST（10）、GEMINI_MAX_CONCURRENCY（16）
+- TEI_RPS（50）、TEI_BURST（50）、TEI_MAX_CONCURRENCY（8）
+- LLM_QUEUE_LIMIT（64）：互動與背景等級各自的佇列上限；批次等級不設限
+- LLM_MAX_ATTEMPTS（4）：遇到 429／503 時的最多嘗試次數
+- LLM_THREAD_LIMIT（160）：LLM 與嵌入呼叫專用的執行緒數；應不小於
+  2 × LLM_QUEUE_LIMIT + GEMINI_MAX_CONCURRENCY + TEI_MAX_CONCURRENCY，
+  讓等待時間由 Gateway 的佇列上限與期限控制，而不是在取得執行緒前就無限期排隊
+"""
+
+import functools
+import heapq
+import itertools
+import logging
+import math
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+import anyio
+import httpx
+from anyio.lowlevel import RunVar
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = (429, 503)
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+    BATCH = 2
+
+
+# 各等級在佇列中等待（含重試）的預設期限（秒），None 表示不設限
+DEFAULT_DEADLINES = {
+    Priority.INTERACTIVE: 30.0,
+    Priority.BACKGROUND: 60.0,
+    Priority.BATCH: None,
+}
+
+
+class Overloaded(Exception):
+    """流量控制拒絕了請求；retry_after 為建議的重試秒數"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+_priority: ContextVar[Priority] = ContextVar("llm_priority", default=Priority.INTERACTIVE)
+_deadline: ContextVar[Optional[float]] = ContextVar("llm_deadline", default=None)
+
+
+@contextmanager
+def llm_priority(priority: Priority, timeout: Optional[float] = -1) -> Iterator[None]:
+    """
+    設定此區塊內 LLM／嵌入請求的優先等級與期限（秒，自現在起算）。
+    timeout 省略時使用該等級的預設期限，None 表示不設期限。
+    """
+    if timeout == -1:
+        timeout = DEFAULT_DEADLINES[priority]
+    priority_token = _priority.set(priority)
+    deadline_token = _deadline.set(time.monotonic() + timeout if timeout is not None else None)
+    try:
+        yield
+    finally:
+        _priority.reset(priority_token)
+        _deadline.reset(deadline_token)
+
+
+class TokenBucket:
+    """令牌桶；呼叫端需自行加鎖"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """距離下一個令牌可用的秒數"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class Gateway:
+    """單一模型（上游服務）的流量控制"""
+
+    def __init__(self, name: str, rate: float, burst: float, max_concurrency: int,
+                 queue_limit: int = 64, max_attempts: int = 4):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.queue_limits = {
+            Priority.INTERACTIVE: queue_limit,
+            Priority.BACKGROUND: queue_limit,
+            Priority.BATCH: None,
+        }
+        self._bucket = TokenBucket(rate, burst)
+        self._cond = threading.Condition()
+        self._waiters: list = []  # (priority, 序號) 的 heap
+        self._queued = {priority: 0 for priority in Priority}
+        self._seq = itertools.count()
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.retries = 0
+
+    def _estimated_wait(self, position: int) -> float:
+        """排在第 position 位（0 為隊首）的請求大約要等多久"""
+        return position / self._bucket.rate
+
+    def acquire(self, priority: Priority, deadline: Optional[float]) -> None:
+        """等待輪到此請求；佇列已滿或無法在期限內輪到時拋出 Overloaded"""
+        with self._cond:
+            limit = self.queue_limits[priority]
+            if limit is not None and self._queued[priority] >= limit:
+                self.shed += 1
+                raise Overloaded(f"{self.name} 佇列已滿", self._estimated_wait(len(self._waiters)))
+            ahead = sum(1 for p, _ in self._waiters if p <= priority)
+            if deadline is not None and time.monotonic() + self._estimated_wait(ahead) > deadline:
+                self.shed += 1
+                raise Overloaded(f"{self.name} 無法在期限內處理", self._estimated_wait(ahead))
+
+            entry = (int(priority), next(self._seq))
+            heapq.heappush(self._waiters, entry)
+            self._queued[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if self._waiters[0] == entry and self.in_flight < self.max_concurrency:
+                        wait = self._bucket.wait_time(now)
+                        if wait == 0:
+                            self._bucket.take()
+                            self.in_flight += 1
+                            self.admitted += 1
+                            return
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0 or (wait is not None and wait > remaining):
+                            self.shed += 1
+                            raise Overloaded(f"{self.name} 等待逾時", max(wait or 0.0, 1.0))
+                        wait = remaining if wait is None else wait
+                    self._cond.wait(timeout=wait)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._queued[priority] -= 1
+                # 隊首改變，喚醒其他等待者重新檢查
+                self._cond.notify_all()
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def backoff(self, attempt: int, retry_after: Optional[float], deadline: Optional[float]) -> None:
+        """重試前等待；超過期限時拋出 Overloaded"""
+        delay = retry_after if retry_after is not None else min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+        delay = random.uniform(delay / 2, delay * 1.5)  # 抖動，避免所有請求同時重試
+        if deadline is not None and time.monotonic() + delay > deadline:
+            raise Overloaded(f"{self.name} 上游持續忙碌", delay)
+        with self._cond:
+            self.retries += 1
+        time.sleep(delay)
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "in_flight": self.in_flight,
+                "queued": len(self._waiters),
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "retries": self.retries,
+            }
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """回應內容讀取完畢（或關閉）時才釋放名額，串流生成期間仍計入同時請求數"""
+
+    def __init__(self, stream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            if not self._released:
+                self._released = True
+                self._release()
+
+
+class GatedTransport(httpx.BaseTransport):
+    """讓 httpx 請求經過 Gateway；GET（如模型資訊）不計入"""
+
+    def __init__(self, gateway: Gateway, transport: Optional[httpx.BaseTransport] = None):
+        self.gateway = gateway
+        self._transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method == "GET":
+            return self._transport.handle_request(request)
+
+        priority, deadline = _priority.get(), _deadline.get()
+        for attempt in range(self.gateway.max_attempts):
+            self.gateway.acquire(priority, deadline)
+            try:
+                response = self._transport.handle_request(request)
+            except BaseException:
+                self.gateway.release()
+                raise
+            if response.status_code not in RETRYABLE_STATUS:
+                return httpx.Response(
+                    status_code=response.status_code,
+                    headers=response.headers,
+                    stream=_ReleasingStream(response.stream, self.gateway.release),
+                    extensions=response.extensions,
+                )
+            response.close()
+            self.gateway.release()
+            retry_after = _retry_after(response)
+            logger.warning(f"{self.gateway.name} 回應 {response.status_code}，第 {attempt + 1} 次嘗試")
+            if attempt + 1 < self.gateway.max_attempts:
+                self.gateway.backoff(attempt, retry_after, deadline)
+        raise Overloaded(
+            f"{self.gateway.name} 上游持續忙碌", retry_after if retry_after is not None else BACKOFF_MAX
+        )
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+_gateways: Dict[Tuple[str, str], Gateway] = {}
+_gateways_lock = threading.Lock()
+
+_SERVICE_DEFAULTS = {
+    # 服務 → (每秒請求數, 突發量, 同時請求數)
+    "gemini": (5.0, 10.0, 16),
+    "tei": (50.0, 50.0, 8),
+}
+
+
+def get_gateway(service: str, model: str) -> Gateway:
+    """取得（或建立）指定服務與模型的 Gateway，設定來自 <SERVICE>_RPS 等環境變數"""
+    key = (service, model)
+    with _gateways_lock:
+        gateway = _gateways.get(key)
+        if gateway is None:
+            rate, burst, concurrency = _SERVICE_DEFAULTS[service]
+            prefix = service.upper()
+            gateway = _gateways[key] = Gateway(
+                name=f"{service}:{model}",
+                rate=float(os.getenv(f"{prefix}_RPS", rate)),
+                burst=float(os.getenv(f"{prefix}_BURST", burst)),
+                max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", concurrency)),
+                queue_limit=int(os.getenv("LLM_QUEUE_LIMIT", "64")),
+                max_attempts=int(os.getenv("LLM_MAX_ATTEMPTS", "4")),
+            )
+        return gateway
+
+
+def gateway_stats() -> Dict[str, int]:
+    """所有 Gateway 的統計，欄位名稱為 <服務:模型>_<欄位>"""
+    with _gateways_lock:
+        gateways = list(_gateways.values())
+    return {
+        f"{gateway.name}_{field}": value
+        for gateway in gateways
+        for field, value in gateway.stats().items()
+    }
+
+
+LLM_THREAD_LIMIT = int(os.getenv("LLM_THREAD_LIMIT", "160"))
+# 每個事件迴圈各自一個 limiter（與 anyio 預設執行緒池的做法相同）
+_llm_limiter: RunVar[anyio.CapacityLimiter] = RunVar("llm_thread_limiter")
+
+
+def _get_llm_limiter() -> anyio.CapacityLimiter:
+    try:
+        return _llm_limiter.get()
+    except LookupError:
+        limiter = anyio.CapacityLimiter(LLM_THREAD_LIMIT)
+        _llm_limiter.set(limiter)
+        return limiter
+
+
+async def run_in_llm_threadpool(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    在 LLM 專用的執行緒名額中執行同步的 LLM／嵌入呼叫（ContextVar 會一併帶入），
+    Gateway 排隊與退避時阻塞的執行緒不佔用其他路由的執行緒池
+    """
+    return await anyio.to_thread.run_sync(
+        functools.partial(func, *args, **kwargs), limiter=_get_llm_limiter()
+    )
+
+
+_route_budgets: list = []
+
+
+class RouteBudget:
+    """限制單一路由同時處理的請求數（同一事件迴圈內）；超過時立即拋出 Overloaded"""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self.rejected = 0
+        _route_budgets.append(self)
+
+    async def run(self, awaitable):
+        if self.active >= self.limit:
+            self.rejected += 1
+            awaitable.close()
+            raise Overloaded(f"{self.name} 同時處理的請求已達上限", 1.0)
+        self.active += 1
+        try:
+            return await awaitable
+        finally:
+            self.active -= 1
+
+
+def route_budget_stats() -> Dict[str, int]:
+    """所有路由的處理中與拒絕數，欄位名稱為 <路由>_<欄位>"""
+    stats = {}
+    for budget in _route_budgets:
+        stats[f"{budget.name}_active"] = budget.active
+        stats[f"{budget.name}_rejected"] = budget.rejected
+    return stats
+
+
+def retry_after_header(error: Overloaded) -> Dict[str, str]:
+    """503 回應的 Retry-After 標頭（整數秒）"""
+    return {"Retry-After": str(max(1, math.ceil(error.retry_after)))}
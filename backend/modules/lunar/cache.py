@@ -0,0 +1,145 @@
+"""
+每日農曆資訊快取
+以陽曆日期為鍵，快取不可變的 LunarInfo，供 /api/lunar、/api/die、ICS 匯出與吉日推薦共用。
+
+環境變數：
+- LUNAR_CACHE_SIZE：記憶體快取的最大筆數（預設 4096）
+- LUNAR_CACHE_DB：共用的 SQLite 檔案路徑；設定後多個 uvicorn worker 共用同一份磁碟快取
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+from modules.models import LunarInfo
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 4096
+
+
+class _DiskTier:
+    """以 SQLite 儲存序列化後的 LunarInfo，跨 process 共用"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS lunar_info (solar TEXT PRIMARY KEY, payload TEXT NOT NULL)"
+        )
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        # preload 模式下於 fork 前建立的連線不可在 worker 中沿用，以 pid 判斷是否需要重新連線
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.conn = sqlite3.connect(self.path, timeout=5)
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    def get(self, key: str) -> Optional[LunarInfo]:
+        row = self._connection().execute(
+            "SELECT payload FROM lunar_info WHERE solar = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return LunarInfo.model_validate_json(row[0])
+
+    def put(self, key: str, value: LunarInfo) -> None:
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR IGNORE INTO lunar_info (solar, payload) VALUES (?, ?)",
+            (key, value.model_dump_json()),
+        )
+        conn.commit()
+
+
+class LunarInfoCache:
+    """有容量上限的 LRU 快取，附命中、未命中與淘汰計數"""
+
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE, disk_path: Optional[str] = None):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, LunarInfo]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_hits = 0
+        self._disk: Optional[_DiskTier] = None
+        if disk_path:
+            try:
+                self._disk = _DiskTier(disk_path)
+            except sqlite3.Error as e:
+                logger.warning(f"無法開啟農曆磁碟快取 {disk_path}: {e}")
+
+    def get_or_compute(self, key: str, compute: Callable[[], LunarInfo]) -> LunarInfo:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        value = self._load_from_disk(key)
+        if value is None:
+            value = compute()
+            self._store_to_disk(key, value)
+
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def _load_from_disk(self, key: str) -> Optional[LunarInfo]:
+        if self._disk is None:
+            return None
+        try:
+            value = self._disk.get(key)
+        except sqlite3.Error as e:
+            logger.warning(f"讀取農曆磁碟快取失敗: {e}")
+            return None
+        if value is not None:
+            with self._lock:
+                self.disk_hits += 1
+        return value
+
+    def _store_to_disk(self, key: str, value: LunarInfo) -> None:
+        if self._disk is None:
+            return
+        try:
+            self._disk.put(key, value)
+        except sqlite3.Error as e:
+            logger.warning(f"寫入農曆磁碟快取失敗: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_hits": self.disk_hits,
+                "disk_path": self._disk.path if self._disk else None,
+            }
+
+
+lunar_info_cache = LunarInfoCache(
+    maxsize=int(os.getenv("LUNAR_CACHE_SIZE", DEFAULT_CACHE_SIZE)),
+    disk_path=os.getenv("LUNAR_CACHE_DB") or None,
+)
@@ -0,0 +1,66 @@
+"""
+農民曆用語簡繁轉換
+lunar_python 輸出的宜忌、干支、生肖、節氣、沖煞等用語屬於封閉集合，
+啟動時一次轉換成對照表，請求時只做字典查詢；
+對照表以外的字串（如農曆日期全名）交由有上限的 LRU 快取處理。
+"""
+
+from functools import lru_cache
+from typing import Dict, Set
+
+from lunar_python import Lunar
+from lunar_python.util import LunarUtil
+from opencc import OpenCC
+
+from modules.metrics import span
+
+cc = OpenCC('s2t')  # 簡體轉繁體
+
+# 對照表以外字串的快取上限
+FALLBACK_CACHE_SIZE = 4096
+
+
+def _almanac_vocabulary() -> Set[str]:
+    """收集 lunar_python 農民曆用語的完整集合"""
+    vocab: Set[str] = {"无"}
+    # 宜忌事項：以公開的 getDayYi／getDayJi 列舉所有月干支 × 日干支的組合（約 0.4 秒）
+    for month_gan_zhi in LunarUtil.JIA_ZI:
+        for day_gan_zhi in LunarUtil.JIA_ZI:
+            vocab.update(LunarUtil.getDayYi(month_gan_zhi, day_gan_zhi))
+            vocab.update(LunarUtil.getDayJi(month_gan_zhi, day_gan_zhi))
+    # 天干、地支、六十甲子、生肖
+    vocab.update(LunarUtil.GAN)
+    vocab.update(LunarUtil.ZHI)
+    vocab.update(LunarUtil.JIA_ZI)
+    vocab.update(LunarUtil.SHENGXIAO)
+    # 節氣
+    vocab.update(Lunar.JIE_QI)
+    vocab.update(Lunar.JIE_QI_IN_USE)
+    # 沖煞描述，格式同 Lunar.getDayChongDesc()，如「(庚午)马」
+    for zhi_index, zhi in enumerate(LunarUtil.ZHI[1:]):
+        shengxiao = LunarUtil.SHENGXIAO[zhi_index + 1]
+        for gan in LunarUtil.GAN[1:]:
+            vocab.add(f"({gan}{zhi}){shengxiao}")
+    return vocab
+
+
+def _build_table() -> Dict[str, str]:
+    return {text: cc.convert(text) for text in _almanac_vocabulary()}
+
+
+_TABLE = _build_table()
+
+
+@lru_cache(maxsize=FALLBACK_CACHE_SIZE)
+def _convert_fallback(text: str) -> str:
+    # 只量測實際呼叫 OpenCC 的情況，對照表與 LRU 命中不計
+    with span("opencc.convert"):
+        return cc.convert(text)
+
+
+def to_traditional(text: str) -> str:
+    """簡體轉繁體：先查預先計算的對照表，查無再走 LRU 快取的 OpenCC 轉換"""
+    converted = _TABLE.get(text)
+    if converted is None:
+        converted = _convert_fallback(text)
+    return converted
@@ -0,0 +1,145 @@
+"""
+純曆法端點的 HTTP 快取
+/api/lunar、/api/die 的回應只取決於查詢參數與曆法資料版本，
+因此可發出強 ETag 與長效 Cache-Control，支援條件式 GET (304)，
+並將序列化後的回應內容快取起來，重複請求時不必再經過 Pydantic 序列化。
+
+ETag 與快取鍵由端點實際使用、且已驗證並正規化的參數產生，而非原始查詢字串：
+traditional=1 與 traditional=true、2024-1-5 與 2024-01-05 得到相同的 ETag，
+未知的查詢參數也不會產生新的快取項目。
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from importlib import metadata
+from typing import Any, Callable, Dict, Optional, Union
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+# LunarInfo / RitualDates 結構或計算規則改變時遞增
+ALMANAC_SCHEMA_REVISION = 1
+
+# 回應於瀏覽器與 CDN 的快取時間（秒）
+CACHE_MAX_AGE = 30 * 24 * 3600
+CACHE_CONTROL = f"public, max-age={CACHE_MAX_AGE}"
+
+# 序列化後回應內容的快取上限
+BODY_CACHE_SIZE = 2048
+
+
+def _package_version(name: str) -> str:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+# 曆法資料版本：lunar_python 與 OpenCC 的版本加上本專案的結構版本
+ALMANAC_DATA_VERSION = (
+    f"lunar_python-{_package_version('lunar_python')}"
+    f"+opencc-{_package_version('opencc')}"
+    f"+rev{ALMANAC_SCHEMA_REVISION}"
+)
+
+
+class _BodyCache:
+    """ETag → 已序列化 JSON 的 LRU 快取"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            body = self._data.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key: str, body: bytes) -> None:
+        with self._lock:
+            self._data[key] = body
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+body_cache = _BodyCache(BODY_CACHE_SIZE)
+
+
+def canonical_date(value: str) -> str:
+    """將 YYYY-M-D 等寫法正規化為 YYYY-MM-DD；無法解析時原樣回傳（交由端點回報錯誤，錯誤回應不快取）"""
+    try:
+        return datetime.strptime(value.strip(), "%Y-%m-%d").date().isoformat()
+    except ValueError:
+        return value
+
+
+def make_etag(path: str, params: Dict[str, Any]) -> str:
+    """以路徑、正規化後的參數與曆法資料版本產生強 ETag"""
+    canonical = "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+    digest = hashlib.sha256(
+        f"{ALMANAC_DATA_VERSION}|{path}|{canonical}".encode("utf-8")
+    ).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """判斷 If-None-Match 是否命中（依 RFC 9110 使用弱比較）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def cached_json_response(
+    request: Request,
+    params: Dict[str, Any],
+    build: Callable[[], Union[BaseModel, Response]],
+    extra_headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """
+    回傳帶 ETag 與 Cache-Control 的 JSON 回應。
+    params 為決定回應內容的參數（已驗證、正規化），作為 ETag 與快取鍵。
+    build 回傳 Response 時視為錯誤回應，原樣傳回且不快取。
+    extra_headers 會一併附在 200 與 304 回應上（如 Link 預先載入提示）。
+    """
+    etag = make_etag(request.url.path, params)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, **(extra_headers or {})}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    body = body_cache.get(etag)
+    if body is None:
+        payload = build()
+        if isinstance(payload, Response):
+            return payload
+        body = payload.model_dump_json().encode("utf-8")
+        body_cache.put(etag, body)
+
+    return Response(content=body, media_type="application/json", headers=headers)
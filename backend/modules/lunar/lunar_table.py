@@ -0,0 +1,145 @@
+"""
+農曆月份對照表
+預先計算支援範圍內每個農曆月的起始陽曆日與天數，
+讓對年等周年日期可直接查表求得，請求時不再呼叫 lunar_python。
+超出表格範圍的日期（如 1901-02-19 以前）改由 lunar_python 逐次計算，結果與查表相同。
+
+邊界規則：
+- 閏月過世者，周年以同數字的本月（非閏月）計算。
+- 目標月份天數不足（如小月無三十），以該月最後一日代之。
+"""
+
+from array import array
+from datetime import date
+from threading import Lock
+from typing import Dict, List, NamedTuple, Tuple
+
+from lunar_python import LunarMonth, LunarYear, Solar
+
+# 支援的農曆年份範圍（含頭尾）
+MIN_LUNAR_YEAR = 1901
+MAX_LUNAR_YEAR = 2099
+
+# 儒略日與 Python date ordinal 的差值（JD 2415051 = 1900-01-31）
+_JULIAN_DAY_OFFSET = 1721425
+
+
+class LunarYmd(NamedTuple):
+    """農曆年月日（月份為正數，閏月以 leap 標示）"""
+    year: int
+    month: int
+    day: int
+    leap: bool
+
+    def to_digits(self) -> str:
+        """轉為 YYYY-MM-DD 格式的數字字串"""
+        return f"{self.year:04d}-{self.month:02d}-{self.day:02d}"
+
+
+class _MonthEntry(NamedTuple):
+    year: int
+    month: int
+    leap: bool
+    first_ordinal: int
+    day_count: int
+
+
+class LunarMonthTable:
+    """農曆月 ↔ 陽曆日期的預先計算對照表"""
+
+    def __init__(self, min_year: int = MIN_LUNAR_YEAR, max_year: int = MAX_LUNAR_YEAR):
+        self.min_year = min_year
+        self.max_year = max_year
+        self._months: List[_MonthEntry] = []
+        self._index: Dict[Tuple[int, int, bool], int] = {}
+
+        for year in range(min_year, max_year + 1):
+            for lunar_month in LunarYear.fromYear(year).getMonthsInYear():
+                # lunar-python 的閏月為負數
+                month = abs(lunar_month.getMonth())
+                leap = lunar_month.isLeap()
+                self._index[(year, month, leap)] = len(self._months)
+                self._months.append(_MonthEntry(
+                    year=year,
+                    month=month,
+                    leap=leap,
+                    first_ordinal=lunar_month.getFirstJulianDay() - _JULIAN_DAY_OFFSET,
+                    day_count=lunar_month.getDayCount(),
+                ))
+
+        # 每一個陽曆日對應到所屬農曆月的索引，反查時免去搜尋
+        self._first_ordinal = self._months[0].first_ordinal
+        last = self._months[-1]
+        self._last_ordinal = last.first_ordinal + last.day_count - 1
+        self._day_to_month = array("H")
+        for idx, entry in enumerate(self._months):
+            self._day_to_month.extend([idx] * entry.day_count)
+
+    @property
+    def first_solar(self) -> date:
+        return date.fromordinal(self._first_ordinal)
+
+    @property
+    def last_solar(self) -> date:
+        return date.fromordinal(self._last_ordinal)
+
+    def solar_to_lunar(self, solar: date) -> LunarYmd:
+        """陽曆日期轉農曆年月日"""
+        ordinal = solar.toordinal()
+        if not self._first_ordinal <= ordinal <= self._last_ordinal:
+            lunar = Solar.fromYmd(solar.year, solar.month, solar.day).getLunar()
+            return LunarYmd(lunar.getYear(), abs(lunar.getMonth()), lunar.getDay(), lunar.getMonth() < 0)
+        entry = self._months[self._day_to_month[ordinal - self._first_ordinal]]
+        return LunarYmd(entry.year, entry.month, ordinal - entry.first_ordinal + 1, entry.leap)
+
+    def lunar_to_solar(self, year: int, month: int, day: int, leap: bool = False) -> date:
+        """
+        農曆年月日轉陽曆日期。
+        指定的閏月不存在時改用本月；日數超過該月天數時以該月最後一日代之。
+        """
+        if not 1 <= month <= 12 or not 1 <= day <= 30:
+            raise ValueError(f"農曆日期不合法: {year}年{month}月{day}日")
+        if self.min_year <= year <= self.max_year:
+            idx = self._index.get((year, month, leap))
+            if idx is None and leap:
+                idx = self._index.get((year, month, False))
+            entry = self._months[idx]
+        else:
+            entry = self._compute_month(year, month, leap)
+        return date.fromordinal(entry.first_ordinal + min(day, entry.day_count) - 1)
+
+    @staticmethod
+    def _compute_month(year: int, month: int, leap: bool) -> _MonthEntry:
+        """表格範圍外的農曆月改由 lunar_python 計算"""
+        lunar_month = LunarMonth.fromYm(year, -month) if leap else None
+        if lunar_month is None:
+            lunar_month = LunarMonth.fromYm(year, month)
+        if lunar_month is None:
+            raise ValueError(f"無法計算農曆 {year}年{month}月")
+        return _MonthEntry(
+            year=year,
+            month=month,
+            leap=lunar_month.isLeap(),
+            first_ordinal=lunar_month.getFirstJulianDay() - _JULIAN_DAY_OFFSET,
+            day_count=lunar_month.getDayCount(),
+        )
+
+    def anniversary(self, death_date: date, years_to_add: int) -> date:
+        """計算周年（對年=1，三年=2）對應的陽曆日期"""
+        lunar = self.solar_to_lunar(death_date)
+        # 閏月過世者以本月計算周年
+        return self.lunar_to_solar(lunar.year + years_to_add, lunar.month, lunar.day, leap=False)
+
+
+_table = None
+_table_lock = Lock()
+
+
+def get_lunar_table() -> LunarMonthTable:
+    """取得共用的農曆月份對照表（首次呼叫時建立）"""
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                _table = LunarMonthTable()
+    return _table
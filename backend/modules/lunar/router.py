@@ -1,62 +1,149 @@
-from fastapi import APIRouter, Query, Form
+from fastapi import APIRouter, Query, Form, Request
 from fastapi.responses import JSONResponse, Response
-from lunar_python import Solar, Lunar
-from opencc import OpenCC
-from modules.models import GanZhi, LunarInfo, Date, RitualDates
-import re
-from datetime import datetime, timedelta
+from lunar_python import Solar
+from modules.models import GanZhi, LunarInfo, Date, RitualDates, LunarDayCell, LunarMonthGrid
+from modules.lunar.lunar_table import get_lunar_table, MIN_LUNAR_YEAR, MAX_LUNAR_YEAR
+from modules.lunar.converter import to_traditional
+from modules.lunar.cache import lunar_info_cache
+from modules.lunar.http_cache import cached_json_response, canonical_date, body_cache
+from modules.metrics import span
+from datetime import date as date_type, datetime, timedelta
 from ics import Calendar, Event
 from typing import Optional, Dict
 from pydantic import BaseModel
 
 
 router = APIRouter()
-cc = OpenCC('s2t')  # 簡體轉繁體
 
 class IcsExportRequest(BaseModel):
     events: Dict[str, str]
 
 """取得指定陽曆日期的詳細農曆資訊。"""
 @router.get("/lunar", response_model=LunarInfo)
-def get_lunar_endpoint(date: str = Query(..., description="格式：YYYY-MM-DD")) -> LunarInfo:
-    return get_lunar_info(date)
+def get_lunar_endpoint(request: Request, date: str = Query(..., description="格式：YYYY-MM-DD")):
+    date = canonical_date(date)
+    return cached_json_response(request, {"date": date}, lambda: get_lunar_info(date))
+
+"""取得月曆畫面整個月（含前後補滿週的日期）的精簡農曆資訊，並以 Link 提示預先載入前後月份。"""
+@router.get("/lunar/month", response_model=LunarMonthGrid)
+def get_lunar_month_endpoint(
+    request: Request,
+    year: int = Query(..., ge=MIN_LUNAR_YEAR, le=MAX_LUNAR_YEAR, description="陽曆年"),
+    month: int = Query(..., ge=1, le=12, description="陽曆月"),
+    week_start: int = Query(0, ge=0, le=1, description="每週起始日：0 為週日、1 為週一"),
+    fixed_weeks: bool = Query(False, description="固定回傳 6 週（42 天）"),
+):
+    links = []
+    for rel_year, rel_month in (_shift_month(year, month, -1), _shift_month(year, month, 1)):
+        if MIN_LUNAR_YEAR <= rel_year <= MAX_LUNAR_YEAR:
+            params = f"year={rel_year}&month={rel_month}&week_start={week_start}"
+            if fixed_weeks:
+                params += "&fixed_weeks=true"
+            links.append(f"<{request.url.path}?{params}>; rel=prefetch")
+    return cached_json_response(
+        request,
+        {"year": year, "month": month, "week_start": week_start, "fixed_weeks": fixed_weeks},
+        lambda: compute_month_grid(year, month, week_start, fixed_weeks),
+        extra_headers={"Link": ", ".join(links)} if links else None,
+    )
+
+def _shift_month(year: int, month: int, delta: int):
+    index = year * 12 + month - 1 + delta
+    return index // 12, index % 12 + 1
+
+def month_grid_range(year: int, month: int, week_start: int = 0, fixed_weeks: bool = False):
+    """月曆畫面的起訖日期：自該月第一天所在週的起始日，到最後一天所在週的結束日"""
+    first = date_type(year, month, 1)
+    next_year, next_month = _shift_month(year, month, 1)
+    last = date_type(next_year, next_month, 1) - timedelta(days=1)
+    # date.weekday()：週一為 0；換算為距離週起始日的天數
+    start = first - timedelta(days=(first.weekday() + 1 - week_start) % 7)
+    weeks = 6 if fixed_weeks else ((last - start).days // 7 + 1)
+    return start, start + timedelta(days=weeks * 7 - 1)
+
+@span("lunar.month_grid")
+def compute_month_grid(year: int, month: int, week_start: int = 0, fixed_weeks: bool = False) -> LunarMonthGrid:
+    start, end = month_grid_range(year, month, week_start, fixed_weeks)
+    cells = []
+    for offset in range((end - start).days + 1):
+        day = start + timedelta(days=offset)
+        info = get_lunar_info(day.isoformat())
+        cells.append(LunarDayCell(
+            日期=info.日期,
+            農曆=info.農曆,
+            閏月=info.閏月,
+            節氣=info.節氣,
+            宜=info.宜,
+            忌=info.忌,
+            沖煞=info.沖煞,
+            本月=day.month == month,
+        ))
+    return LunarMonthGrid(年=year, 月=month, 起始日期=start, 結束日期=end, 日期=cells)
+
+"""查詢每日農曆資訊快取的命中、未命中與淘汰統計。"""
+@router.get("/lunar/cache/stats")
+def get_lunar_cache_stats():
+    return {
+        **lunar_info_cache.stats(),
+        "response_cache": body_cache.stats(),
+    }
 
 def get_lunar_info(date: str) -> LunarInfo:
+    """取得指定陽曆日期（YYYY-MM-DD）的農曆資訊，結果於 process 內共用快取"""
     solar = Solar.fromYmd(*map(int, date.split("-")))
+    key = solar.toYmd()
+    return lunar_info_cache.get_or_compute(key, lambda: _compute_lunar_info(solar))
+
+@span("lunar.compute")
+def _compute_lunar_info(solar: Solar) -> LunarInfo:
     lunar = solar.getLunar()
+    # 直接取用 Lunar 物件的結構化欄位；lunar-python 的閏月為負數
+    lunar_year = lunar.getYear()
+    lunar_month = lunar.getMonth()
+    lunar_day = lunar.getDay()
     return LunarInfo(
         日期=Date(
-            lunar=lunar_str_to_digits(cc.convert(lunar.toString())),
-            solar=date
+            lunar=f"{lunar_year:04d}-{abs(lunar_month):02d}-{lunar_day:02d}",
+            solar=solar.toYmd()
         ),
-        農曆=cc.convert(lunar.toString()),
-        年=lunar.getYear(),
-        月=lunar.getMonth(),
-        日=lunar.getDay(),
-        節氣=cc.convert(lunar.getJieQi()),
-        宜=[cc.convert(item) for item in lunar.getDayYi()],
-        忌=[cc.convert(item) for item in lunar.getDayJi()],
-        沖煞=cc.convert(lunar.getChongDesc()),
+        農曆=to_traditional(lunar.toString()),
+        年=lunar_year,
+        月=abs(lunar_month),
+        日=lunar_day,
+        閏月=lunar_month < 0,
+        節氣=to_traditional(lunar.getJieQi()),
+        宜=tuple(to_traditional(item) for item in lunar.getDayYi()),
+        忌=tuple(to_traditional(item) for item in lunar.getDayJi()),
+        沖煞=to_traditional(lunar.getChongDesc()),
         干支=GanZhi(
-            年=cc.convert(lunar.getYearInGanZhi()),
-            月=cc.convert(lunar.getMonthInGanZhi()),
-            日=cc.convert(lunar.getDayInGanZhi())
+            年=to_traditional(lunar.getYearInGanZhi()),
+            月=to_traditional(lunar.getMonthInGanZhi()),
+            日=to_traditional(lunar.getDayInGanZhi())
         ),
-        生肖=cc.convert(lunar.getYearShengXiao()),
+        生肖=to_traditional(lunar.getYearShengXiao()),
     )
 
 """根據亡者歿日計算相關祭祀日期（頭七、百日、對年等）。"""
 @router.get("/die", response_model=RitualDates)
 def ritual_dates(
+    request: Request,
     date: str = Query(..., description="格式：YYYY-MM-DD"),
     traditional: bool = Query(True, description="作七模式: 是否為traditional (預設為True)"),
-) -> RitualDates:
+):
     """
     回傳所有祭祀日期（頭七~滿七、百日、對年），支援傳統49天與現代24天模式。
     """
+    date = canonical_date(date)
+    return cached_json_response(
+        request, {"date": date, "traditional": traditional}, lambda: compute_ritual_dates(date, traditional)
+    )
+
+def compute_ritual_dates(date: str, traditional: bool = True):
+    """計算祭祀日期；輸入錯誤時回傳 422、其他錯誤回傳 500 的 JSONResponse"""
     from datetime import datetime, timedelta
     try:
         death_date = datetime.strptime(date, "%Y-%m-%d")
+        table = get_lunar_table()
         ritual_dates_dict = {}
 
         # 作七日期
@@ -82,27 +169,24 @@ def ritual_dates(
             ]
 
         for name, offset in offsets:
-            solar_str = (death_date + timedelta(days=offset)).strftime("%Y-%m-%d")
-            lunar_info = get_lunar_info(solar_str)
+            solar_day = (death_date + timedelta(days=offset)).date()
             ritual_dates_dict[name] = Date(
-                lunar=lunar_info.日期.lunar,
-                solar=solar_str
+                lunar=table.solar_to_lunar(solar_day).to_digits(),
+                solar=solar_day.isoformat()
             )
 
         # 百日：陽曆加99天，不考慮閏月
-        solar_bairi = (death_date + timedelta(days=99)).strftime("%Y-%m-%d")
-        lunar_bairi = get_lunar_info(solar_bairi).日期.lunar
+        solar_bairi = (death_date + timedelta(days=99)).date()
         ritual_dates_dict["百日"] = Date(
-            lunar=lunar_bairi,
-            solar=solar_bairi
+            lunar=table.solar_to_lunar(solar_bairi).to_digits(),
+            solar=solar_bairi.isoformat()
         )
 
-        # 對年：農曆同月同日，遇閏月提前
-        dui_nian = get_anniversary_date(date, 1)
-        lunar_duinian = get_lunar_info(dui_nian).日期.lunar
+        # 對年：農曆同月同日，閏月以本月計，小月無三十以廿九代之
+        dui_nian = table.anniversary(death_date.date(), 1)
         ritual_dates_dict["對年"] = Date(
-            lunar=lunar_duinian,
-            solar=dui_nian
+            lunar=table.solar_to_lunar(dui_nian).to_digits(),
+            solar=dui_nian.isoformat()
         )
 
         return RitualDates(**ritual_dates_dict)
@@ -140,7 +224,8 @@ def export_ritual_dates_ics(request: IcsExportRequest):
                     pass
 
         # 產生 .ics 內容並回傳
-        ics_content = str(cal)
+        with span("ics.serialize"):
+            ics_content = str(cal)
         return Response(
             content=ics_content,
             media_type="text/calendar",
@@ -152,102 +237,13 @@ def export_ritual_dates_ics(request: IcsExportRequest):
 def get_anniversary_date(death_solar_date: str, years_to_add: int):
     """
     計算周年（如對年、三年）對應的陽曆日期，處理閏月、大小月等邊界情況。
+    閏月過世者以本月計算；目標月份無該日（如小月無三十）時以該月最後一日代之。
     :param death_solar_date: 歿日（陽曆，格式 YYYY-MM-DD）
     :param years_to_add: 幾周年（如對年=1，三年=2）
     :return: 對應周年的陽曆日期（YYYY-MM-DD）
     """
     try:
-        # 1. 取得歿日的農曆資訊
-        lunar_obj = get_lunar_info(death_solar_date)
-        
-        death_lunar_year = lunar_obj.年
-        death_lunar_month = lunar_obj.月 # lunar-python 的閏月為負數
-        death_lunar_day = lunar_obj.日
-
-        # 如果是閏月，計算時視為正常月份
-        abs_lunar_month = abs(death_lunar_month)
-
-        # 2. 查詢目標年份的閏月資訊
-        target_year = death_lunar_year + years_to_add
-
-        # 判斷平閏年
-        # is_leap = (target_year % 4 == 0 and target_year % 100 != 0) or (target_year % 400 == 0)
-
-        target_lunar_month = abs_lunar_month
-
-        # 3. 產生新的農曆日期物件
-        final_lunar_obj = Lunar.fromYmd(target_year, target_lunar_month, death_lunar_day)
-        
-        # 4. 轉換回陽曆並回傳
-        return final_lunar_obj.getSolar().toYmd()
+        death_date = datetime.strptime(death_solar_date, "%Y-%m-%d").date()
+        return get_lunar_table().anniversary(death_date, years_to_add).isoformat()
     except Exception as e:
         raise ValueError(f"周年日期計算失敗: {e}")
-
-def lunar_str_to_digits(lunar_str: str) -> str:
-    """
-    將農曆日期字串（如「二〇二五年五月初六」）轉為純數字（如「2025-05-06」）。
-    只保留年月日的數字部分。
-    """
-    cn_num_map = {
-        "〇": "0", "零": "0", "一": "1", "二": "2", "三": "3", "四": "4", "五": "5",
-        "六": "6", "七": "7", "八": "8", "九": "9"
-    }
-    cn_month_day_map = {
-        "正": "1", "十": "10", "冬": "11", "臘": "12",
-        "廿": "20", "卅": "30"
-    }
-
-    year_str = ""
-    month_str = ""
-    day_str = ""
-
-    # 年
-    year_match = re.search(r"^(.*?)年", lunar_str)
-    if year_match:
-        for char_cn in year_match.group(1):
-            year_str += cn_num_map.get(char_cn, "")
-
-    # 月
-    month_match = re.search(r"年(閏)?(.*?)月", lunar_str)
-    if month_match:
-        raw_month_cn = month_match.group(2)
-        if raw_month_cn in cn_month_day_map:
-            month_str = cn_month_day_map[raw_month_cn]
-        else:
-            month_str = cn_num_map.get(raw_month_cn, "")
-        if month_str and len(month_str) == 1:
-            month_str = "0" + month_str
-
-
-    # 日
-    day_match = re.search(r"月(.+)", lunar_str)
-    if day_match:
-        raw_day_cn = day_match.group(1).replace("日", "").strip()
-        if not raw_day_cn:
-            day_str = ""
-        elif raw_day_cn == "初十":
-            day_str = "10"
-        elif raw_day_cn.startswith("初"):
-            day_str = "0" + cn_num_map.get(raw_day_cn[1], "") if len(raw_day_cn) == 2 and raw_day_cn[1] in cn_num_map else ""
-        elif raw_day_cn == "十":
-            day_str = "10"
-        elif raw_day_cn == "廿" or raw_day_cn == "二十":
-            day_str = "20"
-        elif raw_day_cn == "卅" or raw_day_cn == "三十":
-            day_str = "30"
-        elif raw_day_cn.startswith("卅"):
-            day_str = "3" + cn_num_map.get(raw_day_cn[1], "") if len(raw_day_cn) == 2 and raw_day_cn[1] in cn_num_map else ""
-        elif raw_day_cn.startswith("廿"):
-            day_str = "2" + cn_num_map.get(raw_day_cn[1], "") if len(raw_day_cn) == 2 and raw_day_cn[1] in cn_num_map else ""
-        elif raw_day_cn.startswith("十"):
-            day_str = "1" + cn_num_map.get(raw_day_cn[1], "") if len(raw_day_cn) == 2 and raw_day_cn[1] in cn_num_map else ""
-        else:
-            day_str = cn_num_map.get(raw_day_cn, "")
-            if day_str and len(day_str) == 1:
-                day_str = "0" + day_str
-            elif not day_str:
-                day_str = ""
-    else:
-        day_str = ""
-
-    return f"{year_str}-{month_str}-{day_str}"
@@ -0,0 +1,276 @@
+"""
+請求層級的效能量測
+- 每個路由的延遲直方圖（以路由樣板為標籤，避免路徑參數造成標籤爆量）
+- 具名的階段計時（span），如農曆計算、OpenCC 轉換、逐日掃描、RAG 檢索與生成、Chrome 啟動、圖片渲染
+- /metrics 以 Prometheus 文字格式輸出
+  量測資料存放在各 process 的記憶體中。gunicorn 多 worker 部署時每次抓取只會由其中一個 worker 回應，
+  因此每筆序列都帶有 worker（pid）標籤，各 worker 的數值為獨立序列，
+  查詢時以 sum without (worker) (rate(...)) 等方式合併；單次抓取看到的並非全體 worker 的總和
+- 請求帶上 `X-Profile: 1` 標頭時，以 Server-Timing 標頭回傳該請求各階段的耗時與計數（如送入 LLM 的 token 數）
+"""
+
+import os
+import threading
+import time
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+PROFILE_HEADER = b"x-profile"
+
+# 預設的延遲分桶（秒），涵蓋微秒級的快取命中到數十秒的 LLM 呼叫
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """執行緒安全的累積直方圖"""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # 標籤值 → [各分桶計數..., 總和, 次數]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labelvalues, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _format_labels(self.labelnames, labelvalues, f'le="{bound}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            le = _format_labels(self.labelnames, labelvalues, 'le="+Inf"')
+            yield f"{self.name}_bucket{le} {series[-1]}"
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {series[-2]}"
+            yield f"{self.name}_count{labels} {series[-1]}"
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP 請求處理時間（秒）",
+    ("method", "route", "status"),
+)
+STAGE_LATENCY = Histogram(
+    "stage_duration_seconds",
+    "各處理階段的耗時（秒）",
+    ("stage",),
+)
+
+
+class Profile:
+    """單一請求的階段耗時累計（階段名稱 → 總秒數、次數）與計數"""
+
+    def __init__(self):
+        self.stages: Dict[str, List[float]] = {}
+        self.counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            entry = self.stages.get(name)
+            if entry is None:
+                self.stages[name] = [seconds, 1]
+            else:
+                entry[0] += seconds
+                entry[1] += 1
+
+    def count(self, name: str, value: int) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def server_timing(self, total: Optional[float] = None) -> str:
+        """轉為 Server-Timing 標頭值，dur 以毫秒表示；計數放在不帶 dur 的項目的 desc"""
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1][0])
+            counts = sorted(self.counts.items())
+        parts = [
+            f'{name};dur={seconds * 1000:.3f};desc="x{int(count)}"'
+            for name, (seconds, count) in stages
+        ]
+        parts.extend(f'{name};desc="{value}"' for name, value in counts)
+        if total is not None:
+            parts.append(f"total;dur={total * 1000:.3f}")
+        return ", ".join(parts)
+
+
+_profile: ContextVar[Optional[Profile]] = ContextVar("request_profile", default=None)
+_current_span: ContextVar[Optional[str]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[str]:
+    """目前所在的最內層 span 名稱"""
+    return _current_span.get()
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """記錄一個階段的耗時（供無法以 span 包住的事件式量測使用）"""
+    STAGE_LATENCY.observe(seconds, name)
+    profile = _profile.get()
+    if profile is not None:
+        profile.add(name, seconds)
+
+
+def record_count(name: str, value: int) -> None:
+    """累加目前請求的計數；只在啟用 X-Profile 時保留"""
+    profile = _profile.get()
+    if profile is not None:
+        profile.count(name, value)
+
+
+class span(ContextDecorator):
+    """
+    具名階段計時，可作為 context manager 或裝飾器使用：
+
+        with span("lunar.compute"):
+            ...
+
+        @span("urn.render")
+        def render(...): ...
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self._token = _current_span.set(self.name)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_stage(self.name, time.perf_counter() - self._start)
+        _current_span.reset(self._token)
+        return False
+
+    def _recreate_cm(self):
+        # 裝飾器可能被多執行緒同時呼叫，每次呼叫使用獨立的實例
+        return span(self.name)
+
+
+# 其他模組的統計資料（快取命中率等），輸出 /metrics 時呼叫
+_collectors: List[Callable[[], Iterable[str]]] = []
+
+
+def register_collector(collector: Callable[[], Iterable[str]]) -> None:
+    _collectors.append(collector)
+
+
+def stats_collector(name: str, help: str, stats: Callable[[], dict]) -> Callable[[], Iterable[str]]:
+    """將 stats() 回傳的數值欄位轉為 `<name>{field="..."}` 形式的 gauge"""
+
+    def collect() -> Iterable[str]:
+        yield f"# HELP {name} {help}"
+        yield f"# TYPE {name} gauge"
+        for field, value in stats().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield f'{name}{{field="{field}"}} {value}'
+
+    return collect
+
+
+def _with_worker_label(line: str, worker: str) -> str:
+    """在序列的標籤中加上 worker="<pid>"（註解行不變）"""
+    if line.startswith("#"):
+        return line
+    series, _, value = line.rpartition(" ")
+    label = f'worker="{worker}"'
+    if series.endswith("}"):
+        series = f"{series[:-1]},{label}}}"
+    else:
+        series = f"{series}{{{label}}}"
+    return f"{series} {value}"
+
+
+def render_metrics() -> str:
+    """輸出目前 process 的量測資料；preload 後 fork 的 worker 各有自己的 pid"""
+    lines: List[str] = []
+    lines.extend(REQUEST_LATENCY.render())
+    lines.extend(STAGE_LATENCY.render())
+    for collector in _collectors:
+        lines.extend(collector())
+    worker = str(os.getpid())
+    return "\n".join(_with_worker_label(line, worker) for line in lines) + "\n"
+
+
+def _route_label(scope) -> str:
+    """以路由樣板（如 /api/lunar）作為標籤；未匹配任何路由者歸為 unmatched"""
+    # 較新版 FastAPI 的 include_router 不再把 prefix 併入 route.path，完整樣板放在 effective_route_context
+    context = scope.get("fastapi", {}).get("effective_route_context")
+    path = getattr(context, "path", None) or getattr(scope.get("route"), "path", None)
+    return path or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware：記錄每個請求的延遲；請求帶有 X-Profile: 1 時啟用階段量測，
+    並以 Server-Timing 標頭回傳各階段耗時。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = None
+        for key, value in scope.get("headers", ()):
+            if key == PROFILE_HEADER and value.strip() in (b"1", b"true"):
+                profile = Profile()
+                break
+        token = _profile.set(profile)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if profile is not None:
+                    header = profile.server_timing(time.perf_counter() - start)
+                    message = {
+                        **message,
+                        "headers": [*message.get("headers", []), (b"server-timing", header.encode("latin-1"))],
+                    }
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - start, scope["method"], _route_label(scope), str(status)
+            )
+            _profile.reset(token)
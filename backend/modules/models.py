@@ -1,29 +1,57 @@
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, ConfigDict
+from typing import List, Tuple
 from datetime import date, datetime
 
 class GanZhi(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     年: str
     月: str
     日: str
 
 class Date(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     lunar: str
     solar: str
 
 class LunarInfo(BaseModel):
+    # 不可變，可安全地在快取中跨請求共用
+    model_config = ConfigDict(frozen=True)
+
     日期: Date
     農曆: str
-    年: int
-    月: int
-    日: int
+    年: int  # 農曆年
+    月: int  # 農曆月（1-12，閏月以「閏月」欄位標示）
+    日: int  # 農曆日
+    閏月: bool = False
     節氣: str
-    宜: List[str]
-    忌: List[str]
+    宜: Tuple[str, ...]
+    忌: Tuple[str, ...]
     沖煞: str
     干支: GanZhi
     生肖: str
 
+class LunarDayCell(BaseModel):
+    """月曆格子中的單日精簡農曆資訊"""
+    model_config = ConfigDict(frozen=True)
+
+    日期: Date
+    農曆: str
+    閏月: bool = False
+    節氣: str
+    宜: Tuple[str, ...]
+    忌: Tuple[str, ...]
+    沖煞: str
+    本月: bool  # 是否屬於查詢的月份（否則為前後月補滿週的日期）
+
+class LunarMonthGrid(BaseModel):
+    年: int
+    月: int
+    起始日期: date
+    結束日期: date
+    日期: List[LunarDayCell]  # 依序排列，每 7 筆為一週
+
 class RitualDates(BaseModel):
     頭七: Date
     二七: Date
@@ -0,0 +1,56 @@
+"""
+多 worker 部署的預先載入
+gunicorn 以 preload_app 在 master 匯入 main:app（同時載入向量索引與建立 RAG 引擎），
+fork 前再呼叫 preload_read_only_state() 建立唯讀資料，worker 以 copy-on-write 共用這些記憶體頁面。
+
+環境變數：
+- PRELOAD_LUNAR_DAYS：預先計算今日前後多少天的農曆資訊（預設 400，0 表示不預先計算）
+"""
+
+import logging
+import os
+import time
+from datetime import date, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+def _warm_lunar_days(days: int) -> int:
+    from modules.lunar.router import get_lunar_info
+
+    start = date.today() - timedelta(days=days // 4)
+    for offset in range(days):
+        get_lunar_info((start + timedelta(days=offset)).isoformat())
+    return days
+
+
+def preload_read_only_state() -> None:
+    """建立農曆對照表、常用日期的農曆資訊、骨灰罐樣板與字型"""
+    from modules.lunar.lunar_table import get_lunar_table
+    from modules.urn.router import urn_catalog
+    from modules.urn.templates import get_font, template_cache
+
+    started = time.perf_counter()
+    get_lunar_table()
+    warmed = _warm_lunar_days(int(os.getenv("PRELOAD_LUNAR_DAYS", "400")))
+
+    urn_catalog.refresh()
+    templates = 0
+    for info in urn_catalog.list():
+        if not info.has_layout:
+            continue
+        try:
+            template_cache.get(urn_catalog.path(info.filename))
+            templates += 1
+        except (OSError, ValueError) as e:
+            logger.warning(f"預先載入骨灰罐樣板 {info.filename} 失敗: {e}")
+    try:
+        get_font()
+    except RuntimeError as e:
+        # 缺少字型時只讓骨灰罐繪製逐次回應錯誤，不影響伺服器啟動
+        logger.warning(f"預先載入碑文字型失敗: {e}")
+
+    logger.info(
+        f"預先載入完成：農曆資訊 {warmed} 天、骨灰罐樣板 {templates} 個，"
+        f"耗時 {time.perf_counter() - started:.2f} 秒"
+    )
@@ -0,0 +1,117 @@
+"""
+以 Gemini 的 response schema 模式抽取結構化資料
+- 由 Pydantic 模型產生 schema，模型只會輸出符合結構的 JSON，不需再剝除 markdown
+- 串流接收時以 pydantic_core.from_json(allow_partial=True) 逐段驗證；
+  一旦內容不再是合法 JSON 的前綴即中止串流，不必等待剩餘的無效輸出
+- 最終結果驗證失敗時，只做一次有上限的修復呼叫；仍失敗才交由呼叫端使用備用方法
+"""
+
+import logging
+import threading
+from typing import Dict, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+from pydantic_core import from_json
+
+logger = logging.getLogger(__name__)
+
+Model = TypeVar("Model", bound=BaseModel)
+
+# 修復呼叫時附上的原始輸出長度上限（字元）與輸出 token 上限
+REPAIR_MAX_INPUT_CHARS = 4000
+REPAIR_MAX_OUTPUT_TOKENS = 1024
+
+REPAIR_PROMPT = """下列 JSON 因格式或型別錯誤而無法解析，請依指定的結構修正後回傳完整 JSON。
+保留原本的欄位值，無法判斷的欄位使用空字串、空 list 或 0。
+
+錯誤：{error}
+
+原始輸出：
+{raw}
+"""
+
+
+class ExtractionStats:
+    """結構化輸出的結果統計：schema 直接成功、修復後成功、僅取得部分欄位、交由備用方法"""
+
+    OUTCOMES = ("schema", "repaired", "partial", "fallback")
+
+    def __init__(self):
+        self._counts = {outcome: 0 for outcome in self.OUTCOMES}
+        self._lock = threading.Lock()
+        self.repair_calls = 0
+
+    def record(self, outcome: str, repaired: bool = False) -> None:
+        with self._lock:
+            self._counts[outcome] += 1
+            if repaired:
+                self.repair_calls += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._counts, "repair_calls": self.repair_calls}
+
+
+def json_schema_config(model_cls: Type[BaseModel], **overrides) -> dict:
+    """以 JSON schema 模式呼叫 Gemini 的 generation_config"""
+    return {
+        "response_mime_type": "application/json",
+        "response_schema": model_cls,
+        **overrides,
+    }
+
+
+def stream_structured(llm, prompt: str, model_cls: Type[Model], **config) -> Tuple[Optional[Model], str, dict, Optional[str]]:
+    """
+    以串流方式取得結構化輸出，邊接收邊驗證。
+    回傳 (完整驗證通過的模型或 None, 原始文字, 最後一次驗證通過的部分欄位, 錯誤訊息)
+    """
+    text = ""
+    partial: dict = {}
+    error: Optional[str] = None
+    stream = llm.stream_complete(prompt, generation_config=json_schema_config(model_cls, **config))
+    for chunk in stream:
+        text += chunk.delta or ""
+        if not text.strip():
+            continue
+        try:
+            candidate = from_json(text, allow_partial=True)
+        except ValueError as e:
+            # 已不是合法 JSON 的前綴，後續輸出也無法使用
+            error = f"JSON 格式錯誤: {e}"
+            break
+        if not isinstance(candidate, dict):
+            error = "輸出不是 JSON 物件"
+            break
+        try:
+            model_cls.model_validate(candidate)
+            partial = candidate
+        except ValidationError:
+            # 部分欄位可能尚未傳完（如缺少必填欄位），等待後續內容
+            pass
+
+    if error is None:
+        try:
+            return model_cls.model_validate_json(text), text, partial, None
+        except ValidationError as e:
+            error = str(e)
+        except ValueError as e:
+            error = f"JSON 格式錯誤: {e}"
+    return None, text, partial, error
+
+
+def repair_structured(llm, raw: str, error: str, model_cls: Type[Model]) -> Optional[Model]:
+    """對驗證失敗的輸出做一次修復呼叫"""
+    prompt = REPAIR_PROMPT.format(error=error[:500], raw=raw[:REPAIR_MAX_INPUT_CHARS])
+    try:
+        response = llm.complete(
+            prompt,
+            generation_config=json_schema_config(
+                model_cls, temperature=0, max_output_tokens=REPAIR_MAX_OUTPUT_TOKENS
+            ),
+        )
+        return model_cls.model_validate_json(str(response))
+    except Exception as e:
+        # 修復失敗時由呼叫端改用部分結果或備用方法，不讓整個請求失敗
+        logger.warning(f"結構化輸出修復失敗: {e}")
+        return None
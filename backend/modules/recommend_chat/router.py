@@ -1,11 +1,22 @@
+import asyncio
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import Optional
 from enum import Enum
 import os
 import logging
 from dotenv import load_dotenv
-from llama_index.llms.google_genai import GoogleGenAI
-from modules.utils import create_rag_engine
+from google.genai.types import GenerateContentConfig
+from llama_index.core import PromptTemplate
+from modules.utils import create_rag_engine, create_llm, CHAT_SESSION_TTL, llm_flight
+from modules.context_budget import token_report
+from modules.singleflight import make_key
+from modules.llm_gateway import (
+    Overloaded, Priority, RouteBudget, llm_priority, retry_after_header, run_in_llm_threadpool
+)
+from modules.metrics import span
+from modules.shared_state import get_shared_store
+from modules.recommend_chat.form_extraction import ExtractionStats, repair_structured, stream_structured
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
@@ -22,6 +33,8 @@ if not GEMINI_API_KEY:
 
 class ChatRequest(BaseModel):
     message: str
+    # 前端每個對話視窗產生一組 session_id，後端依此保存對話紀錄；未提供時為單輪對話
+    session_id: Optional[str] = Field(None, max_length=128)
 
 class ParseConversationRequest(BaseModel):
     conversation_text: str
@@ -51,6 +64,16 @@ class ParsedFormData(BaseModel):
     recommended_plan: str = ""
     special_requirements: str = ""
 
+class ChatTurnRequest(BaseModel):
+    message: str
+    session_id: Optional[str] = Field(None, max_length=128)
+    # 前端目前的表單內容（使用者可能手動修改過）；未提供時沿用該 session 上一輪的結果
+    form: Optional[ParsedFormData] = None
+
+class ChatTurnResult(BaseModel):
+    reply: str = Field(description="給家屬的回覆")
+    form: ParsedFormData = Field(description="更新後的完整表單資料")
+
 # 初始化 RAG 引擎 - 使用 recommend_chat router 的配置
 recommend_system_prompt = """角色設定:你是一位經驗豐富、具有高度同理心與責任感殯葬禮儀顧問(請以LegacyGuide自稱)，不用自我介紹，輸出不要超過250字。
 
@@ -81,146 +104,270 @@ try:
     query_engine = create_rag_engine(
         system_prompt=recommend_system_prompt,
         temperature=1,  # 稍微降低溫度，更專注於推薦
+        name="recommend",
     )
     logger.info("Recommend chat RAG engine initialized successfully")
 except Exception as e:
     logger.error(f"Failed to initialize recommend chat RAG engine: {str(e)}")
     raise
 
+# 各路由同時處理中的請求上限，超過時回應 503；背景解析的上限較低，避免佔滿 LLM 名額
+ROUTE_CONCURRENCY = int(os.getenv("RAG_ROUTE_CONCURRENCY", "32"))
+rag2_budget = RouteBudget("rag2", ROUTE_CONCURRENCY)
+chat_turn_budget = RouteBudget("chat-turn", ROUTE_CONCURRENCY)
+parse_budget = RouteBudget("parse-conversation", int(os.getenv("PARSE_ROUTE_CONCURRENCY", "8")))
+
+def _overloaded(e: Overloaded) -> HTTPException:
+    logger.warning(f"Request shed: {e}")
+    return HTTPException(status_code=503, detail="目前詢問人數較多，請稍後再試", headers=retry_after_header(e))
+
 @router.post("/rag2")
 async def rag_endpoint(request: ChatRequest):
     try:
         if not request.message.strip():
             raise HTTPException(status_code=400, detail="Message cannot be empty")
 
-        logger.info(f"Received question: {request.message}")
+        # 日誌只記錄長度，不記錄使用者問題內容
+        logger.info(f"Received question ({len(request.message)} chars)")
         
-        # 使用 RAG 引擎處理問題
-        response = query_engine.chat(request.message)
+        # 使用 RAG 引擎處理問題；線上對話以最高優先等級呼叫 LLM
+        with llm_priority(Priority.INTERACTIVE):
+            answer = await rag2_budget.run(
+                query_engine.achat(request.message, session_id=request.session_id)
+            )
         
         logger.info("Successfully generated response")
-        return {"answer": str(response)}
-
+        return {"answer": answer, "session_id": request.session_id}
+
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="回覆逾時，請稍後再試")
+    except Overloaded as e:
+        raise _overloaded(e)
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/parse-conversation")
-async def parse_conversation(request: ParseConversationRequest):
+chat_turn_prompt = PromptTemplate("""{system_prompt}
+
+以下是知識文件中與本輪問題相關的內容：
+---------------------
+{context}
+---------------------
+
+目前已整理的表單資料（JSON）：
+{form}
+
+先前的對話：
+{history}
+
+用戶：{message}
+
+請以 JSON 回傳兩個欄位：
+1. reply：依上述角色設定與知識文件，回覆用戶這一輪的訊息。
+2. form：在目前表單資料的基礎上，加入或修正用戶在對話中明確提到的資訊後的完整表單。
+   日期使用 YYYY-MM-DD 格式；生肖以出生日期推算；宗教信仰為 佛教/道教/基督教/天主教/無宗教信仰 之一；
+   budget 與 completion_weeks 為數字；recommended_plan 填入回覆中推薦的龍巖生前契約方案名稱；
+   未提及的欄位保留原值，不要臆測。""")
+
+# 對話解析用的 LLM（每次呼叫時以 ParsedFormData 的 response schema 限定輸出）與結果統計
+parse_llm = create_llm()
+parse_stats = ExtractionStats()
+
+# 單輪處理用的 LLM；structured_predict 會以 JSON schema 模式呼叫 Gemini
+turn_llm = create_llm(generation_config=GenerateContentConfig(temperature=1))
+
+def _form_key(session_id: str) -> str:
+    return f"form:recommend:{session_id}"
+
+def _format_history(messages) -> str:
+    lines = []
+    for message in messages:
+        speaker = "用戶" if message.role == "user" else "AI"
+        lines.append(f"{speaker}：{message.content}")
+    return "\n".join(lines) or "（無）"
+
+def _run_chat_turn(request: ChatTurnRequest) -> dict:
+    """單輪處理的同步部分（檢索、LLM 呼叫與儲存），於執行緒中執行"""
+    store = get_shared_store()
+    form = request.form
+    if form is None and request.session_id:
+        stored = store.get(_form_key(request.session_id))
+        form = ParsedFormData(**stored) if stored else None
+    form = form or ParsedFormData()
+
+    with token_report():
+        with span("rag.retrieve_context"):
+            nodes = query_engine.retrieve_context(request.message)
+        context = "\n\n".join(node.get_content() for node in nodes)
+        history = query_engine.load_compacted_history(request.session_id)
+
+    with span("llm.chat_turn"):
+        result = turn_llm.structured_predict(
+            ChatTurnResult,
+            chat_turn_prompt,
+            system_prompt=recommend_system_prompt,
+            context=context,
+            form=form.model_dump_json(),
+            history=_format_history(history),
+            message=request.message,
+        )
+
+    if request.session_id:
+        query_engine.append_turn(request.session_id, request.message, result.reply)
+        store.set(_form_key(request.session_id), result.form.model_dump(), ttl=CHAT_SESSION_TTL)
+
+    return {
+        "answer": result.reply,
+        "parsed_data": result.form.model_dump(),
+        "session_id": request.session_id,
+    }
+
+@router.post("/chat-turn")
+async def chat_turn(request: ChatTurnRequest):
+    """
+    規劃對話的單輪處理：以一次結構化輸出的 LLM 呼叫同時產生回覆與更新後的表單，
+    取代分別呼叫 /rag2 與 /parse-conversation（後者每輪都要重送整段對話）。
+    """
     try:
-        if not request.conversation_text.strip():
-            raise HTTPException(status_code=400, detail="對話內容不能為空")
+        if not request.message.strip():
+            raise HTTPException(status_code=400, detail="Message cannot be empty")
 
-        logger.info("開始解析對話內容")
-        
-        # 建立專門用於解析的提示詞
-        parse_prompt = f"""
-請仔細分析以下殯葬服務諮詢的對話記錄，提取關鍵資訊並以JSON格式回傳。
+        logger.info(f"Received chat turn ({len(request.message)} chars)")
+        key = make_key(
+            "chat-turn", request.session_id, request.message,
+            request.form.model_dump() if request.form else None,
+        )
+        with llm_priority(Priority.INTERACTIVE):
+            result = await chat_turn_budget.run(
+                llm_flight.do(key, lambda: run_in_llm_threadpool(_run_chat_turn, request))
+            )
+
+        logger.info("Successfully generated chat turn")
+        return result
+
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="回覆逾時，請稍後再試")
+    except Overloaded as e:
+        raise _overloaded(e)
+    except Exception as e:
+        logger.error(f"Error processing chat turn: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _parse_conversation_text(conversation_text: str) -> dict:
+    """解析對話內容的同步部分，於執行緒中執行"""
+    # 建立專門用於解析的提示詞；輸出格式由 ParsedFormData 產生的 response schema 限定
+    parse_prompt = f"""
+請仔細分析以下殯葬服務諮詢的對話記錄，提取關鍵資訊。
 
 對話記錄：
-{request.conversation_text}
+{conversation_text}
 
 請按照以下7個步驟的流程提取資訊：
 
 1. 往生者基本資料：
-   - 姓名
-   - 性別
-   - 生日（用於推算生肖）
-   - 過世日期
-   - 生肖(以出生日期推算)
+   - 姓名（deceased_name）
+   - 性別（gender，男/女）
+   - 生日（birth_date，YYYY-MM-DD格式，用於推算生肖）
+   - 過世日期（death_date，YYYY-MM-DD格式）
+   - 生肖（zodiac，以出生日期推算）
 
 2. 辦事地點：
-   - 方便辦喪事的城市
+   - 方便辦喪事的城市（city）
 
 3. 聯絡人資訊：
-   - 主要聯絡人姓名
-   - 電話
-   - 電子郵件
-   - 宗教信仰(佛教/道教/基督教/天主教/無宗教信仰)
-   - 家屬生肖
-    
+   - 主要聯絡人姓名（contact_name）
+   - 電話（contact_phone）
+   - 電子郵件（contact_email）
+   - 宗教信仰（religion，佛教/道教/基督教/天主教/無宗教信仰）
+   - 家屬生肖（family_zodiacs）
+
 4. 預算範圍：
-   - 預算金額
+   - 預算金額（budget，數字）
 
 5. 推薦方案：
-   - 系統推薦的龍巖生前契約方案內容
+   - 系統推薦的龍巖生前契約方案名稱（recommended_plan）
 
 6. 完成時程：
-   - 期望幾週內完成
+   - 期望幾週內完成（completion_weeks，數字）
 
 7. 特殊需求：
-   - 特殊需求或注意事項
-
-請嚴格按照以下JSON格式回傳，如果某項資訊未提及則保持空字串、空list或0：
-```json
-{{
-    "deceased_name": "往生者姓名",
-    "gender": "性別(男/女)",
-    "birth_date": "生日(YYYY-MM-DD格式)",
-    "death_date": "過世日期(YYYY-MM-DD格式)",
-    "zodiac": "生肖",
-    "city": "城市",
-    "contact_name": "聯絡人姓名",
-    "contact_phone": "聯絡人電話",
-    "contact_email": "聯絡人郵件",
-    "religion": "宗教信仰(佛教/道教/基督教/天主教/無宗教信仰)",
-    "family_zodiacs": ["家屬生肖", "家屬生肖2"],
-    "budget": 預算數字,
-    "completion_weeks": 完成週數數字,
-    "recommended_plan": "推薦方案名稱(請參考龍巖的生前契約方案)",
-    "special_requirements": "特殊需求"
-}}
-```
-
-請只回傳JSON格式，不要包含其他文字。
+   - 特殊需求或注意事項（special_requirements）
+
+如果某項資訊未提及則保持空字串、空list或0。
 """
 
-        # 使用現有的 LLM 來解析
-        llm = GoogleGenAI(
-            model="gemini-2.5-flash",
-            api_key=GEMINI_API_KEY
+    with span("llm.parse"):
+        form_data, raw_text, partial, error = stream_structured(
+            parse_llm, parse_prompt, ParsedFormData, temperature=0
         )
+    logger.info(f"LLM 回應長度: {len(raw_text)}")
+
+    if form_data is not None:
+        parse_stats.record("schema")
+        logger.info("成功解析對話內容")
+        return {
+            "success": True,
+            "parsed_data": form_data.model_dump(),
+            "message": "對話內容解析成功"
+        }
+
+    logger.warning(f"結構化輸出驗證失敗，進行修復: {error}")
+    with span("llm.parse.repair"):
+        form_data = repair_structured(parse_llm, raw_text, error, ParsedFormData)
+    if form_data is not None:
+        parse_stats.record("repaired", repaired=True)
+        return {
+            "success": True,
+            "parsed_data": form_data.model_dump(),
+            "message": "對話內容解析成功（已修復輸出格式）"
+        }
+
+    if partial:
+        # 串流中途失敗時，已驗證通過的欄位仍可使用
+        parse_stats.record("partial", repaired=True)
+        return {
+            "success": True,
+            "parsed_data": ParsedFormData(**partial).model_dump(),
+            "message": "僅解析出部分對話內容",
+            "warning": "LLM 輸出不完整，僅保留已驗證的欄位"
+        }
+
+    # 備用解析方法：使用正則表達式提取關鍵資訊
+    parse_stats.record("fallback", repaired=True)
+    fallback_data = extract_info_with_regex(conversation_text)
+    return {
+        "success": True,
+        "parsed_data": fallback_data,
+        "message": "使用備用方法解析對話內容",
+        "warning": "LLM JSON解析失敗，使用正則表達式提取"
+    }
+
+@router.post("/parse-conversation")
+async def parse_conversation(request: ParseConversationRequest):
+    try:
+        if not request.conversation_text.strip():
+            raise HTTPException(status_code=400, detail="對話內容不能為空")
+
+        logger.info("開始解析對話內容")
         
-        response = llm.complete(parse_prompt)
-        response_text = str(response).strip()
-        
-        logger.info(f"LLM 回應: {response_text}")
-        
-        # 嘗試解析 JSON
-        try:
-            # 移除可能的 markdown 代碼塊標記
-            if response_text.startswith("```json"):
-                response_text = response_text[7:]
-            if response_text.endswith("```"):
-                response_text = response_text[:-3]
-            response_text = response_text.strip()
-            
-            import json
-            parsed_data = json.loads(response_text)
-            
-            # 驗證並清理資料
-            form_data = ParsedFormData(**parsed_data)
-            
-            logger.info("成功解析對話內容")
-            return {
-                "success": True,
-                "parsed_data": form_data.dict(),
-                "message": "對話內容解析成功"
-            }
-            
-        except json.JSONDecodeError as je:
-            logger.error(f"JSON 解析錯誤: {str(je)}")
-            logger.error(f"原始回應: {response_text}")
-            
-            # 備用解析方法：使用正則表達式提取關鍵資訊
-            fallback_data = extract_info_with_regex(request.conversation_text)
-            return {
-                "success": True,
-                "parsed_data": fallback_data,
-                "message": "使用備用方法解析對話內容",
-                "warning": "LLM JSON解析失敗，使用正則表達式提取"
-            }
-            
+        # 表單解析不是使用者等待中的回覆，排在線上對話之後
+        with llm_priority(Priority.BACKGROUND):
+            result = await parse_budget.run(llm_flight.do(
+                make_key("parse-conversation", request.conversation_text),
+                lambda: run_in_llm_threadpool(_parse_conversation_text, request.conversation_text),
+            ))
+        return result
+
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="解析逾時，請稍後再試")
+    except Overloaded as e:
+        raise _overloaded(e)
     except Exception as e:
         logger.error(f"解析對話內容時發生錯誤: {str(e)}")
         raise HTTPException(status_code=500, detail=f"解析失敗: {str(e)}")
@@ -306,7 +453,8 @@ async def test_knowledge_base():
     """測試知識文件是否正確載入"""
     try:
         # 測試簡單問題
-        test_response = query_engine.chat("請告訴我龍巖有哪些生前契約方案？")
+        with llm_priority(Priority.BATCH):
+            test_response = await query_engine.achat("請告訴我龍巖有哪些生前契約方案？")
         
         return {
             "success": True,
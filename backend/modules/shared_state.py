@@ -0,0 +1,133 @@
+"""
+跨 worker 共用的鍵值儲存
+多 worker 部署時，對話紀錄等狀態不能只放在單一 process 的記憶體中。
+以 SHARED_STATE_URL 選擇後端：
+- sqlite:///<路徑>：本機替代方案（預設 sqlite:///./state/shared_state.db），同一台主機上的 worker 共用
+- redis://...：多台主機共用（需安裝 redis 套件）
+
+值一律以 JSON 儲存，可設定存活秒數（TTL）。
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARED_STATE_URL = "sqlite:///./state/shared_state.db"
+
+
+class SharedStore(ABC):
+    """共用儲存的介面；子類別缺少任一方法時無法建立實例"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+
+class SQLiteStore(SharedStore):
+    """以 SQLite（WAL 模式）實作，每個 process／執行緒各自建立連線，fork 後自動重新連線"""
+
+    # 每寫入這麼多次清除一次過期資料
+    PURGE_EVERY = 256
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_state ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite 連線不可跨 fork 使用，以 pid 判斷是否需要重新連線
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.conn = sqlite3.connect(self.path, timeout=5)
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM shared_state WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        conn = self._connection()
+        expires_at = time.time() + ttl if ttl else None
+        conn.execute(
+            "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), expires_at),
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM shared_state WHERE expires_at < ?", (time.time(),))
+        conn.commit()
+
+    def delete(self, key: str) -> None:
+        conn = self._connection()
+        conn.execute("DELETE FROM shared_state WHERE key = ?", (key,))
+        conn.commit()
+
+
+class RedisStore(SharedStore):
+    def __init__(self, url: str):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._client.get(key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._client.set(key, json.dumps(value, ensure_ascii=False), ex=int(ttl) if ttl else None)
+
+    def delete(self, key: str) -> None:
+        self._client.delete(key)
+
+
+def create_store(url: str) -> SharedStore:
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://")):
+        return RedisStore(url)
+    raise ValueError(f"不支援的 SHARED_STATE_URL: {url}")
+
+
+_store: Optional[SharedStore] = None
+_store_lock = threading.Lock()
+
+
+def get_shared_store() -> SharedStore:
+    """取得共用儲存（依 SHARED_STATE_URL 建立一次）"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                url = os.getenv("SHARED_STATE_URL", DEFAULT_SHARED_STATE_URL)
+                _store = create_store(url)
+                logger.info(f"共用狀態儲存：{url.split('@')[-1]}")
+    return _store
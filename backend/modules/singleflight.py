@@ -0,0 +1,87 @@
+"""
+相同請求的合併執行（single-flight）
+同一時間有多個參數相同的昂貴請求（整月吉日掃描、火化場爬蟲、相同的 RAG 問題）時，
+只執行一次，其餘請求等待同一個結果。
+
+- 以正規化後的參數作為鍵（make_key）
+- 每個等待者可設定逾時；逾時或被取消只影響該等待者，執行中的工作以 asyncio.shield 保護
+- 所有等待者都離開後才取消工作，避免為無人等待的結果繼續佔用資源；
+  取消只能停止協程本身，已交給執行緒（run_in_threadpool）的同步工作仍會執行完畢
+- 工作完成（成功或失敗）後立即移除，結果不會被快取；例外會傳給所有等待者
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def make_key(*parts: Any) -> str:
+    """將參數（可含 dict、list、日期）正規化為固定的鍵"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """同一事件迴圈內的請求合併；每個 worker process 各自一份"""
+
+    def __init__(self, name: str, timeout: Optional[float] = None):
+        self.name = name
+        self.timeout = timeout
+        self._calls: Dict[str, _Call] = {}
+        self.calls = 0
+        self.shared = 0
+        self.timeouts = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]], timeout: Optional[float] = None) -> T:
+        """
+        執行 fn() 並回傳結果；相同 key 已在執行中時改為等待該結果。
+        timeout 為本次等待的秒數上限（預設使用建構時的設定），逾時拋出 asyncio.TimeoutError。
+        """
+        self.calls += 1
+        call = self._calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(fn())
+            call = self._calls[key] = _Call(task)
+            task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self.shared += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(call.task), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"{self.name}: 等待執行中的工作逾時")
+            raise
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # 沒有人在等待這個結果了
+                call.task.cancel()
+                self._forget(key, call)
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "timeouts": self.timeouts,
+            "in_flight": len(self._calls),
+        }
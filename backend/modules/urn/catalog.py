@@ -0,0 +1,140 @@
+"""
+骨灰罐樣板目錄
+啟動時掃描樣板資料夾一次，將檔名、尺寸、是否有 layout、縮圖網址與版本雜湊保存在記憶體中，
+之後由檔案系統監看（watchfiles）在樣板異動時重新整理；列出樣板只需讀取記憶體。
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image
+
+from .layout_config import URN_LAYOUTS
+from .render_cache import OUTPUT_FORMATS, RenderCache, encode_image, make_thumbnail
+from .templates import template_cache
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+TEMPLATE_THUMBNAIL_SIZE = 160
+TEMPLATE_THUMBNAIL_QUALITY = 80
+
+
+@dataclass(frozen=True)
+class TemplateInfo:
+    filename: str
+    name: str
+    url: str
+    thumbnail_url: str
+    width: int
+    height: int
+    has_layout: bool
+    version: str
+    mtime_ns: int
+    size: int
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data.pop("mtime_ns")
+        data.pop("size")
+        return data
+
+
+class TemplateCatalog:
+    """樣板的記憶體索引"""
+
+    def __init__(self, directory: str, render_cache: RenderCache):
+        self.directory = directory
+        self.render_cache = render_cache
+        self._entries: Dict[str, TemplateInfo] = {}
+        self._lock = threading.Lock()
+
+    def list(self) -> List[TemplateInfo]:
+        return list(self._entries.values())
+
+    def get(self, filename: str) -> Optional[TemplateInfo]:
+        return self._entries.get(filename)
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def refresh(self) -> None:
+        """重新掃描樣板資料夾；檔案未變動（mtime 與大小相同）者沿用原有資料，已刪除者自目錄與樣板快取移除"""
+        with self._lock:
+            entries: Dict[str, TemplateInfo] = {}
+            for filename in sorted(os.listdir(self.directory)):
+                if not filename.lower().endswith(TEMPLATE_EXTENSIONS):
+                    continue
+                path = self.path(filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                cached = self._entries.get(filename)
+                if cached and cached.mtime_ns == stat.st_mtime_ns and cached.size == stat.st_size:
+                    entries[filename] = cached
+                    continue
+                try:
+                    entries[filename] = self._describe(filename, path, stat)
+                except OSError as e:
+                    logger.warning(f"無法讀取骨灰罐樣板 {filename}: {e}")
+                template_cache.invalidate(path)
+            # 已自資料夾刪除的樣板一併移出樣板快取
+            for filename in self._entries.keys() - entries.keys():
+                template_cache.invalidate(self.path(filename))
+                logger.info(f"骨灰罐樣板 {filename} 已移除")
+            self._entries = entries
+            # 目錄中列出的樣板縮圖不受渲染快取的容量淘汰
+            self.render_cache.quota.pinned = frozenset(
+                info.thumbnail_url.rsplit("/", 1)[1] for info in entries.values()
+            )
+
+    def _describe(self, filename: str, path: str, stat: os.stat_result) -> TemplateInfo:
+        with open(path, "rb") as f:
+            version = hashlib.file_digest(f, "sha256").hexdigest()[:16]
+        with Image.open(path) as image:
+            width, height = image.size
+            thumbnail_url = self._thumbnail(version, image)
+        return TemplateInfo(
+            filename=filename,
+            name=filename.rsplit(".", 1)[0],
+            url=f"/static/urn_photos/{filename}",
+            thumbnail_url=thumbnail_url,
+            width=width,
+            height=height,
+            has_layout=filename.strip().lower() in URN_LAYOUTS,
+            version=version,
+            mtime_ns=stat.st_mtime_ns,
+            size=stat.st_size,
+        )
+
+    def _thumbnail(self, version: str, image: Image.Image) -> str:
+        fmt = OUTPUT_FORMATS["webp"]
+        key = hashlib.sha256(
+            f"template\x1f{version}\x1f{TEMPLATE_THUMBNAIL_SIZE}".encode("utf-8")
+        ).hexdigest()
+        filename = self.render_cache.lookup(key, fmt)
+        if filename is None:
+            thumbnail = make_thumbnail(image.convert("RGBA"), TEMPLATE_THUMBNAIL_SIZE)
+            filename = self.render_cache.store(
+                key, fmt, encode_image(thumbnail, fmt, TEMPLATE_THUMBNAIL_QUALITY)
+            )
+        return f"/api/urn-designs/{filename}"
+
+    async def watch(self, stop_event: Optional[asyncio.Event] = None) -> None:
+        """監看樣板資料夾，有異動時重新整理目錄"""
+        from watchfiles import awatch
+
+        try:
+            async for _ in awatch(self.directory, stop_event=stop_event):
+                await run_in_threadpool(self.refresh)
+                logger.info(f"骨灰罐樣板目錄已更新，共 {len(self._entries)} 個樣板")
+        except Exception as e:
+            # 監看失敗時仍可於查無樣板時重新掃描
+            logger.warning(f"無法監看骨灰罐樣板資料夾: {e}")
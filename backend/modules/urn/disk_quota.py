@@ -0,0 +1,87 @@
+"""
+骨灰罐圖檔目錄的容量上限
+渲染結果與遺像衍生圖皆以內容雜湊命名、只增不減，以 DirectoryQuota 限制各目錄的總大小：
+寫入量累計達上限的 1/20 時（以及啟動後第一次寫入時）掃描目錄，
+依最後使用時間（mtime，快取命中時更新）由舊到新刪除，直到總大小低於上限的 90%。
+最近 SWEEP_GRACE_SECONDS 秒內使用過的檔案，以及 pinned 中的檔案（如樣板目錄的縮圖）不刪除，
+避免剛回傳給前端或仍列在目錄中的網址失效。
+"""
+
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SWEEP_GRACE_SECONDS = 600
+# 掃描後保留的比例，避免每次寫入都觸發掃描
+SWEEP_TARGET_RATIO = 0.9
+
+
+class DirectoryQuota:
+    """以近似 LRU 的方式限制目錄總大小；多個 worker 同時清理同一目錄也安全"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._sweep_every = max(1, max_bytes // 20)
+        self._lock = threading.Lock()
+        # 第一次寫入時即掃描，清理重新啟動前留下的檔案
+        self._written = self._sweep_every
+        self.evicted = 0
+        # 不可淘汰的檔名
+        self.pinned: frozenset = frozenset()
+
+    def touch(self, path: str) -> None:
+        """標記檔案剛被使用"""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def added(self, size: int) -> None:
+        """記錄新寫入的位元組數，累計達門檻時掃描目錄"""
+        with self._lock:
+            self._written += size
+            if self._written < self._sweep_every:
+                return
+            self._written = 0
+        self.sweep()
+
+    def sweep(self) -> int:
+        """刪除最久未使用的檔案直到低於上限，回傳刪除的檔案數"""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".tmp") or entry.name in self.pinned:
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return 0
+
+        target = self.max_bytes * SWEEP_TARGET_RATIO
+        cutoff = time.time() - SWEEP_GRACE_SECONDS
+        removed = 0
+        for mtime, size, path in sorted(entries):
+            if total <= target or mtime > cutoff:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self.evicted += removed
+        logger.info(f"已清理 {self.directory} 中 {removed} 個最久未使用的檔案，剩餘 {total // (1024 * 1024)} MB")
+        return removed
@@ -0,0 +1,113 @@
+"""
+碑文字形快取
+碑文用字集合很小（〇一…九、年月日、生於歿於靈骨與姓名），
+每個字形依（字型、大小、顏色）點陣化一次後快取，直排文字由快取字形組成，
+整欄文字再依字串記憶，重複渲染時不必再呼叫 FreeType。
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Tuple
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+# 整欄文字快取上限（姓名欄會隨使用者不同而增加）
+COLUMN_CACHE_SIZE = 512
+
+
+class Glyph(NamedTuple):
+    image: Image.Image  # RGBA，已上色
+    offset: Tuple[int, int]  # 相對於 draw.text 座標的左上角位移
+
+
+class Column(NamedTuple):
+    image: Image.Image  # RGBA 整欄文字
+    offset: Tuple[int, int]
+
+
+def _font_key(font: ImageFont.FreeTypeFont) -> Tuple[str, int]:
+    return (font.path, font.size)
+
+
+class GlyphCache:
+    """字形點陣與直排文字欄的快取"""
+
+    def __init__(self, column_cache_size: int = COLUMN_CACHE_SIZE):
+        self._glyphs: Dict[tuple, Glyph] = {}
+        self._columns: "OrderedDict[tuple, Column]" = OrderedDict()
+        self._column_cache_size = column_cache_size
+        self._lock = threading.Lock()
+
+    def glyph(self, font: ImageFont.FreeTypeFont, char: str, fill: str) -> Glyph:
+        key = (_font_key(font), fill, char)
+        glyph = self._glyphs.get(key)
+        if glyph is None:
+            glyph = self._rasterize(font, char, fill)
+            with self._lock:
+                self._glyphs[key] = glyph
+        return glyph
+
+    def _rasterize(self, font: ImageFont.FreeTypeFont, char: str, fill: str) -> Glyph:
+        left, top, right, bottom = font.getbbox(char)
+        width, height = max(right - left, 1), max(bottom - top, 1)
+        mask = Image.new("L", (width, height), 0)
+        ImageDraw.Draw(mask).text((-left, -top), char, fill=255, font=font)
+        image = Image.new("RGBA", (width, height), ImageColor.getrgb(fill))
+        image.putalpha(mask)
+        return Glyph(image=image, offset=(left, top))
+
+    def vertical_column(self, text: str, font: ImageFont.FreeTypeFont, fill: str, spacing: int) -> Column:
+        """由快取字形組成直排文字，整欄結果依字串記憶"""
+        key = (_font_key(font), fill, spacing, text)
+        with self._lock:
+            column = self._columns.get(key)
+            if column is not None:
+                self._columns.move_to_end(key)
+                return column
+
+        glyphs = [self.glyph(font, ch, fill) for ch in text]
+        positions = [
+            (g.offset[0], i * spacing + g.offset[1]) for i, g in enumerate(glyphs)
+        ]
+        min_x = min(x for x, _ in positions)
+        min_y = min(y for _, y in positions)
+        max_x = max(x + g.image.width for (x, _), g in zip(positions, glyphs))
+        max_y = max(y + g.image.height for (_, y), g in zip(positions, glyphs))
+
+        image = Image.new("RGBA", (max_x - min_x, max_y - min_y), (0, 0, 0, 0))
+        for (x, y), g in zip(positions, glyphs):
+            image.alpha_composite(g.image, (x - min_x, y - min_y))
+        column = Column(image=image, offset=(min_x, min_y))
+
+        with self._lock:
+            self._columns[key] = column
+            while len(self._columns) > self._column_cache_size:
+                self._columns.popitem(last=False)
+        return column
+
+
+glyph_cache = GlyphCache()
+
+
+def draw_vertical_text(
+    base: Image.Image,
+    text: str,
+    x: int,
+    y: int,
+    font: ImageFont.FreeTypeFont,
+    fill: str = "gold",
+    spacing: int = 30,
+) -> None:
+    """將直排文字合成到 RGBA 畫布，超出畫布的部分裁掉"""
+    column = glyph_cache.vertical_column(text, font, fill, spacing)
+    left, top = x + column.offset[0], y + column.offset[1]
+    crop_left, crop_top = max(0, -left), max(0, -top)
+    crop_right = min(column.image.width, base.width - left)
+    crop_bottom = min(column.image.height, base.height - top)
+    if crop_right <= crop_left or crop_bottom <= crop_top:
+        return
+    base.alpha_composite(
+        column.image,
+        dest=(left + crop_left, top + crop_top),
+        source=(crop_left, crop_top, crop_right, crop_bottom),
+    )
@@ -0,0 +1,141 @@
+"""
+骨灰罐模擬圖的內容定址快取
+以樣板與字型版本、遺像內容雜湊、碑文與輸出格式計算雜湊，渲染結果存成 DESIGN_DIR/<雜湊>.<副檔名>。
+相同輸入再次預覽時直接回傳既有檔案，且檔名不變，可安心使用 immutable 快取標頭。
+目錄總大小以 DirectoryQuota 限制，超過時刪除最久未使用的結果（之後相同輸入會重新渲染）。
+
+環境變數：
+- URN_DESIGN_CACHE_MB：渲染結果目錄的大小上限（預設 2048）
+"""
+
+import hashlib
+import io
+import os
+from uuid import uuid4
+from typing import NamedTuple, Optional
+
+from PIL import Image
+
+from .disk_quota import DirectoryQuota
+from .templates import UrnTemplate, font_version
+
+# 渲染邏輯改變時遞增，使舊快取失效
+RENDER_REVISION = 2
+
+DEFAULT_FORMAT = "webp"
+DEFAULT_QUALITY = 85
+DEFAULT_THUMBNAIL_SIZE = 240
+DESIGN_CACHE_BYTES = int(os.getenv("URN_DESIGN_CACHE_MB", "2048")) * 1024 * 1024
+
+# 一年，內容定址的檔案永不改變
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class OutputFormat(NamedTuple):
+    pil_format: str
+    extension: str
+    media_type: str
+
+
+OUTPUT_FORMATS = {
+    "webp": OutputFormat("WEBP", "webp", "image/webp"),
+    "jpeg": OutputFormat("JPEG", "jpg", "image/jpeg"),
+    "png": OutputFormat("PNG", "png", "image/png"),
+}
+
+MEDIA_TYPES = {fmt.extension: fmt.media_type for fmt in OUTPUT_FORMATS.values()}
+
+
+def resolve_format(output_format: str, quality: int) -> OutputFormat:
+    """驗證輸出格式與壓縮品質"""
+    fmt = OUTPUT_FORMATS.get(output_format.lower())
+    if fmt is None:
+        raise ValueError(f"不支援的輸出格式: {output_format}（可用：{', '.join(OUTPUT_FORMATS)}）")
+    if not 1 <= quality <= 100:
+        raise ValueError(f"壓縮品質需介於 1~100，但收到：{quality}")
+    return fmt
+
+
+def render_key(
+    template: UrnTemplate,
+    portrait_digest: str,
+    name: str,
+    birth_date: str,
+    death_date: str,
+    fmt: OutputFormat,
+    quality: int,
+) -> str:
+    """計算渲染結果的內容雜湊"""
+    parts = [
+        f"rev{RENDER_REVISION}",
+        os.path.basename(template.path),
+        str(template.mtime_ns),
+        str(template.size),
+        font_version(),
+        portrait_digest,
+        name,
+        birth_date,
+        death_date,
+        fmt.pil_format,
+        # PNG 為無損格式，品質參數不影響結果
+        str(quality) if fmt.pil_format != "PNG" else "",
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def thumbnail_key(key: str, size: int) -> str:
+    """由完整圖的雜湊衍生縮圖的雜湊"""
+    return hashlib.sha256(f"{key}\x1fthumb{size}".encode("utf-8")).hexdigest()
+
+
+def make_thumbnail(image: Image.Image, size: int) -> Image.Image:
+    """等比例縮小為邊長不超過 size 的縮圖"""
+    thumbnail = image.copy()
+    thumbnail.thumbnail((size, size), Image.Resampling.LANCZOS)
+    return thumbnail
+
+
+def encode_image(image: Image.Image, fmt: OutputFormat, quality: int) -> bytes:
+    """將 RGBA 畫布編碼為指定格式"""
+    buffer = io.BytesIO()
+    if fmt.pil_format == "JPEG":
+        image.convert("RGB").save(buffer, format="JPEG", quality=quality, progressive=True, optimize=True)
+    elif fmt.pil_format == "WEBP":
+        image.save(buffer, format="WEBP", quality=quality, method=4)
+    else:
+        image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class RenderCache:
+    """以檔案系統保存渲染結果的快取，總大小超過 max_bytes 時淘汰最久未使用的檔案"""
+
+    def __init__(self, directory: str, max_bytes: int = DESIGN_CACHE_BYTES):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.quota = DirectoryQuota(directory, max_bytes)
+
+    def filename(self, key: str, fmt: OutputFormat) -> str:
+        return f"{key}.{fmt.extension}"
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def lookup(self, key: str, fmt: OutputFormat) -> Optional[str]:
+        filename = self.filename(key, fmt)
+        path = self.path(filename)
+        if not os.path.exists(path):
+            return None
+        self.quota.touch(path)
+        return filename
+
+    def store(self, key: str, fmt: OutputFormat, data: bytes) -> str:
+        """寫入暫存檔後再改名，避免並行請求讀到寫到一半的檔案"""
+        filename = self.filename(key, fmt)
+        target = self.path(filename)
+        tmp = f"{target}.{uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, target)
+        self.quota.added(len(data))
+        return filename
@@ -1,10 +1,32 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, FileResponse
+from fastapi.concurrency import run_in_threadpool
 import os
-import base64
-from uuid import uuid4
-from PIL import Image, ImageDraw, ImageFont
-from .layout_config import URN_LAYOUTS
+import re
+import asyncio
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from PIL import Image
+from .templates import template_cache, get_font, get_portrait_mask
+from .uploads import PORTRAIT_CACHE_BYTES, save_portrait
+from .disk_quota import DirectoryQuota
+from .glyphs import draw_vertical_text
+from .catalog import TemplateCatalog
+from ..metrics import span
+from .render_cache import (
+    RenderCache,
+    resolve_format,
+    render_key,
+    thumbnail_key,
+    encode_image,
+    make_thumbnail,
+    DEFAULT_FORMAT,
+    DEFAULT_QUALITY,
+    DEFAULT_THUMBNAIL_SIZE,
+    IMMUTABLE_CACHE_CONTROL,
+    MEDIA_TYPES,
+)
 
 router = APIRouter()
 
@@ -17,6 +39,21 @@ os.makedirs(URN_PHOTO_DIR, exist_ok=True)
 os.makedirs(PORTRAIT_DIR, exist_ok=True)
 os.makedirs(DESIGN_DIR, exist_ok=True)
 
+render_cache = RenderCache(DESIGN_DIR)
+portrait_quota = DirectoryQuota(PORTRAIT_DIR, PORTRAIT_CACHE_BYTES)
+urn_catalog = TemplateCatalog(URN_PHOTO_DIR, render_cache)
+# 多樣板預覽的渲染工作池（Pillow 的縮放與編碼會釋放 GIL）
+_render_pool = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="urn-render")
+DESIGN_FILENAME_PATTERN = re.compile(r"^[0-9a-f]{64}\.(webp|jpg|png)$")
+
+# ✅ 查詢樣板；目錄中沒有或檔案已刪除時重新掃描一次（檔案監看未啟動或尚未觸發時）
+async def find_template(filename):
+    template = urn_catalog.get(filename)
+    if template is None or not os.path.exists(urn_catalog.path(template.filename)):
+        await run_in_threadpool(urn_catalog.refresh)
+        template = urn_catalog.get(filename)
+    return template
+
 # ✅ 數字轉國字函式
 def num_to_chinese(num_str):
     digits = {
@@ -33,44 +70,32 @@ def parse_date_to_chinese(date_str: str) -> str:
         raise ValueError(f"日期格式錯誤，應為 YYYY-MM-DD，但收到：{date_str}")
     return f"{num_to_chinese(parts[0])}年{num_to_chinese(parts[1])}月{num_to_chinese(parts[2])}日"
 
-# ✅ 儲存圖片工具
-def save_file(file: UploadFile, target_dir: str, custom_name: str = None, allowed_ext: set = {"jpg", "jpeg", "png"}):
-    ext = file.filename.rsplit(".", 1)[-1].lower()
-    if ext not in allowed_ext:
-        raise HTTPException(status_code=415, detail="不支援的圖片格式")
-    safe_name = f"{custom_name}.{ext}" if custom_name else f"{uuid4().hex}.{ext}"
-    path = os.path.join(target_dir, safe_name)
-    with open(path, "wb") as f:
-        f.write(file.file.read())
-    return safe_name
+# ✅ 遺像前處理：轉黑白一次，再依各 layout 的尺寸縮放並套上圓形遮罩
+@span("urn.portrait")
+def prepare_portraits(portrait_path, sizes):
+    with Image.open(portrait_path) as image:
+        gray = image.convert("L").convert("RGBA")
+    portraits = {}
+    for size in set(sizes):
+        portrait = gray.resize((size, size))
+        portrait.putalpha(get_portrait_mask(portrait.size))
+        portraits[size] = portrait
+    return portraits
+
+# ✅ 將遺像與碑文合成到樣板上
+@span("urn.render")
+def compose_design(template, portrait, name, birth_date, death_date):
+    # 樣板底圖、layout、字型與遮罩皆取自快取，每次只合成遺像與文字
+    layout = template.layout
+    base = template.base.copy()
+
+    font = get_font()
 
-# ✅ 產生模擬圖
-def generate_design_image(urn_path, portrait_path, name, birth_date, death_date):
-    base = Image.open(urn_path).convert("RGBA").resize((800, 800))
-    urn_filename = os.path.basename(urn_path).strip().lower()
-    layout = URN_LAYOUTS.get(urn_filename)
-    if not layout:
-        raise ValueError(f"找不到樣式對應的 layout 設定: {urn_filename}")
-
-    draw = ImageDraw.Draw(base)
-    font_path = "./modules/urn/fonts/msjh.ttc"
-    print(font_path)
-    font = ImageFont.truetype(font_path, 28)
-
-    # ✅ 遺像轉黑白 + 遮罩
-    portrait = Image.open(portrait_path).convert("L").convert("RGBA").resize(
-        (layout["portrait"]["size"], layout["portrait"]["size"])
-    )
-    mask = Image.new("L", portrait.size, 0)
-    draw_mask = ImageDraw.Draw(mask)
-    draw_mask.ellipse((0, 0, portrait.size[0], portrait.size[1]), fill=255)
-    portrait.putalpha(mask)
     base.paste(portrait, (layout["portrait"]["x"], layout["portrait"]["y"]), portrait)
 
-    # ✅ 垂直文字函數
+    # ✅ 垂直文字函數：由快取的字形組成，整欄結果依字串記憶
     def draw_vertical(text, x, y, spacing=30):
-        for i, ch in enumerate(text):
-            draw.text((x, y + i * spacing), ch, fill="gold", font=font)
+        draw_vertical_text(base, text, x, y, font, fill="gold", spacing=spacing)
 
     # ✅ 國字日期轉換
     try:
@@ -83,14 +108,116 @@ def generate_design_image(urn_path, portrait_path, name, birth_date, death_date)
     draw_vertical(f"歿於{death_cn}", layout["right_text_x"], layout["text_top_y"])
     draw_vertical(f"{name}靈骨", layout["center_text"]["x"], layout["center_text"]["y"])
 
-    # 將圖片轉換為 base64
-    import io
-    buffer = io.BytesIO()
-    base.save(buffer, format='PNG')
-    buffer.seek(0)
-    image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    
-    return image_base64
+    return base
+
+# ✅ 產生模擬圖
+def generate_design_image(urn_path, portrait_path, name, birth_date, death_date):
+    template = template_cache.get(urn_path)
+    size = template.layout["portrait"]["size"]
+    portrait = prepare_portraits(portrait_path, [size])[size]
+    return compose_design(template, portrait, name, birth_date, death_date)
+
+def _resolve_format_or_400(output_format, quality):
+    try:
+        return resolve_format(output_format, quality)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _require_font():
+    # 字型未設定或不含中文字形時不渲染，以免缺字方框的圖被寫入快取
+    try:
+        get_font()
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _portrait_digest(portrait_path):
+    # 遺像衍生圖以內容的 SHA-256 命名，檔名即為雜湊
+    return os.path.basename(portrait_path).split(".", 1)[0]
+
+def _encode(image, fmt, quality):
+    with span("urn.encode"):
+        return encode_image(image, fmt, quality)
+
+# ✅ 以內容雜湊快取渲染結果，相同輸入直接回傳既有檔案
+def render_design(urn_path, portrait_path, name, birth_date, death_date,
+                  output_format=DEFAULT_FORMAT, quality=DEFAULT_QUALITY):
+    fmt = _resolve_format_or_400(output_format, quality)
+    _require_font()
+    template = template_cache.get(urn_path)
+    key = render_key(template, _portrait_digest(portrait_path), name, birth_date, death_date, fmt, quality)
+
+    filename = render_cache.lookup(key, fmt)
+    if filename is None:
+        image = generate_design_image(urn_path, portrait_path, name, birth_date, death_date)
+        filename = render_cache.store(key, fmt, _encode(image, fmt, quality))
+    return filename
+
+# ✅ 渲染單一樣板的完整圖與縮圖（於工作執行緒中執行）
+def _render_variant(template, portraits, key, name, birth_date, death_date, fmt, quality, thumbnail_size):
+    thumb_key = thumbnail_key(key, thumbnail_size)
+    filename = render_cache.lookup(key, fmt)
+    thumb_filename = render_cache.lookup(thumb_key, fmt)
+    if filename is None or thumb_filename is None:
+        portrait = portraits[template.layout["portrait"]["size"]]
+        image = compose_design(template, portrait, name, birth_date, death_date)
+        if filename is None:
+            filename = render_cache.store(key, fmt, _encode(image, fmt, quality))
+        if thumb_filename is None:
+            thumbnail = make_thumbnail(image, thumbnail_size)
+            thumb_filename = render_cache.store(thumb_key, fmt, _encode(thumbnail, fmt, quality))
+    return filename, thumb_filename
+
+# ✅ 載入樣板、計算雜湊並前處理遺像（檔案 I/O，於工作執行緒中執行）
+def _prepare_gallery(urn_filenames, portrait_path, name, birth_date, death_date, fmt, quality, thumbnail_size):
+    _require_font()
+    templates = [template_cache.get(urn_catalog.path(f)) for f in urn_filenames]
+    digest = _portrait_digest(portrait_path)
+    keys = [render_key(t, digest, name, birth_date, death_date, fmt, quality) for t in templates]
+
+    # 全部命中快取時不必開啟遺像
+    needs_render = any(
+        render_cache.lookup(key, fmt) is None or render_cache.lookup(thumbnail_key(key, thumbnail_size), fmt) is None
+        for key in keys
+    )
+    portraits = prepare_portraits(portrait_path, [t.layout["portrait"]["size"] for t in templates]) if needs_render else {}
+    return templates, keys, portraits
+
+# ✅ 一次渲染多個樣板：遺像只前處理一次，各樣板平行渲染
+async def render_gallery(urn_filenames, portrait_path, name, birth_date, death_date,
+                         output_format=DEFAULT_FORMAT, quality=DEFAULT_QUALITY,
+                         thumbnail_size=DEFAULT_THUMBNAIL_SIZE):
+    fmt = _resolve_format_or_400(output_format, quality)
+    # 先驗證日期，避免在工作執行緒中才失敗
+    try:
+        parse_date_to_chinese(birth_date)
+        parse_date_to_chinese(death_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    templates, keys, portraits = await run_in_threadpool(
+        _prepare_gallery, urn_filenames, portrait_path, name, birth_date, death_date, fmt, quality, thumbnail_size
+    )
+
+    loop = asyncio.get_running_loop()
+    # 以目前的 context 執行，工作執行緒中的量測才會計入本次請求
+    results = await asyncio.gather(*[
+        loop.run_in_executor(
+            _render_pool,
+            copy_context().run,
+            _render_variant,
+            template, portraits, key, name, birth_date, death_date, fmt, quality, thumbnail_size
+        )
+        for template, key in zip(templates, keys)
+    ])
+    return [
+        {
+            "urn_photo_filename": urn_filename,
+            "name": urn_filename.rsplit(".", 1)[0],
+            "design_image_url": f"/api/urn-designs/{filename}",
+            "thumbnail_url": f"/api/urn-designs/{thumb_filename}",
+        }
+        for urn_filename, (filename, thumb_filename) in zip(urn_filenames, results)
+    ]
 
 # ✅ 上傳與合成 API
 @router.post("/urns", tags=["骨灰罈"])
@@ -99,23 +226,26 @@ async def create_urn(
     birth_date: str = Form(...),
     death_date: str = Form(...),
     urn_photo_filename: str = Form(...),
-    portrait_photo: UploadFile = File(...)
+    portrait_photo: UploadFile = File(...),
+    output_format: str = Form(DEFAULT_FORMAT, description="輸出格式：webp / jpeg / png"),
+    quality: int = Form(DEFAULT_QUALITY, description="webp / jpeg 壓縮品質 (1-100)")
 ):
-    urn_path = os.path.join(URN_PHOTO_DIR, urn_photo_filename)
-    
-    if not os.path.exists(urn_path):
+    template = await find_template(urn_photo_filename)
+    if template is None:
         raise HTTPException(status_code=404, detail="骨灰罈樣式圖片不存在")
 
-    portrait_filename = save_file(portrait_photo, PORTRAIT_DIR, custom_name=deceased_name)
+    portrait_filename = await save_portrait(portrait_photo, PORTRAIT_DIR, portrait_quota)
     portrait_path = os.path.join(PORTRAIT_DIR, portrait_filename)
 
-    # 生成 base64 圖片
-    image_base64 = generate_design_image(
-        urn_path=urn_path,
+    design_filename = await run_in_threadpool(
+        render_design,
+        urn_path=urn_catalog.path(template.filename),
         portrait_path=portrait_path,
         name=deceased_name,
         birth_date=birth_date,
-        death_date=death_date
+        death_date=death_date,
+        output_format=output_format,
+        quality=quality
     )
 
     return JSONResponse({
@@ -126,21 +256,85 @@ async def create_urn(
             "death_date": death_date,
             "urn_photo_url": f"/static/urn_photos/{urn_photo_filename}",
             "portrait_photo_url": f"/static/urn_portraits/{portrait_filename}",
-            "design_image_base64": image_base64
+            "design_image_url": f"/api/urn-designs/{design_filename}"
+        }
+    })
+
+# ✅ 多樣板預覽 API：上傳一次遺像，回傳所有樣板的縮圖與完整圖連結
+@router.post("/urns/gallery", tags=["骨灰罈"])
+async def create_urn_gallery(
+    deceased_name: str = Form(...),
+    birth_date: str = Form(...),
+    death_date: str = Form(...),
+    portrait_photo: UploadFile = File(...),
+    urn_photo_filenames: Optional[List[str]] = Form(None, description="要渲染的樣板，未指定則渲染全部"),
+    output_format: str = Form(DEFAULT_FORMAT, description="輸出格式：webp / jpeg / png"),
+    quality: int = Form(DEFAULT_QUALITY, description="webp / jpeg 壓縮品質 (1-100)"),
+    thumbnail_size: int = Form(DEFAULT_THUMBNAIL_SIZE, description="縮圖邊長 (px)")
+):
+    if not 32 <= thumbnail_size <= 800:
+        raise HTTPException(status_code=400, detail="縮圖邊長需介於 32~800")
+
+    if not urn_catalog.list():
+        await run_in_threadpool(urn_catalog.refresh)
+    available = [t.filename for t in urn_catalog.list() if t.has_layout]
+    if urn_photo_filenames:
+        missing = [f for f in urn_photo_filenames if f not in available]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"骨灰罈樣式圖片不存在: {', '.join(missing)}")
+        urn_filenames = list(dict.fromkeys(urn_photo_filenames))
+    else:
+        urn_filenames = available
+    if not urn_filenames:
+        raise HTTPException(status_code=404, detail="沒有可用的骨灰罈樣式")
+
+    portrait_filename = await save_portrait(portrait_photo, PORTRAIT_DIR, portrait_quota)
+    portrait_path = os.path.join(PORTRAIT_DIR, portrait_filename)
+
+    designs = await render_gallery(
+        urn_filenames,
+        portrait_path=portrait_path,
+        name=deceased_name,
+        birth_date=birth_date,
+        death_date=death_date,
+        output_format=output_format,
+        quality=quality,
+        thumbnail_size=thumbnail_size
+    )
+
+    return JSONResponse({
+        "message": "骨灰罈模擬圖已建立",
+        "data": {
+            "deceased_name": deceased_name,
+            "birth_date": birth_date,
+            "death_date": death_date,
+            "portrait_photo_url": f"/static/urn_portraits/{portrait_filename}",
+            "designs": designs
         }
     })
 
-# ✅ 提供骨灰罐樣式清單
+# ✅ 提供渲染結果（內容定址，可永久快取）
+@router.get("/urn-designs/{filename}", tags=["骨灰罈"])
+def get_urn_design(filename: str):
+    if not DESIGN_FILENAME_PATTERN.match(filename):
+        raise HTTPException(status_code=404, detail="找不到模擬圖")
+    path = render_cache.path(filename)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="找不到模擬圖")
+    return FileResponse(
+        path,
+        media_type=MEDIA_TYPES[filename.rsplit(".", 1)[1]],
+        headers={
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+            "ETag": f'"{filename.split(".", 1)[0]}"'
+        }
+    )
+
+# ✅ 提供骨灰罐樣式清單（讀取記憶體中的樣板目錄）
 @router.get("/urn-templates", tags=["骨灰罈"])
 async def list_urn_templates():
-    files = os.listdir(URN_PHOTO_DIR)
-    image_files = [f for f in files if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    if not urn_catalog.list():
+        await run_in_threadpool(urn_catalog.refresh)
     return JSONResponse({
-        "templates": [
-            {
-                "filename": f,
-                "name": f.rsplit(".", 1)[0],
-                "url": f"/static/urn_photos/{f}"
-            } for f in image_files
-        ]
+        "templates": [t.to_dict() for t in urn_catalog.list()]
     })
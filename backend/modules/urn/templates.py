@@ -0,0 +1,119 @@
+"""
+骨灰罐模擬圖的樣板快取
+樣板底圖（轉 RGBA 並縮放至畫布大小）、對應的 layout、字型與遺像圓形遮罩皆為常數，
+首次使用時載入一次；樣板檔案的修改時間或大小改變時自動重新載入。
+
+碑文字型因授權不隨原始碼提供，部署時需以 URN_FONT_PATH 指向含繁體中文字形的字型
+（如 Microsoft JhengHei 的 msjh.ttc 或 Noto Sans TC），預設為 ./modules/urn/fonts/msjh.ttc。
+字型缺少中文字形時拒絕渲染，避免把整排缺字方框寫進渲染快取。
+"""
+
+import os
+import threading
+from functools import lru_cache
+from typing import Dict, NamedTuple, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from .layout_config import URN_LAYOUTS
+
+# 模擬圖畫布大小
+CANVAS_SIZE = (800, 800)
+
+# 碑文字型（需含中文字形）
+FONT_PATH = os.getenv("URN_FONT_PATH", "./modules/urn/fonts/msjh.ttc")
+FONT_SIZE = 28
+
+
+class UrnTemplate(NamedTuple):
+    path: str
+    base: Image.Image  # 已轉為 RGBA 並縮放至 CANVAS_SIZE，請勿直接修改
+    layout: dict
+    mtime_ns: int
+    size: int
+
+
+def layout_for(filename: str) -> dict:
+    """依樣板檔名取得 layout 設定"""
+    key = os.path.basename(filename).strip().lower()
+    layout = URN_LAYOUTS.get(key)
+    if not layout:
+        raise ValueError(f"找不到樣式對應的 layout 設定: {key}")
+    return layout
+
+
+class TemplateCache:
+    """以檔案路徑為鍵的樣板快取，依 mtime 與檔案大小判斷是否失效"""
+
+    def __init__(self):
+        self._templates: Dict[str, UrnTemplate] = {}
+        self._lock = threading.Lock()
+
+    def get(self, urn_path: str) -> UrnTemplate:
+        stat = os.stat(urn_path)
+        cached = self._templates.get(urn_path)
+        if cached and cached.mtime_ns == stat.st_mtime_ns and cached.size == stat.st_size:
+            return cached
+
+        with self._lock:
+            cached = self._templates.get(urn_path)
+            if cached and cached.mtime_ns == stat.st_mtime_ns and cached.size == stat.st_size:
+                return cached
+            template = self._load(urn_path, stat)
+            self._templates[urn_path] = template
+            return template
+
+    def _load(self, urn_path: str, stat: os.stat_result) -> UrnTemplate:
+        layout = layout_for(urn_path)
+        with Image.open(urn_path) as image:
+            base = image.convert("RGBA").resize(CANVAS_SIZE)
+        return UrnTemplate(
+            path=urn_path,
+            base=base,
+            layout=layout,
+            mtime_ns=stat.st_mtime_ns,
+            size=stat.st_size,
+        )
+
+    def invalidate(self, urn_path: str = None) -> None:
+        with self._lock:
+            if urn_path is None:
+                self._templates.clear()
+            else:
+                self._templates.pop(urn_path, None)
+
+
+template_cache = TemplateCache()
+
+
+def _has_cjk_glyphs(font: ImageFont.FreeTypeFont) -> bool:
+    # 缺字時會畫出 .notdef 方框，與私用區字元（必定缺字）的點陣相同
+    missing = font.getmask("\U000F0000")
+    glyph = font.getmask("靈")
+    return glyph.size != missing.size or bytes(glyph) != bytes(missing)
+
+
+@lru_cache(maxsize=8)
+def get_font(size: int = FONT_SIZE, path: str = FONT_PATH) -> ImageFont.FreeTypeFont:
+    """載入並快取碑文字型；檔案不存在或不含中文字形時拋出 RuntimeError"""
+    try:
+        font = ImageFont.truetype(path, size)
+    except OSError as e:
+        raise RuntimeError(f"無法載入碑文字型 {path}，請以 URN_FONT_PATH 指定中文字型") from e
+    if not _has_cjk_glyphs(font):
+        raise RuntimeError(f"碑文字型 {path} 不含中文字形，請以 URN_FONT_PATH 指定中文字型")
+    return font
+
+
+def font_version(path: str = FONT_PATH) -> str:
+    """字型檔的版本識別（檔名、修改時間與大小），換字型時渲染快取隨之失效"""
+    stat = os.stat(path)
+    return f"{os.path.basename(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+@lru_cache(maxsize=16)
+def get_portrait_mask(size: Tuple[int, int]) -> Image.Image:
+    """遺像的圓形遮罩（唯讀共用）"""
+    mask = Image.new("L", size, 0)
+    ImageDraw.Draw(mask).ellipse((0, 0, size[0], size[1]), fill=255)
+    return mask
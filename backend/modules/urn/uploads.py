@@ -0,0 +1,184 @@
+"""
+遺像上傳處理
+上傳大小由 UploadLimitMiddleware 在解析 multipart 之前限制：Content-Length 超過上限時直接回應 413，
+未附 Content-Length（chunked）時邊接收邊計算，超過即中止，不會先把整個請求讀進記憶體或暫存檔。
+依檔頭（magic bytes）判斷格式後直接由 UploadFile 的暫存檔解碼，不另外複製；
+解碼時利用 Pillow 的 draft() 直接以縮小比例解碼 JPEG，
+最後只保存縮小至各 layout 所需最大尺寸的黑白衍生圖（以內容雜湊命名），不保存原始檔；
+保存目錄的總大小以 DirectoryQuota 限制。
+
+環境變數：
+- URN_MAX_UPLOAD_MB：遺像檔案大小上限（預設 10）
+- URN_PORTRAIT_CACHE_MB：遺像衍生圖目錄的大小上限（預設 1024）
+"""
+
+import hashlib
+import io
+import os
+from uuid import uuid4
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image, ImageOps
+
+from .disk_quota import DirectoryQuota
+from .layout_config import URN_LAYOUTS
+from ..metrics import span
+
+# 上傳大小上限（位元組）
+MAX_UPLOAD_BYTES = int(os.getenv("URN_MAX_UPLOAD_MB", "10")) * 1024 * 1024
+PORTRAIT_CACHE_BYTES = int(os.getenv("URN_PORTRAIT_CACHE_MB", "1024")) * 1024 * 1024
+# 解碼像素上限，防止解壓縮炸彈
+MAX_IMAGE_PIXELS = 50_000_000
+# multipart 請求中除圖片外的表單欄位與邊界所容許的額外大小
+FORM_OVERHEAD_BYTES = 64 * 1024
+# 受上傳大小限制的路由（POST）
+UPLOAD_PATHS = ("/api/urns",)
+
+# 支援的圖片格式：檔頭 → Pillow 格式名稱
+MAGIC_BYTES = {
+    b"\xff\xd8\xff": "JPEG",
+    b"\x89PNG\r\n\x1a\n": "PNG",
+}
+
+
+def max_portrait_size() -> int:
+    """所有 layout 中遺像需要的最大邊長"""
+    return max(layout["portrait"]["size"] for layout in URN_LAYOUTS.values())
+
+
+def detect_format(header: bytes) -> Optional[str]:
+    """依檔頭判斷圖片格式"""
+    for magic, fmt in MAGIC_BYTES.items():
+        if header.startswith(magic):
+            return fmt
+    return None
+
+
+def _too_large(max_bytes: int) -> str:
+    return f"圖片檔案過大，上限為 {max_bytes // (1024 * 1024)} MB"
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware：在 multipart 解析前限制上傳路由的請求大小。
+    Content-Length 超過上限時不讀取請求內容直接回應 413；
+    沒有 Content-Length 時包裝 receive 累計已接收的位元組，超過上限即以 413 中止。
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES, paths=UPLOAD_PATHS):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.limit = max_bytes + FORM_OVERHEAD_BYTES
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or not scope["path"].startswith(self.paths)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        for key, value in scope.get("headers", ()):
+            if key == b"content-length":
+                try:
+                    too_large = int(value) > self.limit
+                except ValueError:
+                    too_large = False
+                if too_large:
+                    response = JSONResponse({"detail": _too_large(self.max_bytes)}, status_code=413)
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    raise HTTPException(status_code=413, detail=_too_large(self.max_bytes))
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def read_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES):
+    """
+    檢查上傳檔案的大小與格式，回傳 (已定位至開頭的 UploadFile 暫存檔, 圖片格式)。
+    整個請求的大小已由 UploadLimitMiddleware 限制，這裡只確認圖片本身未超過 max_bytes。
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=_too_large(max_bytes))
+    header = await file.read(16)
+    if not header:
+        raise HTTPException(status_code=400, detail="上傳的圖片是空的")
+    fmt = detect_format(header)
+    if fmt is None:
+        raise HTTPException(status_code=415, detail="不支援的圖片格式")
+    await file.seek(0)
+    return file.file, fmt
+
+
+@span("urn.normalize_portrait")
+def normalize_portrait(stream, fmt: str, target: int) -> bytes:
+    """
+    解碼並縮小遺像，回傳 PNG 編碼的黑白衍生圖。
+    短邊縮至 target（不放大），長寬比保持不變，交由各 layout 再縮放。
+    """
+    try:
+        with Image.open(stream, formats=[fmt]) as image:
+            width, height = image.size
+            if width * height > MAX_IMAGE_PIXELS:
+                raise HTTPException(status_code=413, detail="圖片解析度過高")
+            # JPEG 可直接以 1/2、1/4、1/8 比例解碼，大幅減少解碼時間與記憶體
+            image.draft("L", (target, target))
+            image = ImageOps.exif_transpose(image).convert("L")
+    except HTTPException:
+        raise
+    except (OSError, SyntaxError, Image.DecompressionBombError):
+        raise HTTPException(status_code=415, detail="無法解析圖片內容")
+
+    width, height = image.size
+    scale = target / min(width, height)
+    if scale < 1:
+        image = image.resize(
+            (max(target, round(width * scale)), max(target, round(height * scale))),
+            Image.Resampling.LANCZOS
+        )
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+async def save_portrait(file: UploadFile, target_dir: str, quota: Optional[DirectoryQuota] = None) -> str:
+    """檢查上傳的遺像，只保存正規化後的衍生圖，回傳以內容雜湊命名的檔名"""
+    stream, fmt = await read_upload(file)
+    # 解碼、縮放與寫檔皆為阻塞操作，移出事件迴圈
+    return await run_in_threadpool(_store_portrait, stream, fmt, target_dir, quota)
+
+
+def _store_portrait(stream, fmt: str, target_dir: str, quota: Optional[DirectoryQuota] = None) -> str:
+    # stream 為 UploadFile 的暫存檔，由 FastAPI 於請求結束時關閉
+    data = normalize_portrait(stream, fmt, max_portrait_size())
+
+    filename = f"{hashlib.sha256(data).hexdigest()}.png"
+    path = os.path.join(target_dir, filename)
+    if os.path.exists(path):
+        if quota is not None:
+            quota.touch(path)
+        return filename
+    tmp = f"{path}.{uuid4().hex}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    if quota is not None:
+        quota.added(len(data))
+    return filename
@@ -1,25 +1,235 @@
 import os
 import logging
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, Settings, StorageContext, load_index_from_storage
-from llama_index.core.chat_engine.types import ChatMode
+import threading
+import time
+from typing import List, Optional
+import httpx
+from llama_index.core import VectorStoreIndex, Settings, StorageContext, load_index_from_storage
+from llama_index.core.chat_engine import CondensePlusContextChatEngine
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.llms import ChatMessage, MessageRole
 from llama_index.embeddings.text_embeddings_inference import TextEmbeddingsInference
 from llama_index.llms.google_genai import GoogleGenAI
-from llama_index.core.postprocessor import LongContextReorder, SentenceEmbeddingOptimizer
-from google.genai.types import GenerateContentConfig
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.instrumentation.events.retrieval import RetrievalStartEvent, RetrievalEndEvent
+from llama_index.core.instrumentation.events.embedding import EmbeddingStartEvent, EmbeddingEndEvent
+from llama_index.core.instrumentation.events.synthesis import SynthesizeStartEvent, SynthesizeEndEvent
+from llama_index.core.instrumentation.events.exception import ExceptionEvent
+from llama_index.core.instrumentation.events.chat_engine import StreamChatErrorEvent
+from llama_index.core.instrumentation.events.llm import (
+    LLMCompletionStartEvent,
+    LLMCompletionEndEvent,
+    LLMChatStartEvent,
+    LLMChatEndEvent,
+)
+from google.genai.types import GenerateContentConfig, HttpOptions
+from pydantic import PrivateAttr
+from modules.metrics import current_span, record_stage, span
+from modules.shared_state import get_shared_store
+from modules.singleflight import SingleFlight, make_key
+from modules.embedding_batcher import EmbeddingBatcher
+from modules.vector_store import DEFAULT_PERSIST_FNAME, MemmapVectorStore
+from modules.ingestion import load_asset_nodes
+from modules.hybrid_retriever import HYBRID_CANDIDATES, RAG_TOP_K, HybridRetriever
+from modules.context_budget import ContextCompressor, compact_history, token_report
+from modules.llm_gateway import GatedTransport, Priority, get_gateway, llm_priority, run_in_llm_threadpool
 
 # 設定日誌
 logger = logging.getLogger(__name__)
 
+
+# LlamaIndex 開始事件 → 階段名稱
+_RAG_STAGES = {
+    RetrievalStartEvent: "rag.retrieve",
+    EmbeddingStartEvent: "tei.embed",
+    SynthesizeStartEvent: "rag.generate",
+    LLMCompletionStartEvent: "llm.complete",
+    LLMChatStartEvent: "llm.chat",
+}
+_RAG_END_EVENTS = (RetrievalEndEvent, EmbeddingEndEvent, SynthesizeEndEvent, LLMCompletionEndEvent, LLMChatEndEvent)
+# 發生例外時不會有結束事件；例外會一路拋出，同一執行緒上未結束的階段（含外層的生成）一併丟棄
+_RAG_ERROR_EVENTS = (ExceptionEvent, StreamChatErrorEvent)
+# 仍有未配對的開始紀錄超過此數量時，清除逾時（秒）未結束者；其餘沒有錯誤事件的中斷（如取消）靠此回收
+_MAX_PENDING_STAGES = 1024
+_PENDING_STAGE_TTL = 600
+
+
+class StageTimingHandler(BaseEventHandler):
+    """
+    將 LlamaIndex 的事件轉為階段耗時：檢索（rag.retrieve）、生成（rag.generate）、
+    TEI 嵌入（tei.embed）與 LLM 呼叫。在 rag.chat 之內、生成之外的 LLM 呼叫即為問題改寫（rag.condense）。
+    開始與結束事件以 span_id 配對；沒有等到結束事件的紀錄於錯誤事件或逾時後清除。
+    """
+
+    # span_id → (階段名稱, 開始時間, 執行緒 id)
+    _starts: dict = PrivateAttr(default_factory=dict)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _local: threading.local = PrivateAttr(default_factory=threading.local)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "StageTimingHandler"
+
+    def handle(self, event, **kwargs):
+        stage = _RAG_STAGES.get(type(event))
+        if stage is not None:
+            synthesizing = getattr(self._local, "synthesizing", 0)
+            if stage == "rag.generate":
+                self._local.synthesizing = synthesizing + 1
+            elif stage.startswith("llm.") and not synthesizing and current_span() == "rag.chat":
+                stage = "rag.condense"
+            now = time.perf_counter()
+            with self._lock:
+                self._starts[event.span_id] = (stage, now, threading.get_ident())
+                if len(self._starts) > _MAX_PENDING_STAGES:
+                    self._prune(now)
+        elif isinstance(event, _RAG_ERROR_EVENTS):
+            thread = threading.get_ident()
+            with self._lock:
+                for span_id in [key for key, entry in self._starts.items() if entry[2] == thread]:
+                    del self._starts[span_id]
+            self._local.synthesizing = 0
+        elif isinstance(event, _RAG_END_EVENTS):
+            with self._lock:
+                started = self._starts.pop(event.span_id, None)
+            if started is None:
+                return
+            stage, start, _ = started
+            if stage == "rag.generate":
+                self._local.synthesizing = max(getattr(self._local, "synthesizing", 1) - 1, 0)
+            record_stage(stage, time.perf_counter() - start)
+
+    def _prune(self, now: float) -> None:
+        """清除逾時未結束的開始紀錄（呼叫端需持有鎖）"""
+        stale = [span_id for span_id, (_, start, _) in self._starts.items() if now - start > _PENDING_STAGE_TTL]
+        for span_id in stale:
+            del self._starts[span_id]
+
+
+get_dispatcher().add_event_handler(StageTimingHandler())
+
 # 全局變數來存儲共享的索引和引擎
 _shared_index = None
 _shared_embed_model = None
 _shared_llm = None
 
-_LCR = None
-_SEO = None
+# 每個 session 保留的對話訊息數與存活秒數
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "20"))
+CHAT_SESSION_TTL = int(os.getenv("CHAT_SESSION_TTL", str(24 * 3600)))
+
+# 相同的 LLM 請求（同一 session 的同一則訊息、相同的單輪問題或解析內容）同時只呼叫一次
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+llm_flight = SingleFlight("llm", timeout=LLM_TIMEOUT)
 
 # 持久化存儲路徑
-PERSIST_DIR = "./storage"
+PERSIST_DIR = os.getenv("RAG_STORAGE_DIR", "./storage")
+# 知識文件路徑
+ASSETS_DIR = os.getenv("RAG_ASSETS_DIR", "./assets/")
+
+LLM_MODEL = "gemini-2.5-flash"
+# TEI 與 Gemini 的服務位址，基準測試與壓力測試時可改指向本機的替身伺服器
+TEI_BASE_URL = os.getenv("TEI_BASE_URL", "http://embeddings-inference:80")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+
+class GatedTextEmbeddingsInference(TextEmbeddingsInference):
+    """
+    經過 TEI Gateway 送出請求的嵌入模型；共用同一個連線池，上游錯誤直接拋出而不是當成嵌入結果。
+    少量文字（問題改寫、句子篩選）的請求交由 EmbeddingBatcher 與其他使用者的請求合併並快取，
+    建索引時的整批請求則直接送出（仍會查詢與寫入快取）。
+    """
+
+    _client: Optional[httpx.Client] = PrivateAttr(default=None)
+    _client_pid: Optional[int] = PrivateAttr(default=None)
+    _client_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _batcher: EmbeddingBatcher = PrivateAttr()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._batcher = EmbeddingBatcher(self._post_embed, max_batch=self.embed_batch_size)
+
+    def _http_client(self) -> httpx.Client:
+        # preload 模式下 master 建立的連線池不可在 worker 中沿用，以 pid 判斷是否需要重新建立
+        if self._client_pid != os.getpid():
+            with self._client_lock:
+                if self._client_pid != os.getpid():
+                    self._client = httpx.Client(
+                        transport=GatedTransport(get_gateway("tei", self.model_name or "default"))
+                    )
+                    self._client_pid = os.getpid()
+        return self._client
+
+    @property
+    def batcher(self) -> EmbeddingBatcher:
+        return self._batcher
+
+    def _post_embed(self, texts: List[str]) -> List[List[float]]:
+        response = self._http_client().post(
+            f"{self.base_url}{self.endpoint}",
+            json={"inputs": texts, "truncate": self.truncate_text},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def _call_api(self, texts: List[str]) -> List[List[float]]:
+        if len(texts) >= self._batcher.max_batch:
+            return self._batcher.embed_direct(texts)
+        return self._batcher.embed(texts)
+
+    async def _acall_api(self, texts: List[str]) -> List[List[float]]:
+        return await run_in_llm_threadpool(self._call_api, texts)
+
+def create_embed_model():
+    """建立 TEI 嵌入模型"""
+    return GatedTextEmbeddingsInference(
+        model_name=os.getenv("EMBEDDING_MODEL_ID"),
+        base_url=TEI_BASE_URL,
+        embed_batch_size=32
+    )
+
+def create_llm(generation_config: GenerateContentConfig = None):
+    """
+    建立 Gemini LLM；設定 GEMINI_BASE_URL 時改連該位址。
+    請求經過 Gemini Gateway（限速、排隊與 429／503 重試），因此關閉 LlamaIndex 本身的重試。
+    """
+    return GoogleGenAI(
+        model=LLM_MODEL,
+        api_key=os.getenv("GEMINI_API_KEY"),
+        http_options=HttpOptions(
+            base_url=GEMINI_BASE_URL,
+            client_args={"transport": GatedTransport(get_gateway("gemini", LLM_MODEL))},
+        ),
+        generation_config=generation_config,
+        max_retries=0
+    )
+
+def embedding_stats() -> dict:
+    """共用嵌入模型的合併與快取統計"""
+    if isinstance(_shared_embed_model, GatedTextEmbeddingsInference):
+        return _shared_embed_model.batcher.stats()
+    return {}
+
+def load_vector_store(persist_dir: str) -> MemmapVectorStore:
+    """載入向量庫；舊版以 JSON 保存的 SimpleVectorStore 會先轉換為矩陣格式並覆寫"""
+    persist_path = os.path.join(persist_dir, DEFAULT_PERSIST_FNAME)
+    if MemmapVectorStore.is_persisted(persist_path):
+        return MemmapVectorStore.from_persist_path(persist_path)
+    logger.info("Converting JSON vector store to memory-mapped format...")
+    vector_store = MemmapVectorStore.from_simple_store(SimpleVectorStore.from_persist_path(persist_path))
+    vector_store.persist(persist_path)
+    return MemmapVectorStore.from_persist_path(persist_path)
+
+def create_retriever(index: VectorStoreIndex):
+    """建立檢索器：向量庫附有倒排索引時使用 BM25 與向量的混合檢索"""
+    vector_store = index.vector_store
+    if os.getenv("HYBRID_RETRIEVAL", "1") == "0" or not isinstance(vector_store, MemmapVectorStore):
+        return index.as_retriever(similarity_top_k=RAG_TOP_K)
+    return HybridRetriever(
+        vector_retriever=index.as_retriever(similarity_top_k=HYBRID_CANDIDATES),
+        lexical_index=vector_store.lexical_index,
+        docstore=index.docstore,
+    )
 
 def initialize_shared_components():
     """初始化共享組件（索引、嵌入模型、LLM）"""
@@ -33,36 +243,29 @@ def initialize_shared_components():
         if not os.path.exists(PERSIST_DIR) or not os.listdir(PERSIST_DIR):
             logger.info("Building new index from documents...")
             
-            # 使用 SimpleDirectoryReader 載入文件
-            reader = SimpleDirectoryReader(input_dir="./assets/")
-            example_docs = reader.load_data()
-            
-            if not example_docs:
+            # 依文件結構（標題、問答、法規條號）切成節點
+            nodes = load_asset_nodes(ASSETS_DIR)
+
+            if not nodes:
                 raise ValueError("No documents found in assets directory")
 
             # 初始化嵌入模型
-            _shared_embed_model = TextEmbeddingsInference(
-                model_name=os.getenv("EMBEDDING_MODEL_ID"),
-                base_url="http://embeddings-inference:80",
-                embed_batch_size=32
-            )
+            _shared_embed_model = create_embed_model()
 
             # 初始化 LLM
-            _shared_llm = GoogleGenAI(
-                model="gemini-2.5-flash",
-                api_key=os.getenv("GEMINI_API_KEY")
-            )
+            _shared_llm = create_llm()
             
             Settings.embed_model = _shared_embed_model
             Settings.llm = _shared_llm
-            Settings.chunk_size = 1024  # 使用較大的分塊大小
-            Settings.chunk_overlap = 100  # 使用較大的重疊
 
-            # 建立向量索引
-            _shared_index = VectorStoreIndex.from_documents(
-                example_docs,
-                show_progress=True
-            )
+            # 建立向量索引；以批次等級送出嵌入請求，不與線上對話搶用 TEI
+            storage_context = StorageContext.from_defaults(vector_store=MemmapVectorStore())
+            with llm_priority(Priority.BATCH):
+                _shared_index = VectorStoreIndex(
+                    nodes,
+                    storage_context=storage_context,
+                    show_progress=True
+                )
             
             # 保存索引到本地存儲
             os.makedirs(PERSIST_DIR, exist_ok=True)
@@ -73,40 +276,131 @@ def initialize_shared_components():
             logger.info("Loading existing index from storage...")
             
             # 初始化嵌入模型（用於加載索引）
-            _shared_embed_model = TextEmbeddingsInference(
-                model_name=os.getenv("EMBEDDING_MODEL_ID"),
-                base_url="http://embeddings-inference:80",
-                embed_batch_size=32
-            )
+            _shared_embed_model = create_embed_model()
 
             # 初始化 LLM
-            _shared_llm = GoogleGenAI(
-                model="gemini-2.5-flash",
-                api_key=os.getenv("GEMINI_API_KEY")
-            )
+            _shared_llm = create_llm()
             
             Settings.embed_model = _shared_embed_model
             Settings.llm = _shared_llm
             
-            # 從本地存儲加載索引
-            storage_context = StorageContext.from_defaults(persist_dir=PERSIST_DIR)
+            # 從本地存儲加載索引；向量以 mmap 載入
+            vector_store = load_vector_store(PERSIST_DIR)
+            storage_context = StorageContext.from_defaults(
+                persist_dir=PERSIST_DIR,
+                vector_store=vector_store
+            )
+            if vector_store.lexical_index.doc_count < vector_store.node_count:
+                logger.info("Building lexical index from docstore...")
+                vector_store.rebuild_lexical_index(
+                    storage_context.docstore, os.path.join(PERSIST_DIR, DEFAULT_PERSIST_FNAME)
+                )
             _shared_index = load_index_from_storage(storage_context)
             
             logger.info("Existing index loaded successfully")
         
-        _LCR = LongContextReorder()
-        _SEO = SentenceEmbeddingOptimizer(embed_model=Settings.embed_model, percentile_cutoff=0.7)
-        
         return _shared_index, _shared_embed_model, _shared_llm
 
     except Exception as e:
         logger.error(f"Error initializing shared components: {str(e)}")
         raise
 
+class SessionChatEngine:
+    """
+    以 session 區分對話紀錄的 CONDENSE_PLUS_CONTEXT 聊天引擎。
+    檢索器與 LLM 為唯讀共用；每次請求從共用儲存載入該 session 的紀錄並建立輕量的引擎，
+    多個 worker 之間的對話狀態因此一致，不同使用者的紀錄也不會混在一起。
+    未帶 session_id 的請求視為單輪對話。
+    檢索結果經 node_postprocessors（去重與 token 預算）處理，過長的對話紀錄先摘要再送出。
+    """
+
+    def __init__(self, name: str, retriever, llm, system_prompt: str, node_postprocessors=None):
+        self.name = name
+        self._retriever = retriever
+        self._llm = llm
+        self._system_prompt = system_prompt
+        self._node_postprocessors = node_postprocessors or []
+
+    def _key(self, session_id: str) -> str:
+        return f"chat:{self.name}:{session_id}"
+
+    def load_history(self, session_id: Optional[str]) -> List[ChatMessage]:
+        if not session_id:
+            return []
+        stored = get_shared_store().get(self._key(session_id)) or []
+        return [ChatMessage.model_validate(message) for message in stored]
+
+    def save_history(self, session_id: str, messages: List[ChatMessage]) -> None:
+        messages = messages[-CHAT_HISTORY_MAX_MESSAGES:]
+        get_shared_store().set(
+            self._key(session_id),
+            [message.model_dump(mode="json") for message in messages],
+            ttl=CHAT_SESSION_TTL
+        )
+
+    def load_compacted_history(self, session_id: Optional[str]) -> List[ChatMessage]:
+        """載入對話紀錄；超過 token 預算時摘要較早的訊息並寫回"""
+        history = self.load_history(session_id)
+        compacted = compact_history(history, self._llm)
+        if compacted is not history:
+            self.save_history(session_id, compacted)
+        return compacted
+
+    def retrieve(self, query: str):
+        """只做檢索，回傳相關的文件片段"""
+        return self._retriever.retrieve(query)
+
+    def retrieve_context(self, query: str):
+        """檢索並去重、裁剪到 token 預算內，回傳要放進提示詞的文件片段"""
+        nodes = self.retrieve(query)
+        for postprocessor in self._node_postprocessors:
+            nodes = postprocessor.postprocess_nodes(nodes, query_str=query)
+        return nodes
+
+    def append_turn(self, session_id: str, user_message: str, assistant_message: str) -> None:
+        """將一輪問答附加到該 session 的對話紀錄"""
+        history = self.load_history(session_id)
+        history.append(ChatMessage(role=MessageRole.USER, content=user_message))
+        history.append(ChatMessage(role=MessageRole.ASSISTANT, content=assistant_message))
+        self.save_history(session_id, history)
+
+    def chat(self, message: str, session_id: Optional[str] = None):
+        with token_report():
+            engine = CondensePlusContextChatEngine.from_defaults(
+                retriever=self._retriever,
+                llm=self._llm,
+                chat_history=self.load_compacted_history(session_id),
+                system_prompt=self._system_prompt,
+                node_postprocessors=self._node_postprocessors
+            )
+            response = engine.chat(message)
+        if session_id:
+            self.save_history(session_id, engine.chat_history)
+        return response
+
+    def _chat_text(self, message: str, session_id: Optional[str]) -> str:
+        with span("rag.chat"):
+            return str(self.chat(message, session_id=session_id))
+
+    async def achat(self, message: str, session_id: Optional[str] = None) -> str:
+        """
+        在執行緒中呼叫 chat（不阻塞事件迴圈），並合併同時送出的相同請求；回傳回覆文字。
+        等待超過 LLM_TIMEOUT 秒時拋出 asyncio.TimeoutError。
+        """
+        return await llm_flight.do(
+            make_key(self.name, session_id, message),
+            lambda: run_in_llm_threadpool(self._chat_text, message, session_id),
+        )
+
+    def reset(self, session_id: Optional[str] = None) -> None:
+        if session_id:
+            get_shared_store().delete(self._key(session_id))
+
 def create_rag_engine(
     system_prompt: str,
     temperature: float = 0.8,
-    max_output_tokens: int = None
+    max_output_tokens: int = None,
+    name: str = "rag"
 ):
     """
     基於共享組件創建 RAG 引擎
@@ -115,30 +409,28 @@ def create_rag_engine(
         system_prompt: 系統提示詞
         temperature: 生成溫度 (0.0-1.0)
         max_output_tokens: 最大輸出 token 數
+        name: 引擎名稱，用於區分各引擎的對話紀錄
     """
     try:
         # 獲取共享組件
         index, embed_model, base_llm = initialize_shared_components()
         
         # 創建具有特定配置的 LLM
-        llm = GoogleGenAI(
-            model="gemini-2.5-flash",
-            api_key=os.getenv("GEMINI_API_KEY"),
+        llm = create_llm(
             generation_config=GenerateContentConfig(
                 temperature=temperature,
                 max_output_tokens=max_output_tokens
             )
         )
-        # 建立聊天引擎
-        query_engine = index.as_chat_engine(
+        # 建立聊天引擎（對話紀錄依 session 存放於共用儲存）
+        return SessionChatEngine(
+            name=name,
+            retriever=create_retriever(index),
             llm=llm,
-            chat_mode=ChatMode.CONDENSE_PLUS_CONTEXT,
             system_prompt=system_prompt,
-            postprocessors=[_LCR, _SEO]
+            node_postprocessors=[ContextCompressor(embed_model=embed_model)]
         )
 
-        return query_engine
-
     except Exception as e:
         logger.error(f"Error creating RAG engine: {str(e)}")
         raise
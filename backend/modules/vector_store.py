@@ -0,0 +1,304 @@
+"""
+以 NumPy 陣列儲存的向量庫，取代 LlamaIndex 預設以 JSON 文字保存向量的 SimpleVectorStore
+
+- 向量正規化後存成連續的 float32（或 int8 量化）矩陣，以 .npy 格式寫入磁碟，
+  啟動時以 mmap 載入，不需解析 JSON；gunicorn 的多個 worker 透過 page cache 共用同一份資料
+- 節點 id、ref_doc_id 與 metadata 另存於 JSON（不含向量）
+- 查詢以一次矩陣乘積計算所有相似度，再以 argpartition 取前 k 名
+- 新增或刪除節點時同步更新 bigram 倒排索引（modules/lexical_index.py），供混合檢索使用
+- int8 模式以每列一個縮放係數量化，檔案與記憶體約為 float32 的四分之一
+
+檔案（以 persist_path 為 <dir>/default__vector_store.json 為例）：
+- default__vector_store.json：ids、ref_doc_ids、metadata、dtype
+- default__vector_store.npy：向量矩陣
+- default__vector_store.scales.npy：int8 模式的每列縮放係數
+- default__lexical_index.json：bigram 倒排索引
+
+環境變數：
+- VECTOR_STORE_DTYPE：float32（預設）或 int8
+"""
+
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.vector_stores.simple import SimpleVectorStore, _build_metadata_filter_fn
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+
+from modules.lexical_index import LexicalIndex
+
+logger = logging.getLogger(__name__)
+
+DTYPES = ("float32", "int8")
+DEFAULT_PERSIST_FNAME = "default__vector_store.json"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _quantize(vectors: np.ndarray):
+    """每列以 max|x| / 127 為縮放係數量化為 int8"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def _sidecar_paths(persist_path: str):
+    stem = persist_path[:-len(".json")] if persist_path.endswith(".json") else persist_path
+    return f"{stem}.npy", f"{stem}.scales.npy"
+
+
+def _lexical_path(persist_path: str) -> str:
+    directory, name = os.path.split(persist_path)
+    return os.path.join(directory, name.replace("vector_store", "lexical_index"))
+
+
+def _atomic_save(path: str, array: np.ndarray) -> None:
+    # 先寫入暫存檔再取代，讀取中的 mmap 不受影響
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+class MemmapVectorStore(BasePydanticVectorStore):
+    """以 NumPy 矩陣保存向量的向量庫；只保存向量與 metadata，節點內容仍在 docstore"""
+
+    stores_text: bool = False
+    dtype: str = "float32"
+
+    _ids: List[str] = PrivateAttr(default_factory=list)
+    _ref_doc_ids: List[Optional[str]] = PrivateAttr(default_factory=list)
+    _metadata: List[Dict[str, Any]] = PrivateAttr(default_factory=list)
+    _positions: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _vectors: Optional[np.ndarray] = PrivateAttr(default=None)
+    _scales: Optional[np.ndarray] = PrivateAttr(default=None)
+    _lexical: LexicalIndex = PrivateAttr(default_factory=LexicalIndex)
+
+    def __init__(self, dtype: Optional[str] = None, **kwargs: Any):
+        dtype = dtype or os.getenv("VECTOR_STORE_DTYPE", "float32")
+        if dtype not in DTYPES:
+            raise ValueError(f"不支援的向量型別: {dtype}")
+        super().__init__(dtype=dtype, **kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MemmapVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def lexical_index(self) -> LexicalIndex:
+        return self._lexical
+
+    @property
+    def node_count(self) -> int:
+        # 不定義 __len__：StorageContext.from_defaults 以真假值判斷是否傳入向量庫，空的向量庫會被忽略
+        return len(self._ids)
+
+    # ---- 寫入 ----
+
+    def _append(self, ids: List[str], vectors: np.ndarray, ref_doc_ids: List[Optional[str]],
+                metadata: List[Dict[str, Any]]) -> None:
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        if self.dtype == "int8":
+            rows, scales = _quantize(vectors)
+            self._scales = scales if self._scales is None else np.concatenate([self._scales, scales])
+        else:
+            rows = vectors
+        # 載入自磁碟的 mmap 為唯讀，新增時轉為記憶體中的新陣列
+        self._vectors = rows if self._vectors is None else np.concatenate([self._vectors, rows])
+        for node_id in ids:
+            self._positions[node_id] = len(self._ids)
+            self._ids.append(node_id)
+        self._ref_doc_ids.extend(ref_doc_ids)
+        self._metadata.extend(metadata)
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        # 重複加入的節點先移除舊向量
+        existing = {node.node_id for node in nodes if node.node_id in self._positions}
+        if existing:
+            self._keep(lambda node_id: node_id not in existing)
+
+        metadata = []
+        for node in nodes:
+            meta = node_to_metadata_dict(node, remove_text=True, flat_metadata=False)
+            meta.pop("_node_content", None)
+            metadata.append(meta)
+        self._append(
+            [node.node_id for node in nodes],
+            np.array([node.get_embedding() for node in nodes], dtype=np.float32),
+            [node.ref_doc_id for node in nodes],
+            metadata,
+        )
+        for node in nodes:
+            self._lexical.add(node.node_id, node.get_content(metadata_mode=MetadataMode.NONE))
+        return [node.node_id for node in nodes]
+
+    def _keep(self, predicate) -> None:
+        """只保留 predicate(node_id) 為真的列"""
+        mask = np.array([predicate(node_id) for node_id in self._ids], dtype=bool)
+        if mask.all():
+            return
+        self._lexical.remove(node_id for node_id, keep in zip(self._ids, mask) if not keep)
+        self._vectors = self._vectors[mask] if self._vectors is not None else None
+        if self._scales is not None:
+            self._scales = self._scales[mask]
+        self._ids = [node_id for node_id, keep in zip(self._ids, mask) if keep]
+        self._ref_doc_ids = [ref for ref, keep in zip(self._ref_doc_ids, mask) if keep]
+        self._metadata = [meta for meta, keep in zip(self._metadata, mask) if keep]
+        self._positions = {node_id: i for i, node_id in enumerate(self._ids)}
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        refs = dict(zip(self._ids, self._ref_doc_ids))
+        self._keep(lambda node_id: refs[node_id] != ref_doc_id)
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None,
+                     filters: Optional[MetadataFilters] = None, **delete_kwargs: Any) -> None:
+        matches = _build_metadata_filter_fn(self._lookup_metadata, filters)
+        targets = set(node_ids) if node_ids is not None else None
+        self._keep(lambda node_id: not ((targets is None or node_id in targets) and matches(node_id)))
+
+    def clear(self) -> None:
+        self._ids, self._ref_doc_ids, self._metadata, self._positions = [], [], [], {}
+        self._vectors = self._scales = None
+        self._lexical.clear()
+
+    def get(self, text_id: str) -> List[float]:
+        """取得節點的向量（已正規化；int8 模式為還原後的近似值）"""
+        row = self._vectors[self._positions[text_id]].astype(np.float32)
+        if self._scales is not None:
+            row *= self._scales[self._positions[text_id]]
+        return row.tolist()
+
+    # ---- 查詢 ----
+
+    def _lookup_metadata(self, node_id: str) -> Dict[str, Any]:
+        return self._metadata[self._positions[node_id]]
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"不支援的查詢模式: {query.mode}")
+        if self._vectors is None or not self._ids or query.query_embedding is None:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        q = np.asarray(query.query_embedding, dtype=np.float32)
+        q /= np.linalg.norm(q) or 1.0
+        scores = self._vectors @ q
+        if self._scales is not None:
+            scores = scores * self._scales
+
+        # 只在有節點或 metadata 限制時建立遮罩，一般查詢直接對整個矩陣取前 k 名
+        if query.node_ids is not None or query.doc_ids is not None or query.filters is not None:
+            allowed_ids = set(query.node_ids) if query.node_ids is not None else None
+            allowed_docs = set(query.doc_ids) if query.doc_ids is not None else None
+            matches = _build_metadata_filter_fn(self._lookup_metadata, query.filters)
+            mask = np.array([
+                (allowed_ids is None or node_id in allowed_ids)
+                and (allowed_docs is None or ref in allowed_docs)
+                and matches(node_id)
+                for node_id, ref in zip(self._ids, self._ref_doc_ids)
+            ], dtype=bool)
+            scores = np.where(mask, scores, -np.inf)
+            available = int(mask.sum())
+        else:
+            available = len(scores)
+
+        k = min(query.similarity_top_k, available)
+        if k <= 0:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")][:k]
+        return VectorStoreQueryResult(
+            similarities=[float(scores[i]) for i in top],
+            ids=[self._ids[i] for i in top],
+        )
+
+    # ---- 保存與載入 ----
+
+    def persist(self, persist_path: str = os.path.join("./storage", DEFAULT_PERSIST_FNAME), fs=None) -> None:
+        os.makedirs(os.path.dirname(persist_path) or ".", exist_ok=True)
+        vectors_path, scales_path = _sidecar_paths(persist_path)
+        if self._vectors is not None:
+            _atomic_save(vectors_path, np.ascontiguousarray(self._vectors))
+        if self._scales is not None:
+            _atomic_save(scales_path, self._scales)
+        tmp = f"{persist_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "class_name": self.class_name(),
+                "dtype": self.dtype,
+                "ids": self._ids,
+                "ref_doc_ids": self._ref_doc_ids,
+                "metadata": self._metadata,
+            }, f, ensure_ascii=False)
+        os.replace(tmp, persist_path)
+        self._lexical.persist(_lexical_path(persist_path))
+
+    @staticmethod
+    def is_persisted(persist_path: str) -> bool:
+        """persist_path 是否為本向量庫保存的檔案（而非舊版 SimpleVectorStore 的 JSON）"""
+        return os.path.exists(_sidecar_paths(persist_path)[0])
+
+    @classmethod
+    def from_persist_path(cls, persist_path: str, fs=None) -> "MemmapVectorStore":
+        with open(persist_path, encoding="utf-8") as f:
+            data = json.load(f)
+        store = cls(dtype=data["dtype"])
+        store._ids = data["ids"]
+        store._ref_doc_ids = data["ref_doc_ids"]
+        store._metadata = data["metadata"]
+        store._positions = {node_id: i for i, node_id in enumerate(store._ids)}
+        vectors_path, scales_path = _sidecar_paths(persist_path)
+        if store._ids:
+            store._vectors = np.load(vectors_path, mmap_mode="r")
+            if store.dtype == "int8":
+                store._scales = np.load(scales_path)
+        store._lexical = LexicalIndex.load(_lexical_path(persist_path)) or LexicalIndex()
+        return store
+
+    def rebuild_lexical_index(self, docstore, persist_path: str) -> None:
+        """由 docstore 的節點內容重建倒排索引並保存（舊版索引目錄沒有倒排索引時使用）"""
+        self._lexical = LexicalIndex()
+        for node_id in self._ids:
+            node = docstore.get_node(node_id, raise_error=False)
+            if node is not None:
+                self._lexical.add(node_id, node.get_content(metadata_mode=MetadataMode.NONE))
+        self._lexical.persist(_lexical_path(persist_path))
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str, fs=None) -> "MemmapVectorStore":
+        return cls.from_persist_path(os.path.join(persist_dir, DEFAULT_PERSIST_FNAME))
+
+    @classmethod
+    def from_simple_store(cls, simple: SimpleVectorStore, dtype: Optional[str] = None) -> "MemmapVectorStore":
+        """由舊版 SimpleVectorStore 轉換（升級既有的索引目錄時使用）"""
+        store = cls(dtype=dtype)
+        data = simple.data
+        ids = list(data.embedding_dict)
+        if ids:
+            store._append(
+                ids,
+                np.array([data.embedding_dict[node_id] for node_id in ids], dtype=np.float32),
+                [data.text_id_to_ref_doc_id.get(node_id) for node_id in ids],
+                [(data.metadata_dict or {}).get(node_id, {}) for node_id in ids],
+            )
+        return store
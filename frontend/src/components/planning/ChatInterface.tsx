@@ -7,7 +7,7 @@ import { Avatar, AvatarFallback, AvatarImage } from "@/components/ui/avatar";
 import { Send, Video, VideoOff, Mic, MicOff, Loader2 } from "lucide-react";
 import ReactMarkdown from 'react-markdown';
 import remarkGfm from 'remark-gfm';
-import { cn, getBackendUrl } from "@/lib/utils";
+import { cn, getBackendUrl, createSessionId } from "@/lib/utils";
 import { ParsedFormData, Message } from "@/types";
 
 interface ChatInterfaceProps {
@@ -46,6 +46,7 @@ const ChatInterface = ({
     initialConversationHistory || ''
   );
   const scrollRef = useRef<HTMLDivElement>(null);
+  const sessionIdRef = useRef<string>(createSessionId());
   const videoRef = useRef<HTMLVideoElement>(null);
   const audioContextRef = useRef<AudioContext | null>(null);
   const analyserRef = useRef<AnalyserNode | null>(null);
@@ -143,33 +144,9 @@ const ChatInterface = ({
     };
   }, []);
 
-  // Parse conversation after each message
-  const parseConversation = (newMessage: string) => {
-    const updatedConversation = conversationHistory + '\n' + newMessage;
-    setConversationHistory(updatedConversation);
-
-    // Run in background without blocking UI
-    fetch(`${getBackendUrl()}/api/parse-conversation`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify({ conversation_text: updatedConversation })
-    })
-    .then(response => {
-      if (response.ok) {
-        return response.json();
-      }
-      throw new Error('Parse conversation failed');
-    })
-    .then(result => {
-      if (result.success && result.parsed_data && onParsedDataUpdate) {
-        onParsedDataUpdate(result.parsed_data);
-      }
-    })
-    .catch(error => {
-      console.error('Error parsing conversation:', error);
-    });
+  // Keep a plain-text transcript for the parent page
+  const appendConversation = (line: string) => {
+    setConversationHistory(prev => prev + '\n' + line);
   };
 
   const handleSendMessage = async () => {
@@ -184,15 +161,14 @@ const ChatInterface = ({
       setInputMessage('');
       setLoading(true);
       setError(null);
-
-      // Parse conversation with user message (background)
-      parseConversation(`用戶：${inputMessage}`);
+      appendConversation(`用戶：${inputMessage}`);
 
       try {
-        const res = await fetch(`${getBackendUrl()}/api/rag2`, {
+        // One call returns both the reply and the updated form data
+        const res = await fetch(`${getBackendUrl()}/api/chat-turn`, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ message: inputMessage })
+          body: JSON.stringify({ message: inputMessage, session_id: sessionIdRef.current })
         });
         if (!res.ok) throw new Error('AI 回覆失敗');
         const data = await res.json();
@@ -203,9 +179,10 @@ const ChatInterface = ({
           timestamp: new Date()
         };
         setMessages(prev => [...prev, aiResponse]);
-
-        // Parse conversation with AI response (background)
-        parseConversation(`AI：${data.answer}`);
+        appendConversation(`AI：${data.answer}`);
+        if (data.parsed_data && onParsedDataUpdate) {
+          onParsedDataUpdate(data.parsed_data);
+        }
       } catch (e) {
         setError('AI 回覆失敗，請稍後再試');
       } finally {
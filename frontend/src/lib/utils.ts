@@ -13,4 +13,12 @@ export function getBackendUrl(): string {
   
   // In production, use environment variable or fallback
   return import.meta.env.VITE_BACKEND_URL || 'http://localhost:8000'
-}
\ No newline at end of file
+}
+
+// Chat session id so the backend can keep each conversation's history separately
+export function createSessionId(): string {
+  if (typeof crypto !== 'undefined' && typeof crypto.randomUUID === 'function') {
+    return crypto.randomUUID()
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`
+}
@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { Calendar } from "@/components/ui/calendar";
@@ -6,34 +6,60 @@ import { Switch } from "@/components/ui/switch";
 import { Label } from "@/components/ui/label";
 import { ArrowLeft, Calendar as CalendarIcon, Sun, Moon } from "lucide-react";
 import { useNavigate } from "react-router-dom";
-import { format } from "date-fns";
+import { addMonths, format } from "date-fns";
+import { getBackendUrl } from "@/lib/utils";
+
+// 整個月曆畫面的農曆資料：以陽曆日期 (yyyy-MM-dd) 為鍵
+type MonthGrid = Record<string, any>;
+
+const monthKey = (date: Date) => format(date, "yyyy-MM");
 
 const LunarCalendar = () => {
   const navigate = useNavigate();
   const [selectedDate, setSelectedDate] = useState<Date>(new Date());
+  const [viewedMonth, setViewedMonth] = useState<Date>(new Date());
   const [isLunar, setIsLunar] = useState(false);
 
-  // API 農民曆資料
-  const [lunarData, setLunarData] = useState<any | null>(null);
+  // API 農民曆資料（每個月只查詢一次，並預先載入前後月份）
+  const monthCache = useRef<Map<string, Promise<MonthGrid>>>(new Map());
+  const [grids, setGrids] = useState<Record<string, MonthGrid>>({});
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
 
+  const loadMonth = (month: Date): Promise<MonthGrid> => {
+    const key = monthKey(month);
+    let pending = monthCache.current.get(key);
+    if (!pending) {
+      pending = fetch(`${getBackendUrl()}/api/lunar/month?year=${month.getFullYear()}&month=${month.getMonth() + 1}`)
+        .then(res => res.ok ? res.json() : Promise.reject(res))
+        .then(data => {
+          const grid: MonthGrid = {};
+          data.日期.forEach((cell: any) => { grid[cell.日期.solar] = cell; });
+          setGrids(prev => ({ ...prev, [key]: grid }));
+          return grid;
+        });
+      pending.catch(() => monthCache.current.delete(key));
+      monthCache.current.set(key, pending);
+    }
+    return pending;
+  };
+
   useEffect(() => {
-    if (!selectedDate) return;
+    const months = [viewedMonth, selectedDate];
     setLoading(true);
     setError(null);
-    const dateStr = selectedDate.toISOString().slice(0, 10);
-    fetch(`http://localhost:8000/api/lunar?date=${dateStr}`)
-      .then(res => res.ok ? res.json() : Promise.reject(res))
-      .then(data => {
-        setLunarData(data);
-        setLoading(false);
-      })
+    Promise.all(months.map(loadMonth))
+      .then(() => setLoading(false))
       .catch(() => {
         setError('查詢失敗，請稍後再試');
         setLoading(false);
       });
-  }, [selectedDate]);
+    // 預先載入前後月份，切換月份時不必等待
+    [addMonths(viewedMonth, -1), addMonths(viewedMonth, 1)].forEach(month => loadMonth(month).catch(() => undefined));
+  }, [viewedMonth, selectedDate]);
+
+  const selectedKey = format(selectedDate, "yyyy-MM-dd");
+  const lunarData = Object.values(grids).find(grid => grid[selectedKey])?.[selectedKey] ?? null;
 
   return (
     <div className="grid grid-cols-1 lg:grid-cols-2 gap-8">
@@ -49,6 +75,8 @@ const LunarCalendar = () => {
             mode="single"
             selected={selectedDate}
             onSelect={(date) => date && setSelectedDate(date)}
+            month={viewedMonth}
+            onMonthChange={setViewedMonth}
             className="rounded-md border pointer-events-auto mx-auto"
           />
           <div className="mt-4 p-3 bg-muted rounded-lg">
@@ -5,7 +5,7 @@ import { useNavigate, useLocation } from "react-router-dom";
 import { format, addDays, differenceInYears, startOfMonth, endOfMonth, isSameDay } from "date-fns";
 import { OverviewCalendar } from "@/components/overview/OverviewCalendar";
 import { SidebarTrigger } from "@/components/ui/sidebar";
-import { useEffect, useState, useMemo } from "react";
+import { useEffect, useState, useMemo, useRef } from "react";
 import { getBackendUrl } from "@/lib/utils";
 import { SummaryCard } from "@/components/overview/SummaryCard";
 import { TimelineCard } from "@/components/overview/TimelineCard";
@@ -48,6 +48,8 @@ const Overview = () => {
   const [auspiciousDays, setAuspiciousDays] = useState<AuspiciousDay[]>([]);
   const [isLoading, setIsLoading] = useState(true);
   const [selectedCustomDates, setSelectedCustomDates] = useState<{ [key: string]: string }>({});
+  // 已查詢過的月份，切回同一個月時不再重新掃描
+  const scannedMonths = useRef<Set<string>>(new Set());
 
   useEffect(() => {
     const fetchAuspiciousDays = async () => {
@@ -56,6 +58,13 @@ const Overview = () => {
         return;
       }
 
+      const monthKey = format(viewedMonth, "yyyy-MM");
+      if (scannedMonths.current.has(monthKey)) {
+        setIsLoading(false);
+        return;
+      }
+      scannedMonths.current.add(monthKey);
+
       setIsLoading(true);
       try {
         const requestBody = {
@@ -95,6 +104,7 @@ const Overview = () => {
         });
 
       } catch (error) {
+        scannedMonths.current.delete(monthKey);
         console.error("Error fetching auspicious days:", error);
       } finally {
         setIsLoading(false);
@@ -34,7 +34,7 @@ const UrnSimulator = () => {
   const [photoPreview, setPhotoPreview] = useState<string | null>(null);
   const [loading, setLoading] = useState(false);
   const [isDownloading, setIsDownloading] = useState(false);
-  const [generatedDesignBase64, setGeneratedDesignBase64] = useState<string | null>(null);
+  const [generatedDesignUrl, setGeneratedDesignUrl] = useState<string | null>(null);
   const [formData, setFormData] = useState<UrnFormData>({
     deceased_name: "",
     birth_date: "",
@@ -134,7 +134,7 @@ const UrnSimulator = () => {
 
       if (response.ok) {
         const result = await response.json();
-        setGeneratedDesignBase64(result.data.design_image_base64);
+        setGeneratedDesignUrl(`${getBackendUrl()}${result.data.design_image_url}`);
         
         toast({
           title: "成功",
@@ -157,23 +157,22 @@ const UrnSimulator = () => {
   };
 
   const downloadDesign = async () => {
-    if (generatedDesignBase64 && !isDownloading) {
+    if (generatedDesignUrl && !isDownloading) {
       setIsDownloading(true);
       try {
-        // 將 base64 轉換為 blob
-        const byteCharacters = atob(generatedDesignBase64);
-        const byteNumbers = new Array(byteCharacters.length);
-        for (let i = 0; i < byteCharacters.length; i++) {
-          byteNumbers[i] = byteCharacters.charCodeAt(i);
+        // 模擬圖已由瀏覽器快取，直接取得 blob
+        const response = await fetch(generatedDesignUrl);
+        if (!response.ok) {
+          throw new Error('下載失敗');
         }
-        const byteArray = new Uint8Array(byteNumbers);
-        const blob = new Blob([byteArray], { type: 'image/png' });
+        const blob = await response.blob();
+        const extension = generatedDesignUrl.split('.').pop();
         
         const url = window.URL.createObjectURL(blob);
         
         const link = document.createElement('a');
         link.href = url;
-        link.download = `${formData.deceased_name || 'design'}_骨灰罈設計.png`;
+        link.download = `${formData.deceased_name || 'design'}_骨灰罈設計.${extension}`;
         
         document.body.appendChild(link);
         link.click();
@@ -340,8 +339,8 @@ const UrnSimulator = () => {
             <div>
               <h3 className="text-lg font-medium mb-3">預覽效果</h3>
               <div className="aspect-square bg-muted/50 rounded-lg overflow-hidden flex items-center justify-center">
-                {generatedDesignBase64 ? (
-                  <img src={`data:image/png;base64,${generatedDesignBase64}`} alt="生成的骨灰罈設計" className="w-full h-full object-contain" />
+                {generatedDesignUrl ? (
+                  <img src={generatedDesignUrl} alt="生成的骨灰罈設計" className="w-full h-full object-contain" />
                 ) : selectedUrnTemplate ? (
                   <img src={`${getBackendUrl()}${selectedUrnTemplate.url}`} alt={selectedUrnTemplate.name} className="w-full h-full object-contain" />
                 ) : (
@@ -353,13 +352,13 @@ const UrnSimulator = () => {
               </div>
             </div>
             <div className="mt-6 flex justify-center gap-4">
-              {generatedDesignBase64 ? (
+              {generatedDesignUrl ? (
                 <>
                   <Button variant="outline" className="flex items-center gap-2" onClick={downloadDesign} disabled={isDownloading}>
                     {isDownloading ? <Loader2 className="w-4 h-4 animate-spin" /> : <Download className="w-4 h-4" />}
                     {isDownloading ? "下載中..." : "下載設計圖"}
                   </Button>
-                  <Button variant="outline" onClick={() => setGeneratedDesignBase64(null)} disabled={isDownloading}>
+                  <Button variant="outline" onClick={() => setGeneratedDesignUrl(null)} disabled={isDownloading}>
                     重新設計
                   </Button>
                 </>